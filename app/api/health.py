@@ -4,6 +4,7 @@ from app.models import HealthResponse
 from app.database.vector_store import vector_store
 from app.database.metadata_store import metadata_store
 from app.core.cache import cache_manager
+from app.core.hybrid_search import hybrid_search
 from app.config import settings
 
 router = APIRouter()
@@ -42,6 +43,8 @@ async def get_stats():
     return {
         "total_documents": metadata_store.count(),
         "total_chunks": vector_store.count(),
+        "shards": vector_store.shard_stats(),
+        "sparse_index": hybrid_search.index.stats(),
         "cache_stats": cache_manager.stats(),
         "settings": {
             "chunk_size": settings.chunk_size,
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+import hashlib
 import time
-from app.models import QueryRequest, QueryResponse, RetrievalResult, FileType
+from typing import Any, Dict, List, Optional
+from app.models import (
+    QueryRequest, QueryResponse, RetrievalResult, FileType,
+    BatchQueryRequest, BatchQueryResponse, CollectionRebuildRequest
+)
 from app.core.retrieval import retrieval_system
 from app.core.hybrid_search import hybrid_search
 from app.core.reranking import reranker
+from app.core.embeddings import text_embedder
+from app.core.cache import cache_manager
+from app.database.vector_store import vector_store
 from app.utils.guardrails import guardrails
 from app.utils.logging_config import log
 from app.tracing.tracer import tracer, trace_operation
@@ -11,10 +19,70 @@ from app.config import settings
 
 router = APIRouter()
 
+FILE_TYPE_MAP = {
+    'text': FileType.TEXT,
+    'image': FileType.IMAGE,
+    'pdf': FileType.PDF,
+    'docx': FileType.DOCX,
+    'xlsx': FileType.XLSX
+}
+
+
+def to_retrieval_results(results: List[Dict[str, Any]]) -> List[RetrievalResult]:
+    retrieval_results = []
+    for result in results:
+        retrieval_results.append(RetrievalResult(
+            document_id=result.get('document_id', 'unknown'),
+            chunk_id=result['chunk_id'],
+            content=result['content'],
+            score=result.get('rerank_score', result['score']),
+            file_type=FILE_TYPE_MAP.get(result.get('file_type'), FileType.TEXT),
+            filename=result.get('filename', 'unknown'),
+            metadata=result.get('metadata', {}),
+            chunk_index=result.get('chunk_index', 0)
+        ))
+    return retrieval_results
+
+
+def semantic_cache_embedding(query: str) -> Optional[List[float]]:
+    if not cache_manager.semantic_enabled:
+        return None
+    try:
+        # Embeddings are cached, so on a miss the dense leg reuses this one instead of embedding again
+        return text_embedder.embed_text(query)
+    except Exception as e:
+        # Hybrid search still has its sparse leg when embedding fails, so the lookup is skipped rather than raised
+        log.warning(f"Semantic cache lookup skipped: {e}")
+        return None
+
+
+def body_etag(body: bytes) -> str:
+    # Strong validators must change whenever the bytes do, so the tag hashes the body rather than the request
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def replay_body(response: QueryResponse) -> bytes:
+    # Hits replay these bytes, so per-request measurements are dropped rather than repeated from fill time
+    return response.model_copy(update={'processing_time': 0.0, 'timings': None}).model_dump_json().encode()
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def json_response(body: bytes, etag: Optional[str], cache_status: str) -> Response:
+    headers = {"X-Cache": cache_status}
+    if etag:
+        headers["ETag"] = etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
 @router.post("/query", response_model=QueryResponse)
 @trace_operation("query_execution")
-async def query_documents(request: QueryRequest):
+async def query_documents(request: QueryRequest, http_request: Request, x_tenant_id: Optional[str] = Header(default=None)):
     start_time = time.time()
     
     try:
@@ -30,62 +98,104 @@ async def query_documents(request: QueryRequest):
         if request.file_types:
             file_type_filter = [ft.value for ft in request.file_types]
         
+        retrieval_method = "hybrid" if settings.enable_hybrid_search else "dense"
+        reranked = bool(request.enable_reranking and settings.enable_reranking)
+        # Every parameter that can change the response; the index generation is added to the fingerprint
+        scope = {
+            'file_types': sorted(file_type_filter) if file_type_filter else None,
+            'top_k': request.top_k,
+            'similarity_threshold': request.similarity_threshold,
+            'search_effort': request.search_effort,
+            'fusion': request.fusion.value if request.fusion else None,
+            'retrieval_method': retrieval_method,
+            'reranked': reranked,
+            'tenant': x_tenant_id
+        }
+        
+        # Read once, so a write landing mid-request can never file pre-write results under the new generation
+        generation = vector_store.applied_generation()
+        # Hot queries skip retrieval, fusion, reranking and serialization entirely
+        fingerprint = cache_manager.response_fingerprint(sanitized_query, scope, generation)
+        cached_body = cache_manager.get_response(fingerprint)
+        if cached_body is not None:
+            etag = body_etag(cached_body)
+            tracer.log_step("response_cache_hit", {"etag": etag})
+            if etag_matches(etag, http_request.headers.get("if-none-match")):
+                return Response(status_code=304, headers={"ETag": etag})
+            return json_response(cached_body, etag, "hit")
+        
+        # Reworded questions land close to an earlier one in embedding space
+        query_embedding = semantic_cache_embedding(sanitized_query)
+        cached_results = None
+        if query_embedding is not None:
+            cached_results = cache_manager.get_semantic_result(query_embedding, scope, generation)
+        if cached_results is not None:
+            tracer.log_step("semantic_cache_hit", {"num_results": len(cached_results)})
+            response = QueryResponse(
+                success=True,
+                query=sanitized_query,
+                results=cached_results,
+                total_results=len(cached_results),
+                processing_time=time.time() - start_time,
+                retrieval_method=retrieval_method,
+                reranked=reranked
+            )
+            stored = replay_body(response)
+            cache_manager.set_response(fingerprint, stored)
+            # Weak tag: this body differs from the stored one only in its timing fields
+            return json_response(response.model_dump_json().encode(), f"W/{body_etag(stored)}", "semantic")
+        
+        timings = None
         if settings.enable_hybrid_search:
-            results = hybrid_search.hybrid_retrieve(
+            results, timings = hybrid_search.hybrid_retrieve_timed(
                 query=sanitized_query,
                 top_k=request.top_k,
-                file_types=file_type_filter
+                file_types=file_type_filter,
+                search_ef=request.search_effort,
+                fusion=request.fusion.value if request.fusion else None,
+                tenant=x_tenant_id
             )
-            retrieval_method = "hybrid"
         else:
             results = retrieval_system.retrieve(
                 query=sanitized_query,
                 top_k=request.top_k,
                 file_types=file_type_filter,
-                similarity_threshold=request.similarity_threshold
+                similarity_threshold=request.similarity_threshold,
+                search_ef=request.search_effort,
+                tenant=x_tenant_id
             )
-            retrieval_method = "dense"
-        
-        tracer.log_step("retrieval_complete", {"num_results": len(results)})
-        
-        reranked = False
-        if request.enable_reranking and settings.enable_reranking:
-            results = reranker.rerank(sanitized_query, results)
-            reranked = True
-            tracer.log_step("reranking_complete", {"num_results": len(results)})
-        
-        file_type_map = {
-            'text': FileType.TEXT,
-            'image': FileType.IMAGE,
-            'pdf': FileType.PDF,
-            'docx': FileType.DOCX,
-            'xlsx': FileType.XLSX
-        }
         
-        retrieval_results = []
-        for result in results:
-            retrieval_results.append(RetrievalResult(
-                document_id=result.get('document_id', 'unknown'),
-                chunk_id=result['chunk_id'],
-                content=result['content'],
-                score=result.get('rerank_score', result['score']),
-                file_type=file_type_map.get(result.get('file_type'), FileType.TEXT),
-                filename=result.get('filename', 'unknown'),
-                metadata=result.get('metadata', {}),
-                chunk_index=result.get('chunk_index', 0)
-            ))
+        tracer.log_step("retrieval_complete", {"num_results": len(results), "timings": timings})
+        
+        if reranked:
+            results, reranked = await reranker.rerank_async(sanitized_query, results)
+            tracer.log_step("reranking_complete", {"num_results": len(results), "reranked": reranked})
+        
+        retrieval_results = to_retrieval_results(results)
+        # A rerank that timed out or failed is served as is but not cached under the reranked scope;
+        # with nothing to rerank the response is the same either way
+        cacheable = reranked == scope['reranked'] or not results
+        if query_embedding is not None and cacheable:
+            cache_manager.set_semantic_result(query_embedding, scope, generation, retrieval_results)
         
         processing_time = time.time() - start_time
         
-        return QueryResponse(
+        response = QueryResponse(
             success=True,
             query=sanitized_query,
             results=retrieval_results,
             total_results=len(retrieval_results),
             processing_time=processing_time,
             retrieval_method=retrieval_method,
-            reranked=reranked
+            reranked=reranked,
+            timings=timings
         )
+        body = response.model_dump_json().encode()
+        if not cacheable:
+            return json_response(body, None, "bypass")
+        stored = replay_body(response)
+        cache_manager.set_response(fingerprint, stored)
+        return json_response(body, f"W/{body_etag(stored)}", "miss")
         
     except HTTPException:
         raise
@@ -103,6 +213,87 @@ async def query_documents(request: QueryRequest):
         )
 
 
+@router.post("/query/batch", response_model=BatchQueryResponse)
+@trace_operation("batch_query_execution")
+async def query_documents_batch(request: BatchQueryRequest, x_tenant_id: Optional[str] = Header(default=None)):
+    start_time = time.time()
+    responses = [None] * len(request.queries)
+    valid_queries = []
+    
+    for i, query in enumerate(request.queries):
+        is_valid, error_msg = guardrails.validate_query(query)
+        if is_valid:
+            valid_queries.append((i, guardrails.sanitize_query(query)))
+        else:
+            responses[i] = QueryResponse(
+                success=False,
+                query=query,
+                results=[],
+                total_results=0,
+                processing_time=0.0,
+                retrieval_method="none"
+            )
+    
+    tracer.log_step("batch_query_validated", {"num_queries": len(request.queries), "num_valid": len(valid_queries)})
+    
+    file_type_filter = None
+    if request.file_types:
+        file_type_filter = [ft.value for ft in request.file_types]
+    
+    queries = [query for _, query in valid_queries]
+    retrieval_method = "hybrid" if settings.enable_hybrid_search else "dense"
+    timings = None
+    
+    try:
+        if not queries:
+            batch_results = []
+        elif settings.enable_hybrid_search:
+            batch_results, timings = hybrid_search.hybrid_retrieve_batch_timed(
+                queries=queries,
+                top_k=request.top_k,
+                file_types=file_type_filter,
+                search_ef=request.search_effort,
+                fusion=request.fusion.value if request.fusion else None,
+                tenant=x_tenant_id
+            )
+        else:
+            batch_results = retrieval_system.retrieve_batch(
+                queries=queries,
+                top_k=request.top_k,
+                file_types=file_type_filter,
+                similarity_threshold=request.similarity_threshold,
+                search_ef=request.search_effort,
+                tenant=x_tenant_id
+            )
+    except Exception as e:
+        log.error(f"Batch query error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    processing_time = time.time() - start_time
+    
+    for (i, query), results in zip(valid_queries, batch_results):
+        retrieval_results = to_retrieval_results(results)
+        responses[i] = QueryResponse(
+            success=True,
+            query=query,
+            results=retrieval_results,
+            total_results=len(retrieval_results),
+            processing_time=processing_time,
+            retrieval_method=retrieval_method
+        )
+    
+    tracer.log_step("batch_retrieval_complete", {"num_queries": len(queries)})
+    
+    return BatchQueryResponse(
+        success=True,
+        total_queries=len(request.queries),
+        responses=responses,
+        processing_time=processing_time,
+        retrieval_method=retrieval_method,
+        timings=timings
+    )
+
+
 @router.get("/search")
 async def simple_search(q: str, top_k: int = 10):
     try:
@@ -138,4 +329,37 @@ async def rebuild_search_index():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/rebuild-collection")
+async def rebuild_vector_collection(request: CollectionRebuildRequest):
+    from app.database.search_eval import search_evaluator
+    
+    try:
+        result = vector_store.rebuild_collection(
+            hnsw_m=request.hnsw_m,
+            construction_ef=request.construction_ef,
+            search_ef=request.search_ef
+        )
+        result["evaluation"] = search_evaluator.evaluate(k=request.eval_k, sample_size=request.eval_sample_size)
+        return {"success": True, **result}
+    except Exception as e:
+        log.error(f"Collection rebuild error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/evaluate-search")
+async def evaluate_search(k: int = 10, sample_size: int = 100, search_efs: Optional[str] = None):
+    from app.database.search_eval import search_evaluator
+    
+    try:
+        efs = [int(ef) for ef in search_efs.split(",")] if search_efs else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="search_efs must be a comma-separated list of integers")
+    
+    try:
+        return search_evaluator.evaluate(k=k, search_efs=efs, sample_size=sample_size)
+    except Exception as e:
+        log.error(f"Search evaluation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 __all__ = ["router"]
\ No newline at end of file
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import List
+from fastapi import APIRouter, UploadFile, File, Header, HTTPException
+from typing import List, Optional
 import time
 from datetime import datetime
 from app.models import UploadResponse, BatchUploadResponse, DocumentMetadata, FileType
 from app.core.ingestion import document_ingestion
+from app.database.vector_store import vector_store
 from app.utils.guardrails import file_guardrails
 from app.utils.logging_config import log
 from app.tracing.tracer import tracer, trace_operation
@@ -13,7 +14,7 @@ router = APIRouter()
 
 @router.post("/upload", response_model=UploadResponse)
 @trace_operation("document_upload")
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...), x_tenant_id: Optional[str] = Header(default=None)):
     start_time = time.time()
     
     try:
@@ -26,11 +27,7 @@ async def upload_document(file: UploadFile = File(...)):
         
         tracer.log_step("file_validation", {"filename": file.filename, "size": file_size})
         
-        saved_path = document_ingestion.save_uploaded_file(file_content, file.filename)
-        
-        tracer.log_step("file_saved", {"path": saved_path})
-        
-        document_id, metadata = document_ingestion.ingest_document(saved_path)
+        document_id, metadata = document_ingestion.ingest_upload(file_content, file.filename, tenant=x_tenant_id)
         
         tracer.log_step("document_ingested", {"document_id": document_id, "chunks": metadata['num_chunks']})
         
@@ -51,7 +48,7 @@ async def upload_document(file: UploadFile = File(...)):
             file_size=metadata['file_size'],
             upload_timestamp=datetime.fromisoformat(metadata['upload_timestamp']),
             num_chunks=metadata['num_chunks'],
-            source_path=saved_path,
+            source_path=metadata['file_path'],
             additional_metadata=metadata.get('processor_metadata')
         )
         
@@ -76,12 +73,14 @@ async def upload_document(file: UploadFile = File(...)):
 
 @router.post("/upload/batch", response_model=BatchUploadResponse)
 @trace_operation("batch_upload")
-async def upload_batch(files: List[UploadFile] = File(...)):
+async def upload_batch(files: List[UploadFile] = File(...), x_tenant_id: Optional[str] = Header(default=None)):
     start_time = time.time()
     
     results = []
     successful = 0
     failed = 0
+    writer = vector_store.bulk_writer()
+    buffered = {}  # document_id -> position in results, until its chunks are flushed
     
     for file in files:
         try:
@@ -98,8 +97,9 @@ async def upload_batch(files: List[UploadFile] = File(...)):
                 failed += 1
                 continue
             
-            saved_path = document_ingestion.save_uploaded_file(file_content, file.filename)
-            document_id, metadata = document_ingestion.ingest_document(saved_path)
+            document_id, metadata = document_ingestion.ingest_upload(
+                file_content, file.filename, writer=writer, tenant=x_tenant_id
+            )
             
             file_type_map = {
                 'text': FileType.TEXT,
@@ -116,10 +116,11 @@ async def upload_batch(files: List[UploadFile] = File(...)):
                 file_size=metadata['file_size'],
                 upload_timestamp=datetime.fromisoformat(metadata['upload_timestamp']),
                 num_chunks=metadata['num_chunks'],
-                source_path=saved_path,
+                source_path=metadata['file_path'],
                 additional_metadata=metadata.get('processor_metadata')
             )
             
+            buffered[document_id] = len(results)
             results.append(UploadResponse(
                 success=True,
                 message="Document uploaded successfully",
@@ -139,6 +140,21 @@ async def upload_batch(files: List[UploadFile] = File(...)):
             ))
             failed += 1
     
+    stats, flush_errors = document_ingestion.flush_writer(writer)
+    tracer.log_step("vectors_flushed", stats)
+    
+    for document_id, error in flush_errors.items():
+        if document_id not in buffered:
+            continue
+        results[buffered[document_id]] = UploadResponse(
+            success=False,
+            message=f"Error: {error}",
+            document_id=document_id,
+            processing_time=0
+        )
+        successful -= 1
+        failed += 1
+    
     total_time = time.time() - start_time
     
     return BatchUploadResponse(
@@ -158,20 +174,50 @@ async def list_documents():
     return {"total": len(documents), "documents": documents}
 
 
+@router.get("/documents/{document_id}/chunks")
+async def get_document_chunks(document_id: str):
+    from app.core.retrieval import retrieval_system
+    
+    chunks = retrieval_system.retrieve_by_document_id(document_id)
+    if not chunks:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    return {"document_id": document_id, "total": len(chunks), "chunks": chunks}
+
+
+@router.get("/documents/{document_id}/chunks/{chunk_index}/context")
+async def get_chunk_context(document_id: str, chunk_index: int, window: int = 1):
+    from app.core.retrieval import retrieval_system
+    
+    if window < 0 or window > 50:
+        raise HTTPException(status_code=400, detail="window must be between 0 and 50")
+    
+    chunks = retrieval_system.retrieve_chunk_window(document_id, chunk_index, window=window)
+    if not chunks:
+        raise HTTPException(status_code=404, detail="Chunk not found")
+    
+    return {"document_id": document_id, "chunk_index": chunk_index, "window": window, "chunks": chunks}
+
+
 @router.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
     try:
         from app.database.metadata_store import metadata_store
-        from app.database.vector_store import vector_store
         
         metadata = metadata_store.get_document(document_id)
         if not metadata:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        metadata_store.delete_document(document_id)
+        result = document_ingestion.delete_document(document_id)
         
-        return {"success": True, "message": f"Document {document_id} deleted"}
+        return {
+            "success": True,
+            "message": f"Document {document_id} deleted",
+            "chunks_deleted": result['chunks_deleted']
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(f"Delete error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
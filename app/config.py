@@ -33,10 +33,23 @@ class Settings(BaseSettings):
         default=".txt,.pdf,.png,.jpg,.jpeg,.docx,.xlsx,.pptx",
         env="ALLOWED_EXTENSIONS"
     )
+    persist_uploads: bool = Field(default=True, env="PERSIST_UPLOADS")
     
     # Vector Database Settings
+    vector_backend: str = Field(default="chroma", env="VECTOR_BACKEND")  # chroma or numpy
     chroma_dir: str = Field(default="./chroma_db", env="CHROMA_DIR")
     collection_name: str = Field(default="multimodal_documents", env="COLLECTION_NAME")
+    vector_write_batch_size: int = Field(default=500, env="VECTOR_WRITE_BATCH_SIZE")
+    vector_read_page_size: int = Field(default=1000, env="VECTOR_READ_PAGE_SIZE")
+    shard_key: str = Field(default="", env="SHARD_KEY")  # empty (no sharding), file_type, tenant or hash
+    shard_count: int = Field(default=4, env="SHARD_COUNT")  # hash sharding only
+    tenant_id: str = Field(default="default", env="TENANT_ID")  # stamped on chunks uploaded without an X-Tenant-ID header
+    # HNSW index parameters, applied when a Chroma collection is created
+    hnsw_m: int = Field(default=16, env="HNSW_M")
+    hnsw_construction_ef: int = Field(default=100, env="HNSW_CONSTRUCTION_EF")
+    hnsw_search_ef: int = Field(default=10, env="HNSW_SEARCH_EF")
+    # Share of deleted rows in an index that triggers a background compaction
+    compaction_tombstone_ratio: float = Field(default=0.2, env="COMPACTION_TOMBSTONE_RATIO")
     
     # Embedding Settings
     text_embedding_model: str = Field(
@@ -47,28 +60,62 @@ class Settings(BaseSettings):
         default="clip-ViT-B-32",
         env="IMAGE_EMBEDDING_MODEL"
     )
+    local_embedding_model: str = Field(
+        default="all-MiniLM-L6-v2",
+        env="LOCAL_EMBEDDING_MODEL"
+    )
     embedding_dimension: int = Field(default=1536, env="EMBEDDING_DIMENSION")
     
     # Chunking Settings
-    chunk_size: int = Field(default=512, env="CHUNK_SIZE")
+    chunk_size: int = Field(default=512, env="CHUNK_SIZE")  # embedding model tokens
     chunk_overlap: int = Field(default=50, env="CHUNK_OVERLAP")
     max_chunks_per_doc: int = Field(default=100, env="MAX_CHUNKS_PER_DOC")
+    # What to do when a document would exceed max_chunks_per_doc: grow (truncating past the model limit), summarize or truncate
+    chunk_budget_policies: str = Field(
+        default="default:grow,xlsx:summarize",
+        env="CHUNK_BUDGET_POLICIES"
+    )
     
     # Retrieval Settings
     top_k_results: int = Field(default=10, env="TOP_K_RESULTS")
     similarity_threshold: float = Field(default=0.7, env="SIMILARITY_THRESHOLD")
     enable_reranking: bool = Field(default=True, env="ENABLE_RERANKING")
     reranking_top_k: int = Field(default=5, env="RERANKING_TOP_K")
+    rerank_backend: str = Field(default="auto", env="RERANK_BACKEND")  # auto (cross_encoder only if the model is on disk), cross_encoder, openai or simple
+    cross_encoder_model: str = Field(default="cross-encoder/ms-marco-MiniLM-L-6-v2", env="CROSS_ENCODER_MODEL")
+    cross_encoder_max_length: int = Field(default=256, env="CROSS_ENCODER_MAX_LENGTH")  # query + passage tokens
+    cross_encoder_batch_size: int = Field(default=32, env="CROSS_ENCODER_BATCH_SIZE")
+    cross_encoder_onnx: bool = Field(default=False, env="CROSS_ENCODER_ONNX")  # int8-quantized onnxruntime model
+    cross_encoder_workers: int = Field(default=2, env="CROSS_ENCODER_WORKERS")  # inference threads, shared by all requests
+    rerank_timeout: float = Field(default=0.5, env="RERANK_TIMEOUT")  # seconds before keeping retrieval order
+    llm_rerank_model: str = Field(default="gpt-3.5-turbo", env="LLM_RERANK_MODEL")
+    llm_rerank_mode: str = Field(default="listwise", env="LLM_RERANK_MODE")  # listwise (one call) or pointwise
+    llm_rerank_candidates: int = Field(default=10, env="LLM_RERANK_CANDIDATES")  # results sent to the LLM
     
     # Hybrid Search Settings
     enable_hybrid_search: bool = Field(default=True, env="ENABLE_HYBRID_SEARCH")
     dense_weight: float = Field(default=0.7, env="DENSE_WEIGHT")
     sparse_weight: float = Field(default=0.3, env="SPARSE_WEIGHT")
+    sparse_flush_docs: int = Field(default=5000, env="SPARSE_FLUSH_DOCS")  # in-memory BM25 changes before merging to disk
+    sparse_sync_interval: float = Field(default=1.0, env="SPARSE_SYNC_INTERVAL")  # seconds a store write may go unjournaled before BM25 rebuilds
+    hybrid_fusion: str = Field(default="weighted", env="HYBRID_FUSION")  # weighted or rrf
+    rrf_k: int = Field(default=60, env="RRF_K")
+    hybrid_dense_timeout: float = Field(default=5.0, env="HYBRID_DENSE_TIMEOUT")  # seconds
+    hybrid_sparse_timeout: float = Field(default=1.0, env="HYBRID_SPARSE_TIMEOUT")  # seconds
+    hybrid_leg_workers: int = Field(default=8, env="HYBRID_LEG_WORKERS")  # threads for both legs; a timed-out leg holds one until it returns
+    
+    # Text Analysis Settings
+    analyzer_stopwords: bool = Field(default=True, env="ANALYZER_STOPWORDS")
+    analyzer_stemming: bool = Field(default=True, env="ANALYZER_STEMMING")
+    analyzer_query_cache_size: int = Field(default=4096, env="ANALYZER_QUERY_CACHE_SIZE")
     
     # Cache Settings
     cache_dir: str = Field(default="./cache", env="CACHE_DIR")
     cache_enabled: bool = Field(default=True, env="CACHE_ENABLED")
     cache_ttl: int = Field(default=3600, env="CACHE_TTL")  # seconds
+    semantic_cache_enabled: bool = Field(default=False, env="SEMANTIC_CACHE_ENABLED")  # opt-in: near paraphrases can also match distinct questions
+    semantic_cache_threshold: float = Field(default=0.95, env="SEMANTIC_CACHE_THRESHOLD")  # cosine similarity
+    semantic_cache_size: int = Field(default=1024, env="SEMANTIC_CACHE_SIZE")  # query embeddings kept per process
     
     # Logging Settings
     log_dir: str = Field(default="./logs", env="LOG_DIR")
@@ -103,6 +150,14 @@ class Settings(BaseSettings):
     def get_allowed_extensions(self) -> List[str]:
         return [ext.strip() for ext in self.allowed_extensions.split(",")]
     
+    def get_chunk_budget_policy(self, file_type: str) -> str:
+        policies = dict(
+            entry.strip().split(":", 1)
+            for entry in self.chunk_budget_policies.split(",")
+            if ":" in entry
+        )
+        return policies.get(file_type, policies.get("default", "grow")).strip()
+    
     def ensure_directories(self):
         directories = [
             self.upload_dir,
@@ -1,16 +1,99 @@
 import hashlib
-from typing import Any, Optional
+import json
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional
 from diskcache import Cache
 from app.config import settings
 from app.utils.logging_config import log
 
 
+class SemanticCache:
+    
+    def __init__(self, threshold: float = 0.95, capacity: int = 1024):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._reset(None)
+    
+    def _reset(self, generation: Optional[int]):
+        self.generation = generation
+        self.embeddings = None
+        self.scope_ids = np.full(self.capacity, -1, dtype=np.int64)
+        self.scopes = {}
+        self.results = [None] * self.capacity
+        self.size = 0
+        self.next_slot = 0
+    
+    def _vector(self, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def _scope_key(self, scope: Dict[str, Any]) -> str:
+        return json.dumps(scope, sort_keys=True)
+    
+    def get(self, embedding: List[float], scope: Dict[str, Any], generation: int) -> Optional[Any]:
+        vector = self._vector(embedding)
+        with self.lock:
+            scope_id = self.scopes.get(self._scope_key(scope))
+            if generation != self.generation or scope_id is None or self.embeddings.shape[1] != len(vector):
+                self.misses += 1
+                return None
+            
+            # Flat scan over at most `capacity` rows; only entries with identical filters may answer
+            similarities = self.embeddings[:self.size] @ vector
+            similarities[self.scope_ids[:self.size] != scope_id] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            return self.results[best]
+    
+    def set(self, embedding: List[float], scope: Dict[str, Any], generation: int, result: Any):
+        vector = self._vector(embedding)
+        with self.lock:
+            # Entries from an older index generation can never be served again, so they are dropped wholesale
+            if generation != self.generation or self.embeddings is None or self.embeddings.shape[1] != len(vector):
+                self._reset(generation)
+                self.embeddings = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+            
+            slot = self.next_slot
+            self.embeddings[slot] = vector
+            self.scope_ids[slot] = self.scopes.setdefault(self._scope_key(scope), len(self.scopes))
+            self.results[slot] = result
+            # Ring buffer: once full, the oldest query is overwritten
+            self.next_slot = (slot + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+    
+    def clear(self):
+        with self.lock:
+            self._reset(None)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "entries": self.size,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
 class CacheManager:
     
     def __init__(self):
         self.enabled = settings.cache_enabled
         self.cache = Cache(settings.cache_dir)
         self.ttl = settings.cache_ttl
+        self.semantic_enabled = settings.cache_enabled and settings.semantic_cache_enabled
+        self.semantic = SemanticCache(settings.semantic_cache_threshold, settings.semantic_cache_size)
     
     def _generate_key(self, prefix: str, data: str) -> str:
         hash_obj = hashlib.md5(data.encode())
@@ -29,13 +112,13 @@ class CacheManager:
             log.error(f"Cache get error: {e}")
             return None
     
-    def set(self, key: str, value: Any, ttl: int = None):
+    def set(self, key: str, value: Any, ttl: int = None, tag: str = None):
         if not self.enabled:
             return
         
         try:
             expire_time = ttl or self.ttl
-            self.cache.set(key, value, expire=expire_time)
+            self.cache.set(key, value, expire=expire_time, tag=tag)
             log.debug(f"Cache set: {key}")
         except Exception as e:
             log.error(f"Cache set error: {e}")
@@ -48,17 +131,59 @@ class CacheManager:
         key = self._generate_key("embedding", text)
         self.set(key, embedding)
     
-    def get_query_result(self, query: str) -> Optional[Any]:
-        key = self._generate_key("query", query)
+    def query_key(self, query: str, params: Dict[str, Any], generation: int) -> str:
+        # Every cached query result embeds the store's applied generation, so one write retires them all without a scan
+        data = json.dumps({'query': query, 'params': params, 'generation': generation}, sort_keys=True)
+        return self._generate_key("query", data)
+    
+    def get_query_result(self, key: str) -> Optional[Any]:
         return self.get(key)
     
-    def set_query_result(self, query: str, result: Any):
-        key = self._generate_key("query", query)
-        self.set(key, result, ttl=1800)
+    def set_query_result(self, key: str, result: Any):
+        self.set(key, result, tag="query")
+    
+    def response_fingerprint(self, query: str, params: Dict[str, Any], generation: int) -> str:
+        data = json.dumps({'query': query, 'params': params, 'generation': generation}, sort_keys=True)
+        return hashlib.md5(data.encode()).hexdigest()
+    
+    def get_response(self, fingerprint: str) -> Optional[bytes]:
+        return self.get(f"response:{fingerprint}")
+    
+    def set_response(self, fingerprint: str, body: bytes):
+        self.set(f"response:{fingerprint}", body, tag="response")
+    
+    def get_semantic_result(self, embedding: List[float], scope: Dict[str, Any], generation: int) -> Optional[Any]:
+        if not self.semantic_enabled:
+            return None
+        return self.semantic.get(embedding, scope, generation)
+    
+    def set_semantic_result(self, embedding: List[float], scope: Dict[str, Any], generation: int, result: Any):
+        if not self.semantic_enabled:
+            return
+        self.semantic.set(embedding, scope, generation, result)
+    
+    def _rerank_key(self, query: str, content: str, model: str) -> str:
+        # Keyed on the passage text rather than the chunk id, so a re-ingested chunk is never served a stale score
+        query_hash = hashlib.md5(query.encode()).hexdigest()
+        content_hash = hashlib.md5(content.encode()).hexdigest()
+        return f"rerank:{model}:{query_hash}:{content_hash}"
+    
+    def get_rerank_scores(self, query: str, passages: Dict[str, str], model: str) -> Dict[str, float]:
+        scores = {}
+        for chunk_id, content in passages.items():
+            score = self.get(self._rerank_key(query, content, model))
+            if score is not None:
+                scores[chunk_id] = score
+        return scores
+    
+    def set_rerank_scores(self, query: str, scores: Dict[str, float], passages: Dict[str, str], model: str):
+        for chunk_id, score in scores.items():
+            self.set(self._rerank_key(query, passages[chunk_id], model), score, tag="rerank")
     
     def clear(self):
         try:
             self.cache.clear()
+            self.semantic.clear()
             log.info("Cache cleared")
         except Exception as e:
             log.error(f"Cache clear error: {e}")
@@ -67,7 +192,8 @@ class CacheManager:
         try:
             return {
                 "size": self.cache.volume(),
-                "count": len(self.cache)
+                "count": len(self.cache),
+                "semantic": {"enabled": self.semantic_enabled, **self.semantic.stats()}
             }
         except Exception as e:
             log.error(f"Cache stats error: {e}")
@@ -76,4 +202,4 @@ class CacheManager:
 
 cache_manager = CacheManager()
 
-__all__ = ["CacheManager", "cache_manager"]
\ No newline at end of file
+__all__ = ["CacheManager", "SemanticCache", "cache_manager"]
\ No newline at end of file
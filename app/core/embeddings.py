@@ -18,7 +18,7 @@ class TextEmbedder:
         
         if not self.use_openai:
             log.warning("OpenAI API key not found, using sentence-transformers")
-            self.local_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.local_model = SentenceTransformer(settings.local_embedding_model)
     
     def embed_text(self, text: str) -> List[float]:
         cached = cache_manager.get_embedding(text)
@@ -61,10 +61,50 @@ class TextEmbedder:
         return embedding.cpu().numpy().tolist()
     
     def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        embeddings = []
-        for text in texts:
-            embeddings.append(self.embed_text(text))
+        embeddings = [cache_manager.get_embedding(text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            # One model call for every uncached text instead of one per text
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            try:
+                if self.use_openai:
+                    computed = self._embed_batch_with_openai(missing_texts)
+                else:
+                    computed = self._embed_batch_with_local(missing_texts)
+            except Exception as e:
+                log.error(f"Batch embedding error: {e}")
+                raise
+            
+            by_text = dict(zip(missing_texts, computed))
+            for text, embedding in by_text.items():
+                cache_manager.set_embedding(text, embedding)
+            for i in missing:
+                embeddings[i] = by_text[texts[i]]
+        
         return embeddings
+    
+    def _embed_batch_with_openai(self, texts: List[str]) -> List[List[float]]:
+        tracer.log_step("openai_embedding_batch", {"num_texts": len(texts)})
+        
+        client = openai.OpenAI(api_key=settings.openai_api_key)
+        response = client.embeddings.create(
+            model=self.model_name,
+            input=texts
+        )
+        
+        tracer.log_llm_call(
+            model=self.model_name,
+            prompt=texts[0][:100],
+            response="embedding_batch_generated",
+            tokens_used=response.usage.total_tokens
+        )
+        
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
+    def _embed_batch_with_local(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self.local_model.encode(texts, convert_to_tensor=True)
+        return embeddings.cpu().numpy().tolist()
 
 
 class ImageEmbedder:
@@ -1,6 +1,11 @@
-from typing import List, Dict, Any
-from rank_bm25 import BM25Okapi
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+import shutil
 from app.core.retrieval import retrieval_system
+from app.core.sparse_index import InvertedIndex, SegmentDirectory
 from app.database.vector_store import vector_store
 from app.utils.logging_config import log
 from app.config import settings
@@ -11,116 +16,415 @@ class HybridSearch:
     def __init__(self):
         self.dense_weight = settings.dense_weight
         self.sparse_weight = settings.sparse_weight
-        self.bm25_index = None
-        self.documents = []
-        self.doc_ids = []
+        self.index_dir = SegmentDirectory(Path(settings.chroma_dir) / "bm25" / settings.collection_name)
+        self.index = InvertedIndex()
+        self.loaded = False
+        self.state = None  # the CURRENT pointer the index was opened from
+        self.journal_offset = 0
+        self.generation = 0  # newest store generation reflected in the index
+        self._behind_since = None
+        self._sync_lock = threading.RLock()
+        # Sized on its own: legs that miss their deadline keep a thread until they return, so sharing
+        # the general async pool would let slow legs starve everything else
+        self.leg_workers = settings.hybrid_leg_workers
+        self.executor = ThreadPoolExecutor(max_workers=self.leg_workers)
+        self._legs_in_flight = 0
+        self._legs_lock = threading.Lock()
+        # Merging the delta rewrites the whole segment, so it runs here rather than on the writing request's thread
+        self.flush_executor = ThreadPoolExecutor(max_workers=1)
+        self._flush_future = None
+        self._flush_guard = threading.Lock()
+        vector_store.add_write_listener(self)
     
     def build_bm25_index(self):
-        try:
-            count = vector_store.count()
-            
-            if count == 0:
-                log.warning("No documents in vector store for BM25 indexing")
-                return
-            
-            results = vector_store.collection.get()
-            
-            if not results['documents']:
-                log.warning("No documents retrieved for BM25 indexing")
-                return
+        with self._sync_lock:
+            try:
+                with self.index_dir.lock():
+                    state = self.index_dir.current() or self.index_dir.publish(None, None)
+                    offset = self.index_dir.journal_size(state)
+                generation = vector_store.generation()
+                
+                index = InvertedIndex()
+                for page in vector_store.iter_where(None, include=["documents", "metadatas"]):
+                    index.add_many(page['ids'], page['documents'], page['metadatas'])
             
-            self.documents = results['documents']
-            self.doc_ids = results['ids']
+                # Writes journaled while the store was paged through carry over to the new segment's journal
+                self._publish(index, state, offset, generation)
+                log.info(f"BM25 index built with {len(self.index)} documents")
+            except Exception as e:
+                log.error(f"Error building BM25 index: {e}")
+    
+    def _publish(self, index: InvertedIndex, state: Dict[str, Any], offset: int, generation: int):
+        staging = self.index_dir.staging_path()
+        index.save(staging)
+        
+        with self.index_dir.lock():
+            current = self.index_dir.current()
+            if current is not None and current['journal'] == state['journal']:
+                records, _ = self.index_dir.read(state, offset)
+                current = self.index_dir.publish(staging, generation, records)
+            else:
+                # Another worker published first, and its segment holds everything journaled before it
+                shutil.rmtree(staging, ignore_errors=True)
+        
+        with self._sync_lock:
+            self._open(current)
+    
+    def _load(self, state: Dict[str, Any]) -> Tuple[InvertedIndex, int, int]:
+        path = self.index_dir.segment_path(state)
+        index = InvertedIndex(path) if path else InvertedIndex()
+        records, offset = self.index_dir.read(state, 0)
+        return index, offset, max(state['generation'] or 0, self._replay(index, records))
+    
+    def _open(self, state: Dict[str, Any]):
+        self.index, self.journal_offset, self.generation = self._load(state)
+        self.state = state
+        self.loaded = True
+    
+    def _replay(self, index: InvertedIndex, records: List[Dict[str, Any]]) -> int:
+        generation = 0
+        for record in records:
+            if record['op'] == 'upsert':
+                index.add_many(record['ids'], record['texts'], record['metadatas'])
+            else:
+                index.remove(record['ids'])
+            generation = max(generation, record['generation'])
+        return generation
+    
+    def _catch_up(self) -> bool:
+        # Follows CURRENT when another worker published, then replays journal entries this worker has not seen
+        for attempt in range(2):
+            state = self.index_dir.current()
+            if state is None or state['generation'] is None:
+                return False
             
-            tokenized_docs = [doc.lower().split() for doc in self.documents]
-            self.bm25_index = BM25Okapi(tokenized_docs)
+            try:
+                if self.state is None or state['journal'] != self.state['journal']:
+                    self._open(state)
+                elif self.index_dir.journal_size(state) > self.journal_offset:
+                    records, self.journal_offset = self.index_dir.read(state, self.journal_offset)
+                    self.generation = max(self.generation, self._replay(self.index, records))
+                return True
+            except FileNotFoundError:
+                # Two publishes landed since CURRENT was read and retired its files; read it again
+                if attempt:
+                    raise
+    
+    def _is_stale(self) -> bool:
+        # Store writes that never reached the journal (a snapshot import, a worker that died mid-write) leave the
+        # store generation ahead. Other workers' in-flight writes do too, briefly, so the gap must outlive the interval
+        if vector_store.generation() == self.generation:
+            self._behind_since = None
+            return False
+        
+        now = time.monotonic()
+        if self._behind_since is None:
+            self._behind_since = now
+        return now - self._behind_since >= settings.sparse_sync_interval
             
-            log.info(f"BM25 index built with {len(self.documents)} documents")
-        except Exception as e:
-            log.error(f"Error building BM25 index: {e}")
-            self.bm25_index = None
+    def ensure_index(self):
+        with self._sync_lock:
+            try:
+                if self._catch_up() and not self._is_stale():
+                    return
+            except Exception as e:
+                log.warning(f"Could not open BM25 index at {self.index_dir.path}, rebuilding: {e}")
+            self._behind_since = None
+        
+        self.build_bm25_index()
     
-    def sparse_retrieval(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
-        if self.bm25_index is None:
-            self.build_bm25_index()
+    def flush(self, force: bool = False):
+        # One worker at a time merges the shared delta into a new segment; the others follow CURRENT to it
+        if not self.loaded or not (force or self.index.delta_size()):
+            return
         
-        if self.bm25_index is None:
-            return []
+        with self.index_dir.flush_lock() as acquired:
+            if acquired:
+                # The merge works on its own copy of segment plus journal, so queries and writes keep using the
+                # live index until the new segment is published
+                state = self.index_dir.current()
+                index, offset, generation = self._load(state)
+                self._publish(index, state, offset, generation)
+                log.info(f"BM25 index saved to {self.index_dir.path}")
+    
+    def schedule_flush(self) -> Optional[Future]:
+        with self._flush_guard:
+            if self._flush_future is None or self._flush_future.done():
+                self._flush_future = self.flush_executor.submit(self._flush_quietly)
+            return self._flush_future
+    
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.error(f"BM25 index merge failed: {e}")
+    
+    def _record(self, record: Dict[str, Any]):
+        record['generation'] = vector_store.write_generation()
+        self.index_dir.append(record)
         
-        tokenized_query = query.lower().split()
-        scores = self.bm25_index.get_scores(tokenized_query)
+        if self.loaded:
+            with self._sync_lock:
+                self._catch_up()
+            if self.index.delta_size() >= settings.sparse_flush_docs:
+                self.schedule_flush()
+            
+    def on_upsert(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]):
+        self._record({'op': 'upsert', 'ids': ids, 'texts': texts, 'metadatas': metadatas})
+    
+    def on_delete(self, ids: List[str]):
+        self._record({'op': 'delete', 'ids': ids})
+            
+    def on_reset(self):
+        with self._sync_lock:
+            with self.index_dir.lock():
+                state = self.index_dir.publish(None, vector_store.write_generation())
+            self._open(state)
+    
+    def tombstone_ratio(self) -> float:
+        return self.index.tombstone_ratio()
+    
+    def compact(self):
+        self.flush(force=True)
+    
+    def sparse_retrieval(self, query: str, top_k: int = 10, where: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        return self.sparse_retrieval_batch([query], top_k=top_k, where=where)[0]
+    
+    def sparse_retrieval_batch(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        where: Dict[str, Any] = None
+    ) -> List[List[Dict[str, Any]]]:
+        self.ensure_index()
         
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        if not self.loaded:
+            return [[] for _ in queries]
         
-        results = []
-        for idx in top_indices:
-            if scores[idx] > 0:
-                results.append({
-                    'chunk_id': self.doc_ids[idx],
-                    'content': self.documents[idx],
-                    'score': float(scores[idx]),
-                    'method': 'sparse'
-                })
+        return [
+            [self._sparse_result(hit) for hit in hits]
+            for hits in self.index.search_batch(queries, top_k, where=where)
+        ]
         
-        return results
+    def _sparse_result(self, hit: Tuple[str, float]) -> Dict[str, Any]:
+        chunk_id, score = hit
+        return {
+            'chunk_id': chunk_id,
+            'score': float(score),
+            'method': 'sparse'
+        }
     
     def hybrid_retrieve(
         self,
         query: str,
         top_k: int = 10,
-        file_types: List[str] = None
+        file_types: List[str] = None,
+        search_ef: int = None,
+        fusion: str = None,
+        tenant: str = None
     ) -> List[Dict[str, Any]]:
+        return self.hybrid_retrieve_timed(query, top_k, file_types, search_ef, fusion, tenant)[0]
         
-        dense_results = retrieval_system.retrieve(
-            query=query,
-            top_k=top_k * 2,
-            file_types=file_types
+    def hybrid_retrieve_timed(
+        self,
+        query: str,
+        top_k: int = 10,
+        file_types: List[str] = None,
+        search_ef: int = None,
+        fusion: str = None,
+        tenant: str = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        fusion = fusion or settings.hybrid_fusion
+        candidates = self.candidate_count(top_k, fusion)
+        
+        (dense_results, sparse_results), timings = self._run_legs(
+            lambda: retrieval_system.retrieve(
+                query=query,
+                top_k=candidates,
+                file_types=file_types,
+                search_ef=search_ef,
+                tenant=tenant
+            ),
+            lambda: self.sparse_retrieval(query, top_k=candidates, where=self.sparse_filter(file_types, tenant)),
+            []
+        )
+        
+        return self._fuse(dense_results, sparse_results, top_k, fusion), timings
+    
+    def hybrid_retrieve_batch(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        file_types: List[str] = None,
+        search_ef: int = None,
+        fusion: str = None,
+        tenant: str = None
+    ) -> List[List[Dict[str, Any]]]:
+        return self.hybrid_retrieve_batch_timed(queries, top_k, file_types, search_ef, fusion, tenant)[0]
+    
+    def hybrid_retrieve_batch_timed(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        file_types: List[str] = None,
+        search_ef: int = None,
+        fusion: str = None,
+        tenant: str = None
+    ) -> Tuple[List[List[Dict[str, Any]]], Dict[str, Any]]:
+        fusion = fusion or settings.hybrid_fusion
+        candidates = self.candidate_count(top_k, fusion)
+        
+        (dense_batch, sparse_batch), timings = self._run_legs(
+            lambda: retrieval_system.retrieve_batch(
+                queries=queries,
+                top_k=candidates,
+                file_types=file_types,
+                search_ef=search_ef,
+                tenant=tenant
+            ),
+            lambda: self.sparse_retrieval_batch(queries, top_k=candidates, where=self.sparse_filter(file_types, tenant)),
+            [[] for _ in queries]
         )
         
-        sparse_results = self.sparse_retrieval(query, top_k=top_k * 2)
+        batch_results = [
+            self._fuse(dense_results, sparse_results, top_k, fusion)
+            for dense_results, sparse_results in zip(dense_batch, sparse_batch)
+        ]
+        return batch_results, timings
+    
+    def _run_legs(
+        self,
+        dense_leg: Callable[[], Any],
+        sparse_leg: Callable[[], Any],
+        fallback: Any
+    ) -> Tuple[Tuple[Any, Any], Dict[str, Any]]:
+        start_time = time.perf_counter()
+        timings = {}
+        
+        def timed(leg: Callable[[], Any]) -> Tuple[Any, float, float]:
+            leg_start = time.perf_counter()
+            result = leg()
+            return result, (time.perf_counter() - leg_start) * 1000, (leg_start - start_time) * 1000
+        
+        with self._legs_lock:
+            # Legs abandoned by earlier requests still hold threads; with the queue times this shows saturation
+            timings['legs_in_flight'] = self._legs_in_flight
+            timings['leg_workers'] = self.leg_workers
+            self._legs_in_flight += 2
         
+        futures = {
+            'dense': self.executor.submit(timed, dense_leg),
+            'sparse': self.executor.submit(timed, sparse_leg)
+        }
+        for future in futures.values():
+            future.add_done_callback(self._leg_done)
+        deadlines = {'dense': settings.hybrid_dense_timeout, 'sparse': settings.hybrid_sparse_timeout}
+        
+        results = {}
+        for name, future in futures.items():
+            # Both legs are already running, so each deadline counts from the shared start
+            remaining = max(deadlines[name] - (time.perf_counter() - start_time), 0)
+            try:
+                results[name], timings[f"{name}_ms"], timings[f"{name}_queue_ms"] = future.result(timeout=remaining)
+                timings[f"{name}_status"] = "ok"
+            except FutureTimeoutError:
+                # A leg still queued is dropped; a running one cannot be interrupted and its result is discarded
+                cancelled = future.cancel()
+                log.warning(
+                    f"Hybrid {name} leg missed its {deadlines[name]}s deadline"
+                    f"{' before it started' if cancelled else ''}, continuing without it"
+                )
+                results[name] = fallback
+                timings[f"{name}_status"] = "timeout"
+                timings[f"{name}_ms"] = deadlines[name] * 1000
+            except Exception as e:
+                log.error(f"Hybrid {name} leg failed, continuing without it: {e}")
+                results[name] = fallback
+                timings[f"{name}_status"] = "error"
+                timings[f"{name}_ms"] = (time.perf_counter() - start_time) * 1000
+        
+        timings['total_ms'] = (time.perf_counter() - start_time) * 1000
+        return (results['dense'], results['sparse']), timings
+    
+    def _leg_done(self, future):
+        with self._legs_lock:
+            self._legs_in_flight -= 1
+    
+    def sparse_filter(self, file_types: List[str] = None, tenant: str = None) -> Dict[str, Any]:
+        # Same restriction the dense leg applies, resolved against the sparse index's attribute bitmaps
+        return retrieval_system.where_filter(file_types, tenant)
+    
+    def candidate_count(self, top_k: int, fusion: str) -> int:
+        if fusion not in ("weighted", "rrf"):
+            raise ValueError(f"Unknown fusion mode: {fusion}")
+        # Rank fusion never compares raw scores across legs, so each leg only needs its own top_k
+        return top_k if fusion == "rrf" else top_k * 2
+    
+    def _fuse(
+        self,
+        dense_results: List[Dict[str, Any]],
+        sparse_results: List[Dict[str, Any]],
+        top_k: int,
+        fusion: str = "weighted"
+    ) -> List[Dict[str, Any]]:
         combined_scores = {}
         
-        for result in dense_results:
-            chunk_id = result['chunk_id']
-            combined_scores[chunk_id] = {
-                'dense_score': result['score'] * self.dense_weight,
+        for rank, result in enumerate(dense_results, start=1):
+            dense_score = 1 / (settings.rrf_k + rank) if fusion == "rrf" else result['score'] * self.dense_weight
+            combined_scores[result['chunk_id']] = {
+                'dense_score': dense_score,
                 'sparse_score': 0,
                 'result': result
             }
         
-        for result in sparse_results:
-            chunk_id = result['chunk_id']
-            if chunk_id in combined_scores:
-                combined_scores[chunk_id]['sparse_score'] = result['score'] * self.sparse_weight
-            else:
-                dense_info = vector_store.get_document(chunk_id)
-                if dense_info:
-                    combined_scores[chunk_id] = {
-                        'dense_score': 0,
-                        'sparse_score': result['score'] * self.sparse_weight,
-                        'result': {
-                            'chunk_id': chunk_id,
-                            'content': dense_info['document'],
-                            'metadata': dense_info['metadata'],
-                            'score': 0
-                        }
-                    }
+        for rank, result in enumerate(sparse_results, start=1):
+            sparse_score = 1 / (settings.rrf_k + rank) if fusion == "rrf" else result['score'] * self.sparse_weight
+            entry = combined_scores.setdefault(result['chunk_id'], {'dense_score': 0, 'result': None})
+            entry['sparse_score'] = sparse_score
+        
+        ranked = sorted(
+            combined_scores.items(),
+            key=lambda item: item[1]['dense_score'] + item[1]['sparse_score'],
+            reverse=True
+        )
         
         final_results = []
-        for chunk_id, scores in combined_scores.items():
-            final_score = scores['dense_score'] + scores['sparse_score']
-            result = scores['result']
-            result['score'] = final_score
-            result['dense_score'] = scores['dense_score']
-            result['sparse_score'] = scores['sparse_score']
-            result['retrieval_method'] = 'hybrid'
-            final_results.append(result)
-        
-        final_results.sort(key=lambda x: x['score'], reverse=True)
-        
-        log.info(f"Hybrid search returned {len(final_results[:top_k])} results")
-        return final_results[:top_k]
+        position = 0
+        while len(final_results) < top_k and position < len(ranked):
+            # Sparse-only hits that made the cut are fetched in a single round-trip; any the store no longer
+            # has are backfilled from further down the ranking
+            window = ranked[position:position + top_k - len(final_results)]
+            position += len(window)
+            missing = [chunk_id for chunk_id, scores in window if scores['result'] is None]
+            hydrated = self._hydrate(missing) if missing else {}
+            
+            for chunk_id, scores in window:
+                result = scores['result'] or hydrated.get(chunk_id)
+                if result is None:
+                    continue
+                result['score'] = scores['dense_score'] + scores['sparse_score']
+                result['dense_score'] = scores['dense_score']
+                result['sparse_score'] = scores['sparse_score']
+                result['retrieval_method'] = 'hybrid'
+                final_results.append(result)
+        
+        log.info(f"Hybrid search returned {len(final_results)} results ({fusion} fusion)")
+        return final_results
+        
+    def _hydrate(self, chunk_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        hydrated = {}
+        for chunk_id, chunk in vector_store.get_documents(chunk_ids).items():
+            metadata = chunk['metadata'] or {}
+            hydrated[chunk_id] = {
+                'chunk_id': chunk_id,
+                'document_id': metadata.get('document_id', 'unknown'),
+                'content': chunk['document'],
+                'metadata': metadata,
+                'file_type': metadata.get('file_type', 'text'),
+                'filename': metadata.get('filename', 'unknown'),
+                'chunk_index': metadata.get('chunk_index', 0)
+            }
+        return hydrated
 
 
 hybrid_search = HybridSearch()
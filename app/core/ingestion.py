@@ -1,16 +1,18 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
 import uuid
 from datetime import datetime
 import shutil
-from app.processors.text_processor import text_processor
-from app.processors.image_processor import image_processor
-from app.processors.pdf_processor import pdf_processor
-from app.processors.docx_processor import docx_processor
-from app.processors.xlsx_processor import xlsx_processor
+# Importing the built-in processors registers them with the registry
+from app.processors import text_processor, image_processor, pdf_processor, docx_processor, xlsx_processor
+from app.processors.registry import processor_registry, SNIFF_BYTES, TAIL_BYTES
+from app.processors.source import DocumentSource
 from app.core.embeddings import text_embedder, image_embedder
-from app.database.vector_store import vector_store
+from app.database.vector_store import vector_store, BulkVectorWriter
 from app.database.metadata_store import metadata_store
+from app.core.hybrid_search import hybrid_search
 from app.utils.logging_config import log
 from app.config import settings
 
@@ -18,37 +20,93 @@ from app.config import settings
 class DocumentIngestion:
     
     def __init__(self):
-        self.processors = {
-            'text': text_processor,
-            'image': image_processor,
-            'pdf': pdf_processor,
-            'docx': docx_processor,
-            'xlsx': xlsx_processor
-        }
+        self.registry = processor_registry
+        self.processors = processor_registry.processors
+        self.io_executor = ThreadPoolExecutor(max_workers=settings.async_workers)
+        self._compaction_lock = threading.Lock()
     
     def get_processor(self, file_path: str):
-        for processor_type, processor in self.processors.items():
-            if processor.can_process(file_path):
-                return processor, processor_type
-        return None, None
+        return self.registry.resolve(file_path)
+    
+    def ingest_document(
+        self,
+        file_path: str,
+        document_id: str = None,
+        writer: Optional[BulkVectorWriter] = None,
+        tenant: str = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        with DocumentSource.from_path(file_path) as source:
+            return self.ingest_source(source, document_id, writer=writer, tenant=tenant)
+    
+    def ingest_upload(
+        self,
+        file_content: bytes,
+        filename: str,
+        document_id: str = None,
+        writer: Optional[BulkVectorWriter] = None,
+        tenant: str = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        saved_path = None
+        pending_write = None
+        
+        if settings.persist_uploads:
+            saved_path = self.get_upload_path(filename)
+            pending_write = self.io_executor.submit(self._write_file, saved_path, file_content)
+        
+        source = DocumentSource.from_bytes(file_content, filename=filename, file_path=saved_path)
+        try:
+            return self.ingest_source(source, document_id, pending_write=pending_write, writer=writer, tenant=tenant)
+        except Exception:
+            if pending_write is not None:
+                self._discard_upload(saved_path, pending_write)
+            raise
     
-    def ingest_document(self, file_path: str, document_id: str = None) -> Tuple[str, Dict[str, Any]]:
+    def ingest_source(
+        self,
+        source: DocumentSource,
+        document_id: str = None,
+        pending_write: Optional[Future] = None,
+        writer: Optional[BulkVectorWriter] = None,
+        tenant: str = None
+    ) -> Tuple[str, Dict[str, Any]]:
         if document_id is None:
             document_id = str(uuid.uuid4())
+        tenant = tenant or settings.tenant_id
         
-        processor, processor_type = self.get_processor(file_path)
+        head = source.head(SNIFF_BYTES)
+        processor, processor_type = self.registry.resolve(source.filename, head=head)
         
         if processor is None:
-            raise ValueError(f"No processor available for file: {file_path}")
+            raise ValueError(f"No processor available for file: {source.filename}")
         
-        log.info(f"Processing {file_path} with {processor_type} processor")
+        is_valid, error_msg = self.registry.preflight(
+            source.filename,
+            processor_type,
+            head=head,
+            tail=source.tail(TAIL_BYTES)
+        )
+        if not is_valid:
+            raise ValueError(f"Preflight check failed for {source.filename}: {error_msg}")
+        
+        log.info(f"Processing {source.filename} with {processor_type} processor")
         
-        chunks, file_metadata = processor.process(file_path)
+        chunks, file_metadata = processor.process(source)
+        spans = file_metadata.pop('chunk_spans', None) or []
+        chunk_budget = file_metadata.pop('chunk_budget', None) or {}
+        summarized = chunk_budget.get('applied', '').endswith('summarize')
+        
+        if chunk_budget.get('applied', 'none') != 'none':
+            log.warning(
+                f"{source.filename} exceeded {chunk_budget['max_chunks']} chunks "
+                f"({chunk_budget['original_chunks']}), applied {chunk_budget['applied']}"
+                + (", text beyond the budget is not searchable" if chunk_budget.get('text_dropped') else "")
+            )
         
         chunk_ids = []
         chunk_embeddings = []
         chunk_metadatas = []
         chunk_texts = []
+        uploaded_at = datetime.now()
         
         for idx, chunk in enumerate(chunks):
             chunk_id = f"{document_id}_chunk_{idx}"
@@ -62,29 +120,63 @@ class DocumentIngestion:
                 'chunk_id': chunk_id,
                 'file_type': processor_type,
                 'filename': file_metadata['filename'],
-                'source_path': file_metadata['file_path']
+                'tenant': tenant,  # routing value for tenant sharding
+                'upload_date': uploaded_at.strftime("%Y-%m-%d")  # day bucket for date filters
             }
             
+            # Vector metadata cannot hold None, so in-memory uploads simply have no source_path
+            if file_metadata['file_path']:
+                chunk_metadata['source_path'] = file_metadata['file_path']
+            
+            if idx < len(spans):
+                start_char, end_char, token_count = spans[idx]
+                chunk_metadata['start_char'] = start_char
+                chunk_metadata['end_char'] = end_char
+                chunk_metadata['token_count'] = token_count
+            
+            if summarized:
+                chunk_metadata['chunk_kind'] = 'summary'
+            
             chunk_ids.append(chunk_id)
             chunk_embeddings.append(embedding)
             chunk_metadatas.append(chunk_metadata)
             chunk_texts.append(chunk)
         
-        vector_store.add_documents(
-            texts=chunk_texts,
-            embeddings=chunk_embeddings,
-            metadatas=chunk_metadatas,
-            ids=chunk_ids
-        )
+        # The upload must be on disk before anything points at it
+        if pending_write is not None:
+            pending_write.result()
+        
+        # Callers ingesting many documents share a writer and flush once at the end
+        if writer is not None:
+            try:
+                writer.add(chunk_texts, chunk_embeddings, chunk_metadatas, chunk_ids)
+            except Exception:
+                # A failed batch write leaves this document's rows buffered, and earlier batches may hold some of them
+                writer.discard(chunk_ids)
+                self._delete_chunks_quietly(chunk_ids)
+                raise
+        else:
+            vector_store.add_documents(
+                texts=chunk_texts,
+                embeddings=chunk_embeddings,
+                metadatas=chunk_metadatas,
+                ids=chunk_ids
+            )
+        
+        file_size = source.size
         
         doc_metadata = {
             'document_id': document_id,
             'filename': file_metadata['filename'],
             'file_type': processor_type,
+            'tenant': tenant,
             'file_path': file_metadata['file_path'],
-            'file_size': Path(file_path).stat().st_size,
-            'upload_timestamp': datetime.now().isoformat(),
+            'file_size': file_size,
+            'processing_cost': self.registry.estimate_cost(processor_type, file_size),
+            'upload_timestamp': uploaded_at.isoformat(),
             'num_chunks': len(chunks),
+            'chunk_budget': chunk_budget or None,
+            'text_dropped': bool(chunk_budget.get('text_dropped')),  # part of the text is not searchable
             'processor_metadata': file_metadata
         }
         
@@ -95,30 +187,111 @@ class DocumentIngestion:
     
     async def ingest_batch(self, file_paths: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
         results = []
+        writer = vector_store.bulk_writer()
         
         for file_path in file_paths:
             try:
-                doc_id, metadata = self.ingest_document(file_path)
+                doc_id, metadata = self.ingest_document(file_path, writer=writer)
                 results.append((doc_id, metadata))
             except Exception as e:
                 log.error(f"Failed to ingest {file_path}: {e}")
                 results.append((None, {'error': str(e), 'file_path': file_path}))
         
+        stats, flush_errors = self.flush_writer(writer)
+        for i, (doc_id, metadata) in enumerate(results):
+            if doc_id in flush_errors:
+                results[i] = (None, {'error': flush_errors[doc_id], 'file_path': file_paths[i]})
+        
+        log.info(f"Batch ingest wrote {stats['rows_written']} chunks ({stats['rows_per_second']:.0f} rows/s)")
         return results
     
-    def save_uploaded_file(self, file_content: bytes, filename: str) -> str:
+    def flush_writer(self, writer: BulkVectorWriter) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        try:
+            return writer.flush(), {}
+        except Exception as e:
+            log.error(f"Bulk vector flush failed: {e}")
+        
+        # Rows still buffered never reached the store, so each of their documents is rolled back as a whole
+        flush_errors = {}
+        for document_id, chunk_ids in writer.pending_documents().items():
+            writer.discard(chunk_ids)
+            self.rollback_document(document_id)
+            flush_errors[document_id] = "Vector write failed, document was rolled back"
+        return writer.stats(), flush_errors
+    
+    def rollback_document(self, document_id: str):
+        try:
+            vector_store.delete_by_document(document_id)
+        except Exception as e:
+            log.error(f"Rollback of document {document_id} vectors failed: {e}")
+        metadata_store.delete_document(document_id)
+    
+    def _delete_chunks_quietly(self, chunk_ids: List[str]):
+        try:
+            vector_store.delete_chunks(chunk_ids)
+        except Exception as e:
+            log.error(f"Cleanup of {len(chunk_ids)} partially written chunks failed: {e}")
+    
+    def delete_document(self, document_id: str) -> Dict[str, Any]:
+        chunk_ids = vector_store.delete_by_document(document_id)
+        metadata_store.delete_document(document_id)
+        
+        self.schedule_compaction()
+        return {'document_id': document_id, 'chunks_deleted': len(chunk_ids)}
+    
+    def schedule_compaction(self) -> Optional[Future]:
+        threshold = settings.compaction_tombstone_ratio
+        if hybrid_search.tombstone_ratio() < threshold and vector_store.tombstone_ratio() < threshold:
+            return None
+        if self._compaction_lock.locked():
+            return None
+        return self.io_executor.submit(self.compact_indexes)
+    
+    def compact_indexes(self):
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+        
+        try:
+            threshold = settings.compaction_tombstone_ratio
+            
+            if vector_store.tombstone_ratio() >= threshold:
+                vector_store.compact()
+            
+            if hybrid_search.tombstone_ratio() >= threshold:
+                hybrid_search.compact()
+            
+            log.info("Index compaction finished")
+        except Exception as e:
+            log.error(f"Index compaction failed: {e}")
+        finally:
+            self._compaction_lock.release()
+    
+    def get_upload_path(self, filename: str) -> str:
         upload_path = Path(settings.upload_dir)
         upload_path.mkdir(exist_ok=True)
         
         file_id = str(uuid.uuid4())
         extension = Path(filename).suffix
         saved_filename = f"{file_id}{extension}"
-        file_path = upload_path / saved_filename
-        
+        return str(upload_path / saved_filename)
+    
+    def _discard_upload(self, file_path: str, pending_write: Future):
+        # Nothing references a failed upload, so its copy on disk is removed once the write settles
+        if not pending_write.cancel():
+            try:
+                pending_write.result()
+            except Exception:
+                pass
+        Path(file_path).unlink(missing_ok=True)
+    
+    def _write_file(self, file_path: str, file_content: bytes):
         with open(file_path, 'wb') as f:
             f.write(file_content)
-        
-        return str(file_path)
+    
+    def save_uploaded_file(self, file_content: bytes, filename: str) -> str:
+        file_path = self.get_upload_path(filename)
+        self._write_file(file_path, file_content)
+        return file_path
 
 
 document_ingestion = DocumentIngestion()
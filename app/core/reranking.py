@@ -1,95 +1,378 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+import numpy as np
 import openai
 from app.config import settings
+from app.core.cache import cache_manager
+from app.core.hybrid_search import hybrid_search
+from app.utils.analyzer import analyzer
 from app.utils.logging_config import log
 from app.tracing.tracer import tracer
 
 
+class CrossEncoderScorer:
+    
+    def __init__(self, model_name: str = None, max_length: int = None, batch_size: int = None, use_onnx: bool = None):
+        self.model_name = model_name or settings.cross_encoder_model
+        self.max_length = max_length or settings.cross_encoder_max_length
+        self.batch_size = batch_size or settings.cross_encoder_batch_size
+        self.use_onnx = settings.cross_encoder_onnx if use_onnx is None else use_onnx
+        self.model = None
+        self.session = None
+        self.tokenizer = None
+        self._load_lock = threading.Lock()
+    
+    def is_local(self) -> bool:
+        # True when loading needs no download: a model directory, or a model already in the Hugging Face cache
+        if Path(self.model_name).is_dir():
+            return True
+        try:
+            from huggingface_hub import try_to_load_from_cache
+        except ImportError:
+            return False
+        return isinstance(try_to_load_from_cache(self.model_name, "config.json"), str)
+    
+    def load(self):
+        with self._load_lock:
+            if self.model is not None or self.session is not None:
+                return
+            if self.use_onnx:
+                self._load_onnx()
+            else:
+                from sentence_transformers import CrossEncoder
+                self.model = CrossEncoder(self.model_name, max_length=self.max_length)
+            log.info(f"Cross-encoder {self.model_name} loaded ({'onnx int8' if self.use_onnx else 'torch'})")
+    
+    def _load_onnx(self):
+        import onnxruntime
+        from transformers import AutoTokenizer
+        
+        model_dir = Path(settings.cache_dir) / "cross_encoder" / self.model_name.replace("/", "__")
+        quantized_path = model_dir / "model.int8.onnx"
+        if not quantized_path.exists():
+            self._export_onnx(model_dir, quantized_path)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(quantized_path), options, providers=["CPUExecutionProvider"])
+    
+    def _export_onnx(self, model_dir: Path, quantized_path: Path):
+        import torch
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        
+        # Exported once and quantized to int8 weights; later starts load the cached file
+        model_dir.mkdir(parents=True, exist_ok=True)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+        sample = AutoTokenizer.from_pretrained(self.model_name)(["query"], ["passage"], return_tensors="pt")
+        float_path = model_dir / "model.onnx"
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(float_path),
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["logits"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in ["input_ids", "attention_mask", "token_type_ids"]},
+            opset_version=14
+        )
+        quantize_dynamic(str(float_path), str(quantized_path), weight_type=QuantType.QInt8)
+        float_path.unlink()
+    
+    def score(self, query: str, passages: List[str]) -> np.ndarray:
+        self.load()
+        if not passages:
+            return np.zeros(0)
+        
+        if self.model is not None:
+            # One batched forward pass per batch_size pairs; passages past max_length tokens are truncated
+            pairs = [(query, passage) for passage in passages]
+            return np.asarray(self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False))
+        
+        scores = []
+        for start in range(0, len(passages), self.batch_size):
+            batch = passages[start:start + self.batch_size]
+            encoded = self.tokenizer(
+                [query] * len(batch),
+                batch,
+                truncation="only_second",
+                max_length=self.max_length,
+                padding=True,
+                return_tensors="np"
+            )
+            inputs = {node.name: encoded[node.name].astype(np.int64) for node in self.session.get_inputs()}
+            logits = self.session.run(None, inputs)[0].reshape(len(batch), -1)[:, 0]
+            # Same sigmoid activation CrossEncoder.predict applies to single-label models
+            scores.append(1 / (1 + np.exp(-logits)))
+        return np.concatenate(scores)
+
+
 class Reranker:
     
     def __init__(self):
         self.enabled = settings.enable_reranking
         self.top_k = settings.reranking_top_k
         self.use_openai = settings.openai_api_key and settings.validate_api_key()
+        self.backend = settings.rerank_backend
+        self.timeout = settings.rerank_timeout
+        self.llm_model = settings.llm_rerank_model
+        self.llm_mode = settings.llm_rerank_mode
+        self.llm_candidates = settings.llm_rerank_candidates
+        self.cross_encoder = CrossEncoderScorer()
+        self.cross_encoder_available = True
+        self.cross_encoder_local = None  # checked on first use; auto never downloads a model
+        self.executor = ThreadPoolExecutor(max_workers=settings.async_workers)
+        # Inference that misses its budget keeps its thread until it returns, so it gets a bounded pool of its own
+        self.cross_encoder_executor = ThreadPoolExecutor(max_workers=settings.cross_encoder_workers)
     
-    def rerank_with_openai(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        if not self.use_openai:
-            return results
+    def warmup(self):
+        # Model loading can take seconds; doing it in the background keeps the first query inside its budget
+        if self.enabled and self.select_backend() == "cross_encoder":
+            self.executor.submit(self._load_cross_encoder)
+    
+    def _load_cross_encoder(self):
+        if not self.cross_encoder_available:
+            return
+        try:
+            self.cross_encoder.load()
+        except Exception as e:
+            self.cross_encoder_available = False
+            log.warning(f"Cross-encoder {self.cross_encoder.model_name} unavailable, reranking falls back: {e}")
+    
+    def select_backend(self) -> str:
+        if self.backend != "auto":
+            return self.backend
+        if self.cross_encoder_available and self.cross_encoder_local is None:
+            self.cross_encoder_local = self.cross_encoder.is_local()
+        if self.cross_encoder_available and self.cross_encoder_local:
+            return "cross_encoder"
+        return "openai" if self.use_openai else "simple"
+    
+    def _cross_encoder_scores(self, query: str, results: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        self._load_cross_encoder()
+        if not self.cross_encoder_available:
+            return None
+        try:
+            return self.cross_encoder.score(query, [result['content'] or "" for result in results])
+        except Exception as e:
+            log.error(f"Cross-encoder reranking error: {e}")
+            return None
+    
+    def _apply_cross_encoder_scores(self, results: List[Dict[str, Any]], scores: np.ndarray) -> Tuple[List[Dict[str, Any]], bool]:
+        for result, score in zip(results, scores):
+            result['rerank_score'] = float(score)
+        results.sort(key=lambda x: x['rerank_score'], reverse=True)
         
+        log.info(f"Reranked {len(results)} results with cross-encoder {self.cross_encoder.model_name}")
+        return results, True
+    
+    def rerank_with_cross_encoder(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        future = self.cross_encoder_executor.submit(self._cross_encoder_scores, query, results)
         try:
-            client = openai.OpenAI(api_key=settings.openai_api_key)
-            
-            scored_results = []
-            
-            for result in results[:10]:
-                prompt = f"""Rate the relevance of this content to the query on a scale of 0-10.
+            scores = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The worker only returns scores, so abandoning it leaves the results untouched
+            future.cancel()
+            log.warning(f"Cross-encoder reranking missed its {self.timeout}s budget, keeping retrieval order")
+            return results, False
+        
+        if scores is None:
+            # A model that cannot load hands over to the next backend; a failed call keeps retrieval order
+            return self.rerank_with_status(query, results) if self.select_backend() != "cross_encoder" else (results, False)
+        return self._apply_cross_encoder_scores(results, scores)
+    
+    async def rerank_async(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        # The flag is False whenever retrieval order comes back (disabled, timed out or failed)
+        if not self.enabled or not results:
+            return results, False
+        
+        backend = self.select_backend()
+        if backend == "openai" and self.use_openai:
+            return await self.rerank_with_openai_async(query, results)
+        if backend != "cross_encoder":
+            return self.rerank_with_status(query, results)
+        
+        # Inference runs on the worker pool so the event loop keeps serving other requests meanwhile
+        future = self.cross_encoder_executor.submit(self._cross_encoder_scores, query, results)
+        try:
+            scores = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Cross-encoder reranking missed its {self.timeout}s budget, keeping retrieval order")
+            return results, False
+        
+        if scores is None:
+            # The next backend is awaited too, so an LLM fallback never blocks the event loop
+            return await self.rerank_async(query, results) if self.select_backend() != "cross_encoder" else (results, False)
+        return self._apply_cross_encoder_scores(results, scores)
+    
+    def _pointwise_prompt(self, query: str, result: Dict[str, Any]) -> str:
+        return f"""Rate the relevance of this content to the query on a scale of 0-10.
 Query: {query}
-Content: {result['content'][:500]}
+Content: {(result['content'] or '')[:500]}
 
 Respond with only a number between 0 and 10."""
-                
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=10,
-                    temperature=0
-                )
-                
-                score_text = response.choices[0].message.content.strip()
-                
-                try:
-                    relevance_score = float(score_text)
-                    result['rerank_score'] = relevance_score / 10.0
-                except ValueError:
-                    result['rerank_score'] = result['score']
-                
-                scored_results.append(result)
-                
-                tracer.log_llm_call(
-                    model="gpt-3.5-turbo",
-                    prompt=prompt[:100],
-                    response=score_text,
-                    tokens_used=response.usage.total_tokens
-                )
+    
+    def _listwise_prompt(self, query: str, results: List[Dict[str, Any]]) -> str:
+        passages = "\n\n".join(
+            f"[{i}] {(result['content'] or '')[:500]}" for i, result in enumerate(results, start=1)
+        )
+        return f"""Rate the relevance of each passage to the query on a scale of 0-10.
+Query: {query}
+
+{passages}
+
+Respond with only a JSON object mapping every passage number to its score, for example {{"1": 7, "2": 0}}."""
+    
+    async def _complete(self, client: openai.AsyncOpenAI, prompt: str, max_tokens: int, json_output: bool = False) -> str:
+        response = await client.chat.completions.create(
+            model=self.llm_model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0,
+            response_format={"type": "json_object"} if json_output else openai.NOT_GIVEN
+        )
+        content = response.choices[0].message.content.strip()
+        
+        tracer.log_llm_call(
+            model=self.llm_model,
+            prompt=prompt[:100],
+            response=content,
+            tokens_used=response.usage.total_tokens
+        )
+        return content
+    
+    async def _listwise_scores(self, client: openai.AsyncOpenAI, query: str, results: List[Dict[str, Any]]) -> Dict[str, float]:
+        # Every candidate is scored in a single completion instead of one round-trip each
+        content = await self._complete(client, self._listwise_prompt(query, results), 20 + 8 * len(results), json_output=True)
+        
+        scores = {}
+        for number, score in json.loads(content).items():
+            i = int(number) - 1
+            if 0 <= i < len(results):
+                scores[results[i]['chunk_id']] = min(max(float(score), 0.0), 10.0) / 10.0
+        return scores
+    
+    async def _pointwise_scores(self, client: openai.AsyncOpenAI, query: str, results: List[Dict[str, Any]]) -> Dict[str, float]:
+        # For models that rate one passage at a time; the calls overlap, so latency is one round-trip
+        replies = await asyncio.gather(
+            *[self._complete(client, self._pointwise_prompt(query, result), 10) for result in results],
+            return_exceptions=True
+        )
+        
+        scores = {}
+        for result, reply in zip(results, replies):
+            try:
+                scores[result['chunk_id']] = float(reply) / 10.0
+            except (TypeError, ValueError):
+                log.warning(f"Unusable rerank score for {result['chunk_id']}: {reply}")
+        return scores
+    
+    async def rerank_with_openai_async(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        if not self.use_openai:
+            return results, False
+        
+        try:
+            candidates = results[:self.llm_candidates]
+            # Scores are cached per query, passage text and model, so a repeated query makes no LLM call
+            passages = {result['chunk_id']: result['content'] or "" for result in candidates}
+            scores = cache_manager.get_rerank_scores(query, passages, self.llm_model)
+            missing = [result for result in candidates if result['chunk_id'] not in scores]
             
-            scored_results.sort(key=lambda x: x['rerank_score'], reverse=True)
+            if missing:
+                client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
+                if self.llm_mode == "pointwise":
+                    computed = await self._pointwise_scores(client, query, missing)
+                else:
+                    computed = await self._listwise_scores(client, query, missing)
+                cache_manager.set_rerank_scores(query, computed, passages, self.llm_model)
+                scores.update(computed)
             
-            for result in results[10:]:
-                result['rerank_score'] = result['score']
-                scored_results.append(result)
+            scored = [result for result in candidates if result['chunk_id'] in scores]
+            for result in scored:
+                result['rerank_score'] = scores[result['chunk_id']]
+            scored_results = sorted(scored, key=lambda x: x['rerank_score'], reverse=True)
+
+            # Retrieval scores are on another scale, so candidates the model skipped follow the scored ones
+            scored_results += [result for result in candidates if result['chunk_id'] not in scores]
+            scored_results += results[self.llm_candidates:]
             
-            log.info("Reranked results using OpenAI")
-            return scored_results
+            log.info(
+                f"Reranked results using OpenAI {self.llm_mode} "
+                f"({len(candidates) - len(missing)} cached, {len(missing)} scored)"
+            )
+            return scored_results, True
             
         except Exception as e:
             log.error(f"Reranking error: {e}")
-            return results
+            return results, False
     
-    def simple_rerank(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        query_terms = set(query.lower().split())
+    def rerank_with_openai(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        # Runs on a worker thread's own event loop, so it is safe to call whether or not a loop is running here
+        return self.executor.submit(asyncio.run, self.rerank_with_openai_async(query, results)).result()
+    
+    def term_scores(self, query: str, results: List[Dict[str, Any]]) -> np.ndarray:
+        # Same analysis as the sparse index, so "report," and "Reports" both count as "report"
+        terms = list(dict.fromkeys(analyzer.analyze_query(query)))
+        if not terms:
+            return np.zeros(len(results))
         
-        for result in results:
-            content_terms = set(result['content'].lower().split())
-            overlap = len(query_terms.intersection(content_terms))
-            
-            term_score = overlap / len(query_terms) if query_terms else 0
-            result['rerank_score'] = (result['score'] * 0.7) + (term_score * 0.3)
+        index = hybrid_search.index if hybrid_search.loaded else None
+        if index is not None:
+            # Term vectors were stored at ingest, so indexed chunks are never re-tokenized here
+            tfs, lengths, known = index.term_matrix([result['chunk_id'] for result in results], terms)
+        else:
+            tfs, lengths, known = np.zeros((len(results), len(terms))), np.zeros(len(results)), np.zeros(len(results), dtype=bool)
+        
+        for row in np.flatnonzero(~known):
+            counts = Counter(analyzer.analyze(results[row]['content'] or ""))
+            tfs[row] = [counts.get(term, 0) for term in terms]
+            lengths[row] = sum(counts.values())
+        
+        if index is not None and len(index):
+            idf = np.array([index.idf(index.document_frequency(term)) for term in terms])
+            avgdl = index.total_length / len(index) or 1.0
+            k1, b = index.k1, index.b
+        else:
+            idf = np.ones(len(terms))
+            avgdl = lengths.mean() or 1.0
+            k1, b = 1.5, 0.75
+        
+        overlap = (tfs > 0).sum(axis=1) / len(terms)
+        bm25 = (idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths[:, None] / avgdl))).sum(axis=1)
+        if bm25.max() > 0:
+            bm25 /= bm25.max()
+        return 0.5 * overlap + 0.5 * bm25
+    
+    def simple_rerank(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        scores = np.array([result['score'] for result in results]) * 0.7 + self.term_scores(query, results) * 0.3
+        for result, score in zip(results, scores):
+            result['rerank_score'] = float(score)
         
         results.sort(key=lambda x: x['rerank_score'], reverse=True)
         
-        log.info("Reranked results using simple term overlap")
+        log.info("Reranked results using term overlap and BM25")
         return results
     
-    def rerank(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def rerank_with_status(self, query: str, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
         if not self.enabled or not results:
-            return results
+            return results, False
         
-        if self.use_openai and len(results) <= 10:
+        backend = self.select_backend()
+        if backend == "cross_encoder":
+            return self.rerank_with_cross_encoder(query, results)
+        if backend == "openai" and self.use_openai:
             return self.rerank_with_openai(query, results)
-        else:
-            return self.simple_rerank(query, results)
+        return self.simple_rerank(query, results), True
+    
+    def rerank(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self.rerank_with_status(query, results)[0]
 
 
 reranker = Reranker()
 
-__all__ = ["Reranker", "reranker"]
\ No newline at end of file
+__all__ = ["CrossEncoderScorer", "Reranker", "reranker"]
\ No newline at end of file
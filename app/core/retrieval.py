@@ -13,51 +13,133 @@ class RetrievalSystem:
         self.top_k = settings.top_k_results
         self.similarity_threshold = settings.similarity_threshold
     
+    def cache_params(
+        self,
+        top_k: int,
+        file_types: Optional[List[str]],
+        similarity_threshold: float,
+        search_ef: Optional[int],
+        tenant: Optional[str] = None
+    ) -> Dict[str, Any]:
+        # Everything that changes the result list belongs in the cache key
+        return {
+            'top_k': top_k,
+            'file_types': sorted(file_types) if file_types else None,
+            'similarity_threshold': similarity_threshold,
+            'search_ef': search_ef,
+            'tenant': tenant,
+            'backend': vector_store.backend
+        }
+    
+    def where_filter(self, file_types: Optional[List[str]] = None, tenant: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        # A tenant restriction also lets a store sharded by tenant skip every other tenant's shard
+        clauses = []
+        if file_types:
+            clauses.append({"file_type": {"$in": file_types}})
+        if tenant:
+            clauses.append({"tenant": tenant})
+        if len(clauses) > 1:
+            return {"$and": clauses}
+        return clauses[0] if clauses else None
+    
     def retrieve(
         self,
         query: str,
         top_k: int = None,
         file_types: List[str] = None,
-        similarity_threshold: float = None
+        similarity_threshold: float = None,
+        search_ef: int = None,
+        tenant: str = None
     ) -> List[Dict[str, Any]]:
         
         top_k = top_k or self.top_k
         similarity_threshold = similarity_threshold or 0.0  # DEBUG: Accept any result
         
-        cached_result = cache_manager.get_query_result(query)
-        if cached_result:
+        # Taken once before searching and reused to store the result, so a write landing mid-search can never
+        # file pre-write results under the new generation
+        generation = vector_store.applied_generation()
+        cache_key = cache_manager.query_key(query, self.cache_params(top_k, file_types, similarity_threshold, search_ef, tenant), generation)
+        cached_result = cache_manager.get_query_result(cache_key)
+        if cached_result is not None:
             log.info("Retrieved results from cache")
-            return cached_result[:top_k]
+            return cached_result
         
         query_embedding = text_embedder.embed_text(query)
         
-        where_filter = None
-        if file_types:
-            where_filter = {"file_type": {"$in": file_types}}
-        
         results = vector_store.query(
             query_embedding=query_embedding,
             n_results=top_k * 2,
-            where=where_filter
+            where=self.where_filter(file_types, tenant),
+            search_ef=search_ef
         )
         
+        formatted_results = self._format_results(results, 0, top_k, similarity_threshold)
+        
+        cache_manager.set_query_result(cache_key, formatted_results)
+        
+        log.info(f"Retrieved {len(formatted_results)} results for query")
+        return formatted_results
+    
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        top_k: int = None,
+        file_types: List[str] = None,
+        similarity_threshold: float = None,
+        search_ef: int = None,
+        tenant: str = None
+    ) -> List[List[Dict[str, Any]]]:
+        top_k = top_k or self.top_k
+        similarity_threshold = similarity_threshold or 0.0
+        
+        cache_params = self.cache_params(top_k, file_types, similarity_threshold, search_ef, tenant)
+        generation = vector_store.applied_generation()
+        cache_keys = [cache_manager.query_key(query, cache_params, generation) for query in queries]
+        batch_results = [cache_manager.get_query_result(key) for key in cache_keys]
+        
+        missing = [i for i, result in enumerate(batch_results) if result is None]
+        if missing:
+            query_embeddings = text_embedder.embed_batch([queries[i] for i in missing])
+            
+            # A single multi-embedding query instead of one vector search per query
+            results = vector_store.query_batch(
+                query_embeddings=query_embeddings,
+                n_results=top_k * 2,
+                where=self.where_filter(file_types, tenant),
+                search_ef=search_ef
+            )
+            
+            for position, i in enumerate(missing):
+                batch_results[i] = self._format_results(results, position, top_k, similarity_threshold)
+                cache_manager.set_query_result(cache_keys[i], batch_results[i])
+        
+        log.info(f"Retrieved results for {len(queries)} queries ({len(queries) - len(missing)} from cache)")
+        return batch_results
+    
+    def _format_results(
+        self,
+        results: Dict[str, Any],
+        query_index: int,
+        top_k: int,
+        similarity_threshold: float
+    ) -> List[Dict[str, Any]]:
         formatted_results = []
         
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                chunk_id = results['ids'][0][i]
-                distance = results['distances'][0][i]
+        if results['ids'] and len(results['ids'][query_index]) > 0:
+            for i in range(len(results['ids'][query_index])):
+                chunk_id = results['ids'][query_index][i]
+                distance = results['distances'][query_index][i]
                 score = 1 - distance
                 
                 if score < similarity_threshold:
                     continue
                 
-                metadata = results['metadatas'][0][i]
+                metadata = results['metadatas'][query_index][i]
                 
                 result = {
                     'chunk_id': chunk_id,
                     'document_id': metadata.get('document_id', 'unknown'),
-                    'content': results['documents'][0][i],
+                    'content': results['documents'][query_index][i],
                     'score': float(score),
                     'metadata': metadata,
                     'file_type': metadata.get('file_type', 'text'),
@@ -68,35 +150,29 @@ class RetrievalSystem:
                 formatted_results.append(result)
         
         formatted_results.sort(key=lambda x: x['score'], reverse=True)
-        formatted_results = formatted_results[:top_k]
-        
-        cache_manager.set_query_result(query, formatted_results)
-        
-        log.info(f"Retrieved {len(formatted_results)} results for query")
-        return formatted_results
+        return formatted_results[:top_k]
     
     def retrieve_by_document_id(self, document_id: str) -> List[Dict[str, Any]]:
-        results = vector_store.query(
-            query_embedding=[0] * settings.embedding_dimension,
-            n_results=1000,
-            where={"document_id": document_id}
-        )
-        
-        formatted_results = []
-        
-        if results['ids'] and len(results['ids'][0]) > 0:
-            for i in range(len(results['ids'][0])):
-                result = {
-                    'chunk_id': results['ids'][0][i],
-                    'document_id': document_id,
-                    'content': results['documents'][0][i],
-                    'metadata': results['metadatas'][0][i],
-                    'chunk_index': results['metadatas'][0][i].get('chunk_index', 0)
-                }
-                formatted_results.append(result)
-        
-        formatted_results.sort(key=lambda x: x['chunk_index'])
-        return formatted_results
+        chunks = vector_store.get_document_chunks(document_id)
+        return [self._format_chunk(chunk, document_id) for chunk in chunks]
+    
+    def retrieve_chunk_window(
+        self,
+        document_id: str,
+        chunk_index: int,
+        window: int = 1
+    ) -> List[Dict[str, Any]]:
+        chunks = vector_store.get_chunk_window(document_id, chunk_index, window=window)
+        return [self._format_chunk(chunk, document_id) for chunk in chunks]
+    
+    def _format_chunk(self, chunk: Dict[str, Any], document_id: str) -> Dict[str, Any]:
+        return {
+            'chunk_id': chunk['id'],
+            'document_id': document_id,
+            'content': chunk['document'],
+            'metadata': chunk['metadata'],
+            'chunk_index': chunk['metadata'].get('chunk_index', 0)
+        }
 
 
 retrieval_system = RetrievalSystem()
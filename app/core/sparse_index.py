@@ -0,0 +1,1055 @@
+import hashlib
+import json
+import math
+import operator
+import os
+import shutil
+import threading
+import uuid
+from functools import lru_cache
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+import numpy as np
+from app.utils.analyzer import Analyzer, analyzer as default_analyzer
+from app.utils.file_lock import file_lock
+
+
+SEGMENT_FORMAT = 5
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+BLOCK_SIZE = 128
+EXACT_POSTINGS = 4 * BLOCK_SIZE
+
+# Metadata attributes kept as per-value doc sets, so sparse queries can filter before scoring
+INDEXED_ATTRIBUTES = ("file_type", "document_id", "upload_date", "tenant")
+ARRAY_CONTAINER = 0
+BITMAP_CONTAINER = 1
+FILTER_PRUNING_RATIO = 0.5
+RANGE_OPERATORS = {
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le
+}
+
+
+def chunk_hash(chunk_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode(), digest_size=8).digest(), 'little')
+
+
+def attribute_key(attribute: str, value: Any) -> str:
+    return f"{attribute}={value}"
+
+
+def _load_array(path: Path) -> np.ndarray:
+    try:
+        # A plain ndarray view over the mapping avoids np.memmap's per-slice overhead
+        return np.load(path, mmap_mode='r').view(np.ndarray)
+    except ValueError:
+        # Zero-length arrays cannot be memory-mapped
+        return np.load(path)
+
+
+class StringTable:
+    
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.data = memoryview(blob)
+        self.offsets = offsets
+    
+    @classmethod
+    def load(cls, path: Path, name: str) -> "StringTable":
+        return cls(_load_array(path / f"{name}.npy"), _load_array(path / f"{name}_offsets.npy"))
+    
+    @staticmethod
+    def write(path: Path, name: str, values: List[str]):
+        encoded = [value.encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        np.save(path / f"{name}.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(path / f"{name}_offsets.npy", offsets)
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i: int) -> str:
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+    
+    def lower_bound(self, value: str, order: np.ndarray = None) -> int:
+        # Binary search straight over the mapped bytes, so lookups need no in-memory dictionary
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = int(order[mid]) if order is not None else mid
+            if self[i] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+        
+    def find(self, value: str, order: np.ndarray = None) -> Optional[int]:
+        lo = self.lower_bound(value, order)
+        if lo < len(self):
+            i = int(order[lo]) if order is not None else lo
+            if self[i] == value:
+                return i
+        return None
+
+
+class AttributeBitmaps:
+    
+    def __init__(self, path: Path, num_docs: int):
+        self.num_docs = num_docs
+        self.keys = StringTable.load(path, "attribute_keys")
+        self.kinds = _load_array(path / "attribute_kinds.npy")
+        self.starts = _load_array(path / "attribute_starts.npy")
+        self.ends = _load_array(path / "attribute_ends.npy")
+        self.arrays = _load_array(path / "attribute_arrays.npy")
+        self.bitmaps = _load_array(path / "attribute_bitmaps.npy")
+        self.key_id = lru_cache(maxsize=4096)(self.key_id)
+    
+    @staticmethod
+    def write(path: Path, attributes: Dict[str, np.ndarray], num_docs: int):
+        keys = sorted(attributes)
+        kinds = []
+        starts = []
+        ends = []
+        arrays = []
+        bitmaps = []
+        array_size = 0
+        bitmap_size = 0
+        
+        # Like roaring bitmaps: sparse values keep gap-encoded doc lists, dense ones a bit per doc
+        for key in keys:
+            docs = attributes[key]
+            if len(docs) * 32 > num_docs:
+                bits = np.zeros(num_docs, dtype=bool)
+                bits[docs] = True
+                packed = np.packbits(bits)
+                kinds.append(BITMAP_CONTAINER)
+                starts.append(bitmap_size)
+                bitmap_size += len(packed)
+                bitmaps.append(packed)
+                ends.append(bitmap_size)
+            else:
+                kinds.append(ARRAY_CONTAINER)
+                starts.append(array_size)
+                array_size += len(docs)
+                arrays.append(np.diff(docs, prepend=0).astype(np.uint32))
+                ends.append(array_size)
+        
+        StringTable.write(path, "attribute_keys", keys)
+        np.save(path / "attribute_kinds.npy", np.array(kinds, dtype=np.uint8))
+        np.save(path / "attribute_starts.npy", np.array(starts, dtype=np.int64))
+        np.save(path / "attribute_ends.npy", np.array(ends, dtype=np.int64))
+        np.save(path / "attribute_arrays.npy", np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.uint32))
+        np.save(path / "attribute_bitmaps.npy", np.concatenate(bitmaps) if bitmaps else np.zeros(0, dtype=np.uint8))
+    
+    def key_id(self, key: str) -> Optional[int]:
+        return self.keys.find(key)
+    
+    def docs_at(self, i: int) -> np.ndarray:
+        start, end = self.starts[i], self.ends[i]
+        if self.kinds[i] == BITMAP_CONTAINER:
+            return np.flatnonzero(np.unpackbits(self.bitmaps[start:end], count=self.num_docs))
+        return np.cumsum(self.arrays[start:end], dtype=np.int64)
+    
+    def mark(self, i: int, mask: np.ndarray):
+        start, end = self.starts[i], self.ends[i]
+        if self.kinds[i] == BITMAP_CONTAINER:
+            mask[:self.num_docs] |= np.unpackbits(self.bitmaps[start:end], count=self.num_docs).view(bool)
+        else:
+            mask[np.cumsum(self.arrays[start:end], dtype=np.int64)] = True
+    
+    def values(self, attribute: str) -> Iterator[Tuple[str, int]]:
+        prefix = attribute_key(attribute, "")
+        i = self.keys.lower_bound(prefix)
+        while i < len(self.keys):
+            key = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            yield key[len(prefix):], i
+            i += 1
+
+
+class SparseSegment:
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        with open(self.path / MANIFEST_FILE, 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != SEGMENT_FORMAT:
+            raise ValueError(f"Unsupported sparse segment format: {self.manifest.get('format')}")
+        
+        self.num_docs = self.manifest['documents']
+        self.total_length = self.manifest['total_length']
+        self.terms = StringTable.load(self.path, "terms")
+        self.chunk_ids = StringTable.load(self.path, "chunk_ids")
+        self.chunk_hashes = _load_array(self.path / "chunk_hashes.npy")
+        self.chunk_hash_docs = _load_array(self.path / "chunk_hash_docs.npy")
+        self.postings_offsets = _load_array(self.path / "postings_offsets.npy")
+        self.doc_gaps = _load_array(self.path / "doc_gaps.npy")
+        self.term_freqs = _load_array(self.path / "term_freqs.npy")
+        self.doc_lengths = _load_array(self.path / "doc_lengths.npy")
+        self.block_offsets = _load_array(self.path / "block_offsets.npy")
+        self.block_first_docs = _load_array(self.path / "block_first_docs.npy")
+        self.block_last_docs = _load_array(self.path / "block_last_docs.npy")
+        self.block_max_tfs = _load_array(self.path / "block_max_tfs.npy")
+        self.block_min_lengths = _load_array(self.path / "block_min_lengths.npy")
+        self.forward_keys = _load_array(self.path / "forward_keys.npy")
+        self.forward_tfs = _load_array(self.path / "forward_tfs.npy")
+        self.attributes = AttributeBitmaps(self.path, self.num_docs)
+        self.term_id = lru_cache(maxsize=65536)(self.term_id)
+    
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / MANIFEST_FILE).exists()
+    
+    @staticmethod
+    def write(
+        path: str,
+        chunk_ids: List[str],
+        doc_lengths: np.ndarray,
+        postings: Iterator[Tuple[str, np.ndarray, np.ndarray]],
+        attributes: Dict[str, np.ndarray] = None,
+        analyzer: Dict[str, Any] = None
+    ):
+        path = Path(path)
+        path.mkdir(parents=True)
+        AttributeBitmaps.write(path, attributes or {}, len(chunk_ids))
+        
+        doc_lengths = np.asarray(doc_lengths, dtype=np.uint32)
+        terms = []
+        offsets = [0]
+        gaps = []
+        freqs = []
+        block_offsets = [0]
+        blocks = []
+        forward_docs = []
+        # Doc numbers within a posting list ascend, so storing gaps keeps the values small
+        for term, docs, tfs in postings:
+            forward_docs.append(docs)
+            terms.append(term)
+            gaps.append(np.diff(docs, prepend=0))
+            freqs.append(tfs)
+            offsets.append(offsets[-1] + len(docs))
+        
+            # Per-block maxima let queries bound a block's best score without decoding it
+            starts = np.arange(0, len(docs), BLOCK_SIZE)
+            ends = np.minimum(starts + BLOCK_SIZE, len(docs)) - 1
+            blocks.append((
+                docs[starts],
+                docs[ends],
+                np.maximum.reduceat(tfs, starts),
+                np.minimum.reduceat(doc_lengths[docs], starts)
+            ))
+            block_offsets.append(block_offsets[-1] + len(starts))
+        
+        np.save(path / "doc_gaps.npy", np.concatenate(gaps).astype(np.uint32) if gaps else np.zeros(0, dtype=np.uint32))
+        np.save(path / "term_freqs.npy", np.concatenate(freqs).astype(np.uint32) if freqs else np.zeros(0, dtype=np.uint32))
+        np.save(path / "postings_offsets.npy", np.array(offsets, dtype=np.int64))
+        np.save(path / "doc_lengths.npy", doc_lengths)
+        np.save(path / "block_offsets.npy", np.array(block_offsets, dtype=np.int64))
+        for i, name in enumerate(("block_first_docs", "block_last_docs", "block_max_tfs", "block_min_lengths")):
+            values = np.concatenate([block[i] for block in blocks]) if blocks else np.zeros(0)
+            np.save(path / f"{name}.npy", values.astype(np.uint32))
+        
+        # The same postings keyed doc-major as doc * vocabulary + term, so any (chunk, term) pair is one binary search
+        all_docs = np.concatenate(forward_docs).astype(np.uint64) if forward_docs else np.zeros(0, dtype=np.uint64)
+        keys = all_docs * np.uint64(len(terms)) + np.repeat(np.arange(len(terms), dtype=np.uint64), np.diff(offsets))
+        by_key = np.argsort(keys)
+        np.save(path / "forward_keys.npy", keys[by_key])
+        np.save(path / "forward_tfs.npy", (np.concatenate(freqs) if freqs else np.zeros(0))[by_key].astype(np.uint32))
+        # Sorted chunk id hashes resolve a whole candidate list with one searchsorted
+        hashes = np.array([chunk_hash(chunk_id) for chunk_id in chunk_ids], dtype=np.uint64)
+        hash_order = np.argsort(hashes, kind='stable')
+        np.save(path / "chunk_hashes.npy", hashes[hash_order])
+        np.save(path / "chunk_hash_docs.npy", hash_order.astype(np.int64))
+        StringTable.write(path, "terms", terms)
+        StringTable.write(path, "chunk_ids", chunk_ids)
+        
+        manifest = {
+            'format': SEGMENT_FORMAT,
+            'created_at': datetime.now().isoformat(),
+            'documents': len(chunk_ids),
+            'total_length': int(np.sum(doc_lengths, dtype=np.int64)),
+            'terms': len(terms),
+            'postings': offsets[-1],
+            'analyzer': analyzer
+        }
+        with open(path / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    
+    def term_id(self, term: str) -> Optional[int]:
+        return self.terms.find(term)
+    
+    def doc_number(self, chunk_id: str) -> Optional[int]:
+        doc = int(self.doc_numbers([chunk_id])[0])
+        return doc if doc >= 0 else None
+    
+    def doc_numbers(self, chunk_ids: List[str]) -> np.ndarray:
+        hashes = np.array([chunk_hash(chunk_id) for chunk_id in chunk_ids], dtype=np.uint64)
+        positions = np.searchsorted(self.chunk_hashes, hashes)
+        docs = np.full(len(chunk_ids), -1, dtype=np.int64)
+        
+        for i, position in enumerate(positions):
+            # Colliding hashes sit next to each other; the stored id settles which doc it is
+            while position < len(self.chunk_hashes) and self.chunk_hashes[position] == hashes[i]:
+                doc = int(self.chunk_hash_docs[position])
+                if self.chunk_ids[doc] == chunk_ids[i]:
+                    docs[i] = doc
+                    break
+                position += 1
+        return docs
+    
+    def document_frequency(self, term_id: int) -> int:
+        return int(self.postings_offsets[term_id + 1] - self.postings_offsets[term_id])
+    
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+        return np.cumsum(self.doc_gaps[start:end], dtype=np.int64), np.asarray(self.term_freqs[start:end])
+    
+    def blocks(self, term_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        start, end = self.block_offsets[term_id], self.block_offsets[term_id + 1]
+        return (
+            np.asarray(self.block_first_docs[start:end], dtype=np.int64),
+            np.asarray(self.block_last_docs[start:end], dtype=np.int64),
+            np.asarray(self.block_max_tfs[start:end], dtype=np.float64),
+            np.asarray(self.block_min_lengths[start:end], dtype=np.float64)
+        )
+    
+    def doc_term_freqs(self, docs: np.ndarray, term_ids: np.ndarray) -> np.ndarray:
+        if not len(self.forward_keys):
+            return np.zeros((len(docs), len(term_ids)))
+        keys = docs.astype(np.uint64)[:, None] * np.uint64(len(self.terms)) + term_ids.astype(np.uint64)[None, :]
+        positions = np.minimum(np.searchsorted(self.forward_keys, keys), len(self.forward_keys) - 1)
+        return np.where(self.forward_keys[positions] == keys, self.forward_tfs[positions], 0)
+    
+    def decode_blocks(self, term_id: int, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        starts = self.postings_offsets[term_id] + blocks * BLOCK_SIZE
+        lengths = np.minimum(starts + BLOCK_SIZE, self.postings_offsets[term_id + 1]) - starts
+        owner = np.repeat(np.arange(len(blocks)), lengths)
+        positions = starts[owner] + np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        
+        # Each block's first gap is relative to the previous block, so decode from the stored first doc instead
+        gaps = np.asarray(self.doc_gaps[positions], dtype=np.int64)
+        running = np.cumsum(gaps)
+        block_starts = np.cumsum(lengths) - lengths
+        first_docs = np.asarray(self.block_first_docs[self.block_offsets[term_id] + blocks], dtype=np.int64)
+        docs = running - running[block_starts][owner] + first_docs[owner]
+        return docs, np.asarray(self.term_freqs[positions])
+
+
+class SegmentDirectory:
+    # Published segments live in their own directories next to a journal of the writes made since. CURRENT names
+    # both and is replaced atomically; every worker appends to the journal and publishes under one file lock
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+    
+    def lock(self, blocking: bool = True):
+        return file_lock(self.path / "write.lock", blocking=blocking)
+    
+    def flush_lock(self):
+        return file_lock(self.path / "flush.lock", blocking=False)
+    
+    def current(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path / CURRENT_FILE, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def segment_path(self, state: Dict[str, Any]) -> Optional[Path]:
+        return self.path / state['segment'] if state.get('segment') else None
+    
+    def staging_path(self) -> Path:
+        return self.path / f"partial_{uuid.uuid4().hex}"
+    
+    def journal_size(self, state: Dict[str, Any]) -> int:
+        return (self.path / state['journal']).stat().st_size
+    
+    def append(self, record: Dict[str, Any]):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock():
+            state = self.current() or self.publish(None, None)
+            with open(self.path / state['journal'], 'a') as f:
+                f.write(line)
+    
+    def read(self, state: Dict[str, Any], offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        with open(self.path / state['journal'], 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # Appends are not atomic for readers, so a trailing partial line waits for the next read
+        end = data.rfind(b"\n") + 1
+        return [json.loads(line) for line in data[:end].splitlines()], offset + end
+    
+    def publish(
+        self,
+        staging: Optional[Path],
+        generation: Optional[int],
+        records: List[Dict[str, Any]] = ()
+    ) -> Dict[str, Any]:
+        # Callers hold lock(); records are journal entries the new segment does not contain yet
+        self.path.mkdir(parents=True, exist_ok=True)
+        previous = self.current()
+        name = uuid.uuid4().hex
+        state = {
+            'segment': None,
+            'journal': f"journal_{name}.jsonl",
+            'generation': generation,  # store generation the segment reflects; None until first built
+            'published_at': datetime.now().isoformat()
+        }
+        if staging is not None:
+            state['segment'] = f"segment_{name}"
+            staging.rename(self.path / state['segment'])
+        with open(self.path / state['journal'], 'w') as f:
+            f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+        
+        pointer = self.path / (CURRENT_FILE + ".tmp")
+        with open(pointer, 'w') as f:
+            json.dump(state, f)
+        os.replace(pointer, self.path / CURRENT_FILE)
+        
+        # Workers still reading the previous generation keep it until they follow CURRENT; older ones go
+        keep = {state['segment'], state['journal']}
+        if previous:
+            keep.update((previous['segment'], previous['journal']))
+        for entry in self.path.iterdir():
+            if entry.name.startswith(("segment_", "journal_")) and entry.name not in keep:
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    entry.unlink(missing_ok=True)
+        return state
+
+
+class InvertedIndex:
+    
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75, analyzer: Analyzer = None):
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self.analyzer = analyzer or default_analyzer
+        self._lock = threading.RLock()
+        self.segment = None
+        self.clear()
+        
+        if self.path and SparseSegment.exists(self.path):
+            self._open_segment()
+    
+    def clear(self):
+        with self._lock:
+            self.segment = None
+            self.deleted = set()  # segment doc numbers removed since it was written
+            self._clear_delta()
+            self.total_length = 0
+            self.live_docs = 0
+    
+    def _clear_delta(self):
+        # Writes since the last save live in memory; their doc numbers follow the segment's
+        self.chunk_ids: List[Optional[str]] = []
+        self.doc_numbers: Dict[str, int] = {}
+        self.doc_terms: List[Optional[Dict[str, int]]] = []
+        self.doc_lengths: List[int] = []
+        self.doc_attributes: List[Optional[List[str]]] = []
+        self.postings: Dict[str, Dict[int, int]] = {}  # term -> {delta doc number: term frequency}
+        self.attribute_docs: Dict[str, set] = {}  # attribute key -> delta doc numbers
+    
+    def _open_segment(self):
+        segment = SparseSegment(self.path)
+        if segment.manifest.get('analyzer') != self.analyzer.signature():
+            raise ValueError(f"Sparse segment at {self.path} was built with a different analyzer")
+        self.segment = segment
+        self.deleted = set()
+        self._clear_delta()
+        self.total_length = self.segment.total_length
+        self.live_docs = self.segment.num_docs
+    
+    @property
+    def base(self) -> int:
+        return self.segment.num_docs if self.segment else 0
+    
+    def add(self, chunk_id: str, text: str, metadata: Dict[str, Any] = None):
+        with self._lock:
+            self._remove(chunk_id)
+            
+            tokens = self.analyzer.analyze(text or "")
+            metadata = metadata or {}
+            keys = [
+                attribute_key(attribute, metadata[attribute])
+                for attribute in INDEXED_ATTRIBUTES if metadata.get(attribute) is not None
+            ]
+            self._append(chunk_id, dict(Counter(tokens)), len(tokens), keys)
+            self.total_length += len(tokens)
+            self.live_docs += 1
+    
+    def _append(self, chunk_id: str, terms: Dict[str, int], length: int, keys: List[str]):
+        doc = len(self.chunk_ids)
+        self.chunk_ids.append(chunk_id)
+        self.doc_terms.append(terms)
+        self.doc_lengths.append(length)
+        self.doc_attributes.append(keys)
+        self.doc_numbers[chunk_id] = doc
+        
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc] = tf
+        for key in keys:
+            self.attribute_docs.setdefault(key, set()).add(doc)
+    
+    def add_many(self, chunk_ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]] = None):
+        with self._lock:
+            for i, (chunk_id, text) in enumerate(zip(chunk_ids, texts)):
+                self.add(chunk_id, text, metadatas[i] if metadatas else None)
+    
+    def remove(self, chunk_ids: List[str]) -> int:
+        with self._lock:
+            return sum(1 for chunk_id in chunk_ids if self._remove(chunk_id))
+    
+    def _remove(self, chunk_id: str) -> bool:
+        doc = self.doc_numbers.pop(chunk_id, None)
+        if doc is not None:
+            # Only the chunk's own terms are touched, so a delete costs O(chunk) rather than O(corpus)
+            for term in self.doc_terms[doc]:
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(doc, None)
+                if not postings:
+                    del self.postings[term]
+            for key in self.doc_attributes[doc]:
+                docs = self.attribute_docs.get(key)
+                if docs is not None:
+                    docs.discard(doc)
+                    if not docs:
+                        del self.attribute_docs[key]
+            
+            self.total_length -= self.doc_lengths[doc]
+            self.chunk_ids[doc] = None
+            self.doc_terms[doc] = None
+            self.doc_attributes[doc] = None
+            self.doc_lengths[doc] = 0
+            self.live_docs -= 1
+            return True
+        
+        if self.segment is None:
+            return False
+        
+        # Segment postings are read-only; deleted docs are masked out until the next save
+        doc = self.segment.doc_number(chunk_id)
+        if doc is None or doc in self.deleted:
+            return False
+        self.deleted.add(doc)
+        self.total_length -= int(self.segment.doc_lengths[doc])
+        self.live_docs -= 1
+        return True
+    
+    def __len__(self) -> int:
+        return self.live_docs
+    
+    def __contains__(self, chunk_id: str) -> bool:
+        if chunk_id in self.doc_numbers:
+            return True
+        if self.segment is None:
+            return False
+        doc = self.segment.doc_number(chunk_id)
+        return doc is not None and doc not in self.deleted
+    
+    def delta_size(self) -> int:
+        return len(self.chunk_ids) + len(self.deleted)
+    
+    def chunk_id(self, doc: int) -> str:
+        if doc < self.base:
+            return self.segment.chunk_ids[doc]
+        return self.chunk_ids[doc - self.base]
+    
+    def idf(self, df: int) -> float:
+        # Deleted segment docs still count in df until the next save, so they count in N as well
+        total_docs = self.base + len(self.doc_numbers)
+        # The +1 keeps idf positive for common terms without a corpus-wide average to maintain
+        return math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+    
+    def document_frequency(self, term: str) -> int:
+        # Deleted segment docs keep counting until the next save, so df never needs a full decode
+        df = len(self.postings.get(term, ()))
+        if self.segment is not None:
+            term_id = self.segment.term_id(term)
+            if term_id is not None:
+                df += self.segment.document_frequency(term_id)
+        return df
+    
+    def _tf_norm(self, tfs: np.ndarray, lengths: np.ndarray, avgdl: float) -> np.ndarray:
+        tfs = np.asarray(tfs, dtype=np.float64)
+        return tfs * (self.k1 + 1) / (tfs + self.k1 * (1 - self.b + self.b * np.asarray(lengths) / avgdl))
+    
+    def term_matrix(self, chunk_ids: List[str], terms: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Term frequencies of the given chunks for the given terms, read from stored vectors without re-tokenizing
+        with self._lock:
+            tfs = np.zeros((len(chunk_ids), len(terms)))
+            lengths = np.zeros(len(chunk_ids))
+            known = np.zeros(len(chunk_ids), dtype=bool)
+            segment_rows = []
+            segment_docs = np.zeros(0, dtype=np.int64)
+            
+            for row, chunk_id in enumerate(chunk_ids):
+                doc = self.doc_numbers.get(chunk_id)
+                if doc is not None:
+                    doc_terms = self.doc_terms[doc]
+                    tfs[row] = [doc_terms.get(term, 0) for term in terms]
+                    lengths[row] = self.doc_lengths[doc]
+                    known[row] = True
+                else:
+                    segment_rows.append(row)
+            
+            if segment_rows and self.segment is not None:
+                segment_rows = np.array(segment_rows)
+                segment_docs = self.segment.doc_numbers([chunk_ids[row] for row in segment_rows])
+                live = segment_docs >= 0
+                if self.deleted:
+                    live &= ~np.isin(segment_docs, np.fromiter(self.deleted, dtype=np.int64))
+                segment_rows, segment_docs = segment_rows[live], segment_docs[live]
+            
+            if len(segment_docs):
+                lengths[segment_rows] = self.segment.doc_lengths[segment_docs]
+                known[segment_rows] = True
+                
+                term_ids = [self.segment.term_id(term) for term in terms]
+                columns = [i for i, term_id in enumerate(term_ids) if term_id is not None]
+                if columns:
+                    tfs[np.ix_(segment_rows, columns)] = self.segment.doc_term_freqs(
+                        segment_docs,
+                        np.array([term_ids[i] for i in columns], dtype=np.int64)
+                    )
+            
+            return tfs, lengths, known
+    
+    def term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        docs = []
+        tfs = []
+        lengths = []
+        
+        if self.segment is not None:
+            term_id = self.segment.term_id(term)
+            if term_id is not None:
+                segment_docs, segment_tfs = self.segment.postings(term_id)
+                if self.deleted:
+                    keep = ~np.isin(segment_docs, np.fromiter(self.deleted, dtype=np.int64))
+                    segment_docs, segment_tfs = segment_docs[keep], segment_tfs[keep]
+                docs.append(segment_docs)
+                tfs.append(segment_tfs)
+                lengths.append(self.segment.doc_lengths[segment_docs])
+        
+        delta = self.postings.get(term)
+        if delta:
+            delta_docs = np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))
+            docs.append(delta_docs + self.base)
+            tfs.append(np.fromiter(delta.values(), dtype=np.int64, count=len(delta)))
+            lengths.append(np.array([self.doc_lengths[doc] for doc in delta_docs], dtype=np.int64))
+        
+        if not docs:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        return np.concatenate(docs), np.concatenate(tfs), np.concatenate(lengths)
+    
+    def term_scores(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        docs, tfs, lengths = self.term_postings(term)
+        if not len(docs) or not self.live_docs:
+            return docs, np.zeros(0)
+        
+        avgdl = self.total_length / self.live_docs or 1.0
+        return docs, self.idf(self.document_frequency(term)) * self._tf_norm(tfs, lengths, avgdl)
+    
+    def _mark_key(self, key: str, mask: np.ndarray):
+        if self.segment is not None:
+            i = self.segment.attributes.key_id(key)
+            if i is not None:
+                self.segment.attributes.mark(i, mask)
+        delta = self.attribute_docs.get(key)
+        if delta:
+            mask[np.fromiter(delta, dtype=np.int64, count=len(delta)) + self.base] = True
+    
+    def _mark_range(self, attribute: str, accept: Callable[[str], bool], mask: np.ndarray):
+        # Range filters compare values as strings, which orders ISO dates correctly
+        if self.segment is not None:
+            for value, i in self.segment.attributes.values(attribute):
+                if accept(value):
+                    self.segment.attributes.mark(i, mask)
+        prefix = attribute_key(attribute, "")
+        for key, delta in self.attribute_docs.items():
+            if key.startswith(prefix) and accept(key[len(prefix):]):
+                mask[np.fromiter(delta, dtype=np.int64, count=len(delta)) + self.base] = True
+    
+    def _condition_mask(self, attribute: str, condition: Any) -> np.ndarray:
+        if attribute not in INDEXED_ATTRIBUTES:
+            raise ValueError(f"Sparse index cannot filter on '{attribute}'; indexed attributes are {INDEXED_ATTRIBUTES}")
+        
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        
+        result = np.ones(self.base + len(self.chunk_ids), dtype=bool)
+        for op, value in condition.items():
+            mask = np.zeros(len(result), dtype=bool)
+            if op in ("$eq", "$ne"):
+                self._mark_key(attribute_key(attribute, value), mask)
+            elif op in ("$in", "$nin"):
+                for item in value:
+                    self._mark_key(attribute_key(attribute, item), mask)
+            elif op in RANGE_OPERATORS:
+                compare = RANGE_OPERATORS[op]
+                self._mark_range(attribute, lambda item: compare(item, str(value)), mask)
+            else:
+                raise ValueError(f"Unsupported sparse filter operator: {op}")
+            
+            if op in ("$ne", "$nin"):
+                np.invert(mask, out=mask)
+            result &= mask
+        return result
+    
+    def matching_docs(self, where: Dict[str, Any]) -> np.ndarray:
+        # Same shape as the vector store's where clauses; the result is a mask over doc numbers
+        result = np.ones(self.base + len(self.chunk_ids), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    result &= self.matching_docs(clause)
+            elif key == "$or":
+                union = np.zeros(len(result), dtype=bool)
+                for clause in condition:
+                    union |= self.matching_docs(clause)
+                result &= union
+            else:
+                result &= self._condition_mask(key, condition)
+        return result
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        exhaustive: bool = False,
+        where: Dict[str, Any] = None
+    ) -> List[Tuple[str, float]]:
+        return self.search_batch([query], top_k, exhaustive=exhaustive, where=where)[0]
+    
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        exhaustive: bool = False,
+        where: Dict[str, Any] = None
+    ) -> List[List[Tuple[str, float]]]:
+        with self._lock:
+            tokenized_queries = [self.analyzer.analyze_query(query or "") for query in queries]
+            # The filter is resolved once per batch, before any posting list is read
+            allowed = None
+            if where:
+                allowed = self.matching_docs(where)
+                selected = int(np.count_nonzero(allowed))
+                if not selected:
+                    return [[] for _ in queries]
+                # A selective filter drops the docs block maxima were computed from, so the bounds stop pruning
+                exhaustive = exhaustive or selected < FILTER_PRUNING_RATIO * self.live_docs
+            
+            if not exhaustive:
+                return [self._search_pruned(tokens, top_k, allowed) for tokens in tokenized_queries]
+            
+            # Each distinct term is scored once and shared by every query in the batch
+            term_scores = {}
+            for term in {term for tokens in tokenized_queries for term in tokens}:
+                docs, scores = self.term_scores(term)
+                if allowed is not None:
+                    keep = allowed[docs]
+                    docs, scores = docs[keep], scores[keep]
+                term_scores[term] = docs, scores
+            
+            batch_results = []
+            for tokens in tokenized_queries:
+                if not tokens:
+                    batch_results.append([])
+                    continue
+                
+                docs, totals = self._sum_by_doc(
+                    [term_scores[term][0] for term in tokens],
+                    [term_scores[term][1] for term in tokens]
+                )
+                batch_results.append(self._ranked(*self._select(docs, totals, top_k)))
+            
+            return batch_results
+    
+    def _sum_by_doc(self, docs: List[np.ndarray], scores: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.zeros(0)
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        return unique_docs, np.bincount(inverse, weights=scores, minlength=len(unique_docs))
+    
+    def _select(self, docs: np.ndarray, scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(scores) <= top_k:
+            return docs, scores
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        return docs[top], scores[top]
+    
+    def _ranked(self, docs: np.ndarray, scores: np.ndarray) -> List[Tuple[str, float]]:
+        order = np.lexsort((docs, -scores))
+        return [(self.chunk_id(int(docs[i])), float(scores[i])) for i in order if scores[i] > 0]
+    
+    def _search_pruned(self, tokens: List[str], top_k: int, allowed: np.ndarray = None) -> List[Tuple[str, float]]:
+        # allowed is a mask over doc numbers, so filtering postings is a lookup rather than a set intersection
+        if not tokens or not self.live_docs or top_k <= 0:
+            return []
+        
+        avgdl = self.total_length / self.live_docs or 1.0
+        weights = {
+            term: count * self.idf(self.document_frequency(term))
+            for term, count in Counter(tokens).items()
+        }
+        
+        # Unsaved writes are few, so they are scored exhaustively and seed the heap threshold
+        docs = []
+        scores = []
+        for term, weight in weights.items():
+            delta = self.postings.get(term)
+            if delta:
+                delta_docs = np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))
+                tfs = np.fromiter(delta.values(), dtype=np.int64, count=len(delta))
+                lengths = np.array([self.doc_lengths[doc] for doc in delta_docs])
+                docs.append(delta_docs + self.base)
+                scores.append(weight * self._tf_norm(tfs, lengths, avgdl))
+        docs, totals = self._sum_by_doc(docs, scores)
+        if allowed is not None:
+            keep = allowed[docs]
+            docs, totals = docs[keep], totals[keep]
+        best_docs, best_scores = self._select(docs, totals, top_k)
+        
+        if self.segment is not None:
+            best_docs, best_scores = self._search_segment(weights, avgdl, top_k, best_docs, best_scores, allowed)
+        
+        return self._ranked(best_docs, best_scores)
+    
+    def _search_segment(
+        self,
+        weights: Dict[str, float],
+        avgdl: float,
+        top_k: int,
+        best_docs: np.ndarray,
+        best_scores: np.ndarray,
+        allowed: np.ndarray = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        segment = self.segment
+        
+        terms = []
+        for term, weight in weights.items():
+            term_id = segment.term_id(term)
+            if term_id is None:
+                continue
+            
+            if segment.document_frequency(term_id) <= EXACT_POSTINGS:
+                # Short lists are scored outright; one wide block would otherwise inflate the bound everywhere
+                docs, tfs = segment.postings(term_id)
+                if allowed is not None:
+                    keep = allowed[docs]
+                    docs, tfs = docs[keep], tfs[keep]
+                    if not len(docs):
+                        continue
+                scores = weight * self._tf_norm(tfs, segment.doc_lengths[docs], avgdl)
+                terms.append((term_id, weight, docs, docs, scores, (docs, scores)))
+                continue
+            
+            first_docs, last_docs, max_tfs, min_lengths = segment.blocks(term_id)
+            # The largest tf in the shortest doc bounds every score in the block
+            terms.append((term_id, weight, first_docs, last_docs, weight * self._tf_norm(max_tfs, min_lengths, avgdl), None))
+        
+        if not terms:
+            return best_docs, best_scores
+        
+        # Block boundaries of all query terms cut the doc space into intervals, each covered by at most one block per term
+        edges = np.unique(np.concatenate([term[2] for term in terms] + [term[3] + 1 for term in terms]))
+        lows = edges[:-1]
+        upper_bounds = np.zeros(len(lows))
+        covering = []
+        for _, _, first_docs, last_docs, block_bounds, _ in terms:
+            blocks = np.searchsorted(first_docs, lows, side='right') - 1
+            covered = (blocks >= 0) & (last_docs[np.maximum(blocks, 0)] >= lows)
+            upper_bounds += np.where(covered, block_bounds[np.maximum(blocks, 0)], 0.0)
+            covering.append(np.where(covered, blocks, -1))
+        
+        if allowed is not None:
+            # Intervals holding no doc that passes the filter can never be visited
+            allowed_counts = np.concatenate([[0], np.cumsum(allowed[:self.base])])
+            upper_bounds[allowed_counts[edges[1:]] == allowed_counts[lows]] = 0.0
+        
+        deleted = np.fromiter(self.deleted, dtype=np.int64) if self.deleted else None
+        order = np.argsort(-upper_bounds, kind='stable')
+        position = 0
+        round_size = 16
+        
+        # Visit intervals by falling upper bound, in growing rounds, until none can beat the k-th best score
+        while position < len(order):
+            threshold = best_scores.min() if len(best_scores) >= top_k else 0.0
+            intervals = order[position:position + round_size]
+            intervals = intervals[upper_bounds[intervals] > threshold]
+            if not len(intervals):
+                break
+            position += round_size
+            round_size *= 2
+            
+            selected = np.zeros(len(lows), dtype=bool)
+            selected[intervals] = True
+            docs = []
+            scores = []
+            for t, (term_id, weight, _, _, _, exact) in enumerate(terms):
+                blocks = covering[t][intervals]
+                blocks = np.unique(blocks[blocks >= 0])
+                if not len(blocks):
+                    continue
+                if exact is not None:
+                    docs.append(exact[0][blocks])
+                    scores.append(exact[1][blocks])
+                    continue
+                
+                block_docs, tfs = segment.decode_blocks(term_id, blocks)
+                in_round = selected[np.searchsorted(edges, block_docs, side='right') - 1]
+                if allowed is not None:
+                    in_round &= allowed[block_docs]
+                block_docs, tfs = block_docs[in_round], tfs[in_round]
+                docs.append(block_docs)
+                scores.append(weight * self._tf_norm(tfs, segment.doc_lengths[block_docs], avgdl))
+            
+            docs, totals = self._sum_by_doc(docs, scores)
+            if deleted is not None:
+                keep = ~np.isin(docs, deleted)
+                docs, totals = docs[keep], totals[keep]
+            
+            best_docs, best_scores = self._select(
+                np.concatenate([best_docs, docs]),
+                np.concatenate([best_scores, totals]),
+                top_k
+            )
+        
+        return best_docs, best_scores
+    
+    def tombstone_ratio(self) -> float:
+        total = self.base + len(self.chunk_ids)
+        if not total:
+            return 0.0
+        return 1 - self.live_docs / total
+    
+    def _merged_postings(self, base_alive: np.ndarray, live_delta: List[int]) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        base_remap = np.cumsum(base_alive) - 1
+        delta_remap = {doc: int(base_alive.sum()) + i for i, doc in enumerate(live_delta)}
+        
+        segment_terms = {}
+        if self.segment is not None:
+            segment_terms = {self.segment.terms[i]: i for i in range(len(self.segment.terms))}
+        
+        for term in sorted(set(segment_terms) | set(self.postings)):
+            docs = []
+            tfs = []
+            
+            if term in segment_terms:
+                segment_docs, segment_tfs = self.segment.postings(segment_terms[term])
+                keep = base_alive[segment_docs]
+                docs.append(base_remap[segment_docs[keep]])
+                tfs.append(segment_tfs[keep])
+            
+            delta = self.postings.get(term, {})
+            if delta:
+                delta_docs = sorted(delta)
+                docs.append(np.array([delta_remap[doc] for doc in delta_docs], dtype=np.int64))
+                tfs.append(np.array([delta[doc] for doc in delta_docs], dtype=np.int64))
+            
+            docs = np.concatenate(docs)
+            if len(docs):
+                yield term, docs, np.concatenate(tfs)
+    
+    def _merged_attributes(self, base_alive: np.ndarray, live_delta: List[int]) -> Dict[str, np.ndarray]:
+        base_remap = np.cumsum(base_alive) - 1
+        delta_remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+        delta_remap[live_delta] = int(base_alive.sum()) + np.arange(len(live_delta))
+        
+        attributes = {}
+        if self.segment is not None:
+            for i in range(len(self.segment.attributes.keys)):
+                docs = self.segment.attributes.docs_at(i)
+                docs = base_remap[docs[base_alive[docs]]]
+                if len(docs):
+                    attributes[self.segment.attributes.keys[i]] = docs
+        
+        for key, delta in self.attribute_docs.items():
+            docs = delta_remap[np.fromiter(delta, dtype=np.int64, count=len(delta))]
+            attributes[key] = np.concatenate([attributes.get(key, np.zeros(0, dtype=np.int64)), np.sort(docs)])
+        return attributes
+    
+    def save(self, path: str = None):
+        with self._lock:
+            if path:
+                self.path = Path(path)
+            if self.path is None:
+                raise ValueError("No path to save the sparse index to")
+            
+            base_alive = np.ones(self.base, dtype=bool)
+            if self.deleted:
+                base_alive[list(self.deleted)] = False
+            live_delta = [doc for doc, chunk_id in enumerate(self.chunk_ids) if chunk_id is not None]
+            
+            chunk_ids = [self.segment.chunk_ids[int(doc)] for doc in np.flatnonzero(base_alive)] if self.segment else []
+            chunk_ids += [self.chunk_ids[doc] for doc in live_delta]
+            doc_lengths = np.concatenate([
+                np.asarray(self.segment.doc_lengths[base_alive] if self.segment else [], dtype=np.int64),
+                np.array([self.doc_lengths[doc] for doc in live_delta], dtype=np.int64)
+            ])
+            
+            staging = self.path.with_name(self.path.name + ".partial")
+            previous = self.path.with_name(self.path.name + ".old")
+            shutil.rmtree(staging, ignore_errors=True)
+            shutil.rmtree(previous, ignore_errors=True)
+            SparseSegment.write(
+                staging,
+                chunk_ids,
+                doc_lengths,
+                self._merged_postings(base_alive, live_delta),
+                self._merged_attributes(base_alive, live_delta),
+                self.analyzer.signature()
+            )
+            
+            # Readers that already mapped the old files keep them until they reopen
+            if self.path.exists():
+                self.path.rename(previous)
+            staging.rename(self.path)
+            shutil.rmtree(previous, ignore_errors=True)
+            
+            self._open_segment()
+    
+    def compact(self):
+        with self._lock:
+            if self.path is not None:
+                self.save()
+                return
+            
+            # Without a segment every doc is in memory; renumber the live ones densely
+            live = [
+                (chunk_id, terms, length, keys)
+                for chunk_id, terms, length, keys in zip(
+                    self.chunk_ids, self.doc_terms, self.doc_lengths, self.doc_attributes
+                )
+                if chunk_id is not None
+            ]
+            self._clear_delta()
+            for chunk_id, terms, length, keys in live:
+                self._append(chunk_id, terms, length, keys)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'documents': self.live_docs,
+                'segment_documents': self.base,
+                'segment_terms': len(self.segment.terms) if self.segment else 0,
+                'delta_documents': len(self.doc_numbers),
+                'deleted_documents': len(self.deleted),
+                'avg_doc_length': self.total_length / self.live_docs if self.live_docs else 0.0,
+                'tombstone_ratio': self.tombstone_ratio(),
+                'path': str(self.path) if self.path else None
+            }
+
+
+__all__ = ["AttributeBitmaps", "InvertedIndex", "SegmentDirectory", "SparseSegment", "StringTable", "INDEXED_ATTRIBUTES"]
\ No newline at end of file
@@ -0,0 +1,746 @@
+import heapq
+import json
+from abc import ABC, abstractmethod
+import os
+import re
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Dict, Any, Iterable, Optional, Set
+import numpy as np
+from app.utils.logging_config import log
+
+
+# Overwrites and deletes only ever append to rows.jsonl, so it is rewritten once it holds this many records per row
+LOG_COMPACTION_FACTOR = 2
+
+COMPARISON_OPERATORS = {
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+}
+
+
+class VectorBackend(ABC):
+    
+    # Mirrors the subset of Chroma's Collection API that VectorStore and the retrievers use,
+    # so a Chroma collection is itself a valid backend
+    
+    @abstractmethod
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]] = None,
+        documents: List[str] = None
+    ):
+        ...
+    
+    @abstractmethod
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> Dict[str, Any]:
+        ...
+    
+    @abstractmethod
+    def get(
+        self,
+        ids: List[str] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: int = None,
+        offset: int = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> Dict[str, Any]:
+        ...
+    
+    @abstractmethod
+    def delete(self, ids: List[str] = None, where: Optional[Dict[str, Any]] = None):
+        ...
+    
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+
+class NumpyVectorBackend(VectorBackend):
+    
+    def __init__(self, path: str, initial_capacity: int = 1024):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.path / "vectors.npy"
+        self.rows_path = self.path / "rows.jsonl"
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        
+        self._clear()
+        self._load()
+        log.info(f"NumPy vector backend loaded: {self.count()} vectors from {self.path}")
+    
+    def _load(self):
+        if self.vectors_path.exists():
+            self.vectors = np.load(self.vectors_path, mmap_mode='r+')
+            self.alive = np.zeros(len(self.vectors), dtype=bool)
+        
+        if not self.rows_path.exists():
+            return
+        
+        with open(self.rows_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                row = record['row']
+                self.log_records += 1
+                if record['op'] == 'delete':
+                    self._mark_deleted(row)
+                elif record['op'] == 'deleted':
+                    # Placeholder for a dead row in a rewritten log, so later rows keep their positions
+                    self._set_row(row, record['id'], None, {})
+                    self._mark_deleted(row)
+                else:
+                    self._set_row(row, record['id'], record['document'], record['metadata'])
+        
+        # Rows past the last logged record were never committed
+        self.size = len(self.ids)
+    
+    def _ensure_capacity(self, rows_needed: int, dimension: int):
+        if self.vectors is None:
+            capacity = max(self.initial_capacity, rows_needed)
+            self.vectors = np.lib.format.open_memmap(
+                self.vectors_path, mode='w+', dtype=np.float32, shape=(capacity, dimension)
+            )
+            self.alive = np.zeros(capacity, dtype=bool)
+            return
+        
+        if self.vectors.shape[1] != dimension:
+            raise ValueError(
+                f"Embedding dimension {dimension} does not match collection dimensionality {self.vectors.shape[1]}"
+            )
+        
+        capacity = len(self.vectors)
+        if rows_needed <= capacity:
+            return
+        
+        while capacity < rows_needed:
+            capacity *= 2
+        
+        grown_path = self.path / "vectors.grow.npy"
+        grown = np.lib.format.open_memmap(
+            grown_path, mode='w+', dtype=np.float32, shape=(capacity, dimension)
+        )
+        grown[:self.size] = self.vectors[:self.size]
+        grown.flush()
+        del grown
+        
+        self.vectors = None
+        os.replace(grown_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode='r+')
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+    
+    def _set_row(self, row: int, doc_id: str, document: str, metadata: Dict[str, Any]):
+        metadata = metadata or {}
+        
+        if row == len(self.ids):
+            self.ids.append(doc_id)
+            self.documents.append(document)
+            self.metadatas.append(metadata)
+            for key, values in self.columns.items():
+                values.append(metadata.get(key))
+        else:
+            self.ids[row] = doc_id
+            self.documents[row] = document
+            self.metadatas[row] = metadata
+            for key, values in self.columns.items():
+                values[row] = metadata.get(key)
+        
+        for key, value in metadata.items():
+            if key not in self.columns:
+                values = [None] * len(self.ids)
+                values[row] = value
+                self.columns[key] = values
+        
+        if row >= len(self.alive):
+            self.alive = np.concatenate([self.alive, np.zeros(row + 1 - len(self.alive), dtype=bool)])
+        
+        self.alive[row] = True
+        self.id_to_row[doc_id] = row
+        self._column_arrays.clear()
+    
+    def _mark_deleted(self, row: int):
+        self.alive[row] = False
+        self.id_to_row.pop(self.ids[row], None)
+        self._column_arrays.clear()
+    
+    def _append_log(self, records: List[Dict[str, Any]]):
+        with open(self.rows_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        
+        self.log_records += len(records)
+        if self.log_records > LOG_COMPACTION_FACTOR * max(self.size, self.initial_capacity):
+            self._rewrite_log()
+    
+    def _rewrite_log(self):
+        # One record per row: the current state of live rows and a bare placeholder for dead ones
+        staging_path = self.rows_path.with_suffix(".jsonl.tmp")
+        with open(staging_path, 'w', encoding='utf-8') as f:
+            for row in range(self.size):
+                if self.alive[row]:
+                    record = {
+                        'op': 'upsert', 'row': row, 'id': self.ids[row],
+                        'document': self.documents[row], 'metadata': self.metadatas[row]
+                    }
+                else:
+                    record = {'op': 'deleted', 'row': row, 'id': self.ids[row]}
+                f.write(json.dumps(record) + '\n')
+        
+        os.replace(staging_path, self.rows_path)
+        self.log_records = self.size
+    
+    def _normalize(self, embeddings) -> np.ndarray:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[np.newaxis, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]] = None,
+        documents: List[str] = None
+    ):
+        if not ids:
+            return
+        
+        matrix = self._normalize(embeddings)
+        if len(matrix) != len(ids):
+            raise ValueError(f"Got {len(matrix)} embeddings for {len(ids)} ids")
+        
+        metadatas = metadatas or [{}] * len(ids)
+        documents = documents or [None] * len(ids)
+        
+        with self._lock:
+            new_ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in self.id_to_row]
+            self._ensure_capacity(self.size + len(new_ids), matrix.shape[1])
+            
+            records = []
+            rows = []
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                row = self.id_to_row.get(doc_id)
+                if row is None:
+                    row = len(self.ids)
+                self._set_row(row, doc_id, document, metadata)
+                rows.append(row)
+                records.append({'op': 'upsert', 'row': row, 'id': doc_id, 'document': document, 'metadata': metadata})
+            
+            self.vectors[rows] = matrix
+            self.vectors.flush()
+            self.size = len(self.ids)
+            
+            # The vectors are flushed before the log, so every logged row has its embedding on disk
+            self._append_log(records)
+    
+    def _column(self, key: str) -> np.ndarray:
+        array = self._column_arrays.get(key)
+        if array is None:
+            values = self.columns.get(key, [None] * self.size)
+            array = np.empty(self.size, dtype=object)
+            array[:] = values
+            self._column_arrays[key] = array
+        return array
+    
+    def _where_mask(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        mask = np.ones(self.size, dtype=bool)
+        if not where:
+            return mask
+        
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where_mask(clause)
+            elif key == "$or":
+                any_mask = np.zeros(self.size, dtype=bool)
+                for clause in condition:
+                    any_mask |= self._where_mask(clause)
+                mask &= any_mask
+            else:
+                mask &= self._condition_mask(self._column(key), condition)
+        
+        return mask
+    
+    def _condition_mask(self, column: np.ndarray, condition: Any) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        
+        mask = np.ones(len(column), dtype=bool)
+        for operator, target in condition.items():
+            if operator == "$eq":
+                mask &= (column == target).astype(bool)
+            elif operator == "$ne":
+                mask &= (column != target).astype(bool)
+            elif operator in ("$in", "$nin"):
+                targets = set(target)
+                matches = np.frompyfunc(lambda value: value in targets, 1, 1)(column).astype(bool)
+                mask &= matches if operator == "$in" else ~matches
+            elif operator in COMPARISON_OPERATORS:
+                compare = COMPARISON_OPERATORS[operator]
+                mask &= np.frompyfunc(lambda value: compare(value, target), 1, 1)(column).astype(bool)
+            else:
+                raise ValueError(f"Unsupported where operator: {operator}")
+        
+        return mask
+    
+    def _document_mask(self, where_document: Optional[Dict[str, Any]]) -> np.ndarray:
+        if not where_document:
+            return np.ones(self.size, dtype=bool)
+        
+        if "$contains" in where_document:
+            needle = where_document["$contains"]
+            return np.fromiter((needle in (doc or "") for doc in self.documents), dtype=bool, count=self.size)
+        if "$not_contains" in where_document:
+            needle = where_document["$not_contains"]
+            return np.fromiter((needle not in (doc or "") for doc in self.documents), dtype=bool, count=self.size)
+        
+        raise ValueError(f"Unsupported where_document filter: {where_document}")
+    
+    def _candidate_rows(
+        self,
+        where: Optional[Dict[str, Any]],
+        where_document: Optional[Dict[str, Any]]
+    ) -> np.ndarray:
+        mask = self.alive[:self.size] & self._where_mask(where) & self._document_mask(where_document)
+        return np.flatnonzero(mask)
+    
+    def _rows_result(self, rows, include: List[str]) -> Dict[str, Any]:
+        return {
+            'ids': [self.ids[row] for row in rows],
+            'documents': [self.documents[row] for row in rows] if 'documents' in include else None,
+            'metadatas': [self.metadatas[row] for row in rows] if 'metadatas' in include else None,
+            'embeddings': [self.vectors[row].tolist() for row in rows] if 'embeddings' in include else None,
+        }
+    
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> Dict[str, Any]:
+        include = include or ["metadatas", "documents", "distances"]
+        queries = self._normalize(query_embeddings)
+        
+        with self._lock:
+            rows = self._candidate_rows(where, where_document)
+            results = {key: [] for key in ('ids', 'documents', 'metadatas', 'embeddings', 'distances')}
+            
+            if len(rows) == 0 or n_results <= 0:
+                for _ in range(len(queries)):
+                    for key in results:
+                        results[key].append([])
+                return self._drop_excluded(results, include)
+            
+            # Contiguous BLAS matmul when nothing is filtered out, gathered rows otherwise
+            if len(rows) == self.size:
+                candidates = self.vectors[:self.size]
+            else:
+                candidates = self.vectors[rows]
+            
+            scores = queries @ candidates.T
+            k = min(n_results, len(rows))
+            
+            if k < len(rows):
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(len(rows)), (len(queries), 1))
+            
+            for query_index in range(len(queries)):
+                order = top[query_index][np.argsort(-scores[query_index, top[query_index]], kind='stable')]
+                hit_rows = rows[order]
+                rows_result = self._rows_result(hit_rows, include)
+                for key, value in rows_result.items():
+                    results[key].append(value)
+                results['distances'].append((1.0 - scores[query_index, order]).tolist())
+        
+        return self._drop_excluded(results, include)
+    
+    def _drop_excluded(self, results: Dict[str, Any], include: List[str]) -> Dict[str, Any]:
+        # Chroma reports fields that were not requested as None rather than empty lists
+        for key in ('documents', 'metadatas', 'embeddings'):
+            if key not in include:
+                results[key] = None
+        return results
+    
+    def get(
+        self,
+        ids: List[str] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: int = None,
+        offset: int = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> Dict[str, Any]:
+        include = include if include is not None else ["metadatas", "documents"]
+        
+        with self._lock:
+            rows = self._candidate_rows(where, where_document)
+            
+            if ids is not None:
+                wanted = np.array([self.id_to_row[doc_id] for doc_id in ids if doc_id in self.id_to_row], dtype=np.int64)
+                rows = wanted[np.isin(wanted, rows)]
+            
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            
+            return self._rows_result(rows, include)
+    
+    def delete(self, ids: List[str] = None, where: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            if ids is not None:
+                rows = [self.id_to_row[doc_id] for doc_id in ids if doc_id in self.id_to_row]
+                if where:
+                    allowed = set(self._candidate_rows(where, None).tolist())
+                    rows = [row for row in rows if row in allowed]
+            else:
+                rows = self._candidate_rows(where, None).tolist()
+            
+            for row in rows:
+                self._mark_deleted(row)
+            
+            self._append_log([{'op': 'delete', 'row': row} for row in rows])
+    
+    def count(self) -> int:
+        return int(self.alive[:self.size].sum())
+    
+    def tombstone_ratio(self) -> float:
+        if self.size == 0:
+            return 0.0
+        return 1.0 - self.count() / self.size
+    
+    def compact(self):
+        with self._lock:
+            live_rows = np.flatnonzero(self.alive[:self.size])
+            if len(live_rows) == self.size:
+                return
+            
+            # Rewrite live rows into a staging directory and swap it in, so a crash never loses the original
+            staging_path = self.path.with_name(self.path.name + ".compact")
+            shutil.rmtree(staging_path, ignore_errors=True)
+            staging = NumpyVectorBackend(str(staging_path), initial_capacity=max(len(live_rows), 1))
+            if len(live_rows):
+                staging.upsert(
+                    ids=[self.ids[row] for row in live_rows],
+                    embeddings=np.array(self.vectors[live_rows]),
+                    metadatas=[self.metadatas[row] for row in live_rows],
+                    documents=[self.documents[row] for row in live_rows]
+                )
+            staging.vectors = None
+            
+            backup_path = self.path.with_name(self.path.name + ".old")
+            self.vectors = None
+            os.replace(self.path, backup_path)
+            os.replace(staging_path, self.path)
+            shutil.rmtree(backup_path, ignore_errors=True)
+            
+            self._clear()
+            self._load()
+            log.info(f"Compacted NumPy vector backend to {self.count()} rows")
+    
+    def reset(self):
+        with self._lock:
+            self.vectors = None
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._clear()
+    
+    def _clear(self):
+        self.vectors = None
+        self.size = 0
+        self.ids = []
+        self.id_to_row = {}
+        self.documents = []
+        self.metadatas = []
+        self.columns = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self._column_arrays = {}
+        self.log_records = 0
+
+
+class ShardedVectorBackend(VectorBackend):
+    
+    def __init__(
+        self,
+        base_name: str,
+        shard_key: str,
+        open_shard: Callable[[str], Any],
+        drop_shard: Callable[[str], None],
+        existing_shards: Iterable[str] = (),
+        shard_count: int = 4,
+        max_workers: int = 4
+    ):
+        if shard_key not in ("file_type", "tenant", "hash"):
+            raise ValueError(f"Unknown shard key: {shard_key}")
+        
+        self.base_name = base_name
+        self.shard_key = shard_key
+        self.shard_count = shard_count
+        self.open_shard = open_shard
+        self.drop_shard = drop_shard
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self.shards = {}
+        self._empty = {}  # shard name -> cached emptiness, dropped whenever a delete may have emptied it
+        
+        prefix = f"{base_name}__"
+        for name in existing_shards:
+            if name.startswith(prefix):
+                self.shards[name] = open_shard(name)
+        
+        log.info(f"Sharded vector backend by {shard_key}: {len(self.shards)} shards")
+    
+    def shard_name(self, value: Any) -> str:
+        if self.shard_key == "hash":
+            value = f"h{zlib.crc32(str(value).encode()) % self.shard_count}"
+        return f"{self.base_name}__{re.sub(r'[^A-Za-z0-9_-]', '_', str(value))}"
+    
+    def _routing_value(self, chunk_id: str, metadata: Dict[str, Any]) -> Any:
+        if self.shard_key == "file_type":
+            return metadata.get("file_type", "unknown")
+        if self.shard_key == "tenant":
+            return metadata.get("tenant", "default")
+        # Hashing the document id keeps all chunks of a document on one shard
+        return metadata.get("document_id", chunk_id)
+    
+    def _routing_field(self) -> str:
+        return "document_id" if self.shard_key == "hash" else self.shard_key
+    
+    def _get_or_open(self, name: str):
+        with self._lock:
+            shard = self.shards.get(name)
+            if shard is None:
+                shard = self.open_shard(name)
+                self.shards[name] = shard
+            return shard
+    
+    def _is_empty(self, name: str) -> bool:
+        empty = self._empty.get(name)
+        if empty is None:
+            empty = self.shards[name].count() == 0
+            self._empty[name] = empty
+        return empty
+    
+    def _allowed_values(self, where: Optional[Dict[str, Any]]) -> Optional[Set[Any]]:
+        # None means the filter does not constrain the shard key, so every shard is a candidate
+        if not where:
+            return None
+        
+        allowed = None
+        for key, condition in where.items():
+            values = None
+            if key == "$and":
+                for clause in condition:
+                    clause_values = self._allowed_values(clause)
+                    if clause_values is not None:
+                        values = clause_values if values is None else values & clause_values
+            elif key == "$or":
+                branches = [self._allowed_values(clause) for clause in condition]
+                if branches and all(branch is not None for branch in branches):
+                    values = set().union(*branches)
+            elif key == self._routing_field():
+                if not isinstance(condition, dict):
+                    values = {condition}
+                elif "$eq" in condition:
+                    values = {condition["$eq"]}
+                elif "$in" in condition:
+                    values = set(condition["$in"])
+            
+            if values is not None:
+                allowed = values if allowed is None else allowed & values
+        
+        return allowed
+    
+    def route(self, where: Optional[Dict[str, Any]] = None) -> List[str]:
+        allowed = self._allowed_values(where)
+        with self._lock:
+            names = sorted(self.shards)
+        if allowed is None:
+            return names
+        wanted = {self.shard_name(value) for value in allowed}
+        return [name for name in names if name in wanted]
+    
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]] = None,
+        documents: List[str] = None
+    ):
+        metadatas = metadatas or [{}] * len(ids)
+        documents = documents or [None] * len(ids)
+        groups = {}
+        
+        for i, (chunk_id, metadata) in enumerate(zip(ids, metadatas)):
+            name = self.shard_name(self._routing_value(chunk_id, metadata or {}))
+            groups.setdefault(name, []).append(i)
+        
+        for name, rows in groups.items():
+            self._get_or_open(name).upsert(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+                documents=[documents[i] for i in rows]
+            )
+            self._empty[name] = False
+        
+        self._remove_moved(groups, ids)
+    
+    def _remove_moved(self, groups: Dict[str, List[int]], ids: List[str]):
+        # An id whose shard-key value changed now lives on its new shard; any copy left on another shard is stale
+        with self._lock:
+            names = list(self.shards)
+        
+        def find_stale(name):
+            stale_ids = [ids[i] for target, rows in groups.items() if target != name for i in rows]
+            if not stale_ids or self._is_empty(name):
+                return name, []
+            return name, self.shards[name].get(ids=stale_ids, include=[])['ids']
+        
+        for name, stale_ids in self.executor.map(find_stale, names):
+            if stale_ids:
+                self.shards[name].delete(ids=stale_ids)
+                self._empty.pop(name, None)
+    
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> Dict[str, Any]:
+        include = list(include or ["metadatas", "documents"])
+        if "distances" not in include:
+            include.append("distances")
+        
+        def query_shard(name):
+            # Chroma rejects queries against an empty collection
+            if self._is_empty(name):
+                return None
+            return self.shards[name].query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=include
+            )
+        
+        shard_results = [result for result in self.executor.map(query_shard, self.route(where)) if result is not None]
+        merged = {key: [] for key in ('ids', 'distances', 'documents', 'metadatas', 'embeddings')}
+        
+        for query_index in range(len(query_embeddings)):
+            candidates = []
+            for result in shard_results:
+                for rank, distance in enumerate(result['distances'][query_index]):
+                    candidates.append((distance, rank, result))
+            
+            top = heapq.nsmallest(n_results, candidates, key=lambda candidate: candidate[0])
+            for key in merged:
+                merged[key].append([
+                    result[key][query_index][rank] if result.get(key) is not None else None
+                    for _, rank, result in top
+                ])
+        
+        for key in ('documents', 'metadatas', 'embeddings'):
+            if key not in include:
+                merged[key] = None
+        
+        return merged
+    
+    def get(
+        self,
+        ids: List[str] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: int = None,
+        offset: int = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        include: List[str] = None
+    ) -> Dict[str, Any]:
+        include = include if include is not None else ["metadatas", "documents"]
+        merged = {'ids': [], 'documents': [], 'metadatas': [], 'embeddings': []}
+        skip = offset or 0
+        remaining = limit
+        
+        # Shards are read in a stable order, so offset/limit page through their concatenation
+        for name in self.route(where):
+            if remaining is not None and remaining <= 0:
+                break
+            
+            page = self.shards[name].get(
+                ids=ids,
+                where=where,
+                limit=skip + remaining if remaining is not None else None,
+                where_document=where_document,
+                include=include
+            )
+            found = len(page['ids'])
+            if found <= skip:
+                skip -= found
+                continue
+            
+            end = skip + remaining if remaining is not None else found
+            for key in merged:
+                if page.get(key) is not None:
+                    merged[key].extend(page[key][skip:end])
+            if remaining is not None:
+                remaining -= min(end, found) - skip
+            skip = 0
+        
+        for key in ('documents', 'metadatas', 'embeddings'):
+            if key not in include:
+                merged[key] = None
+        
+        return merged
+    
+    def delete(self, ids: List[str] = None, where: Optional[Dict[str, Any]] = None):
+        for name in self.route(where):
+            self.shards[name].delete(ids=ids, where=where)
+            self._empty.pop(name, None)
+    
+    def count(self) -> int:
+        with self._lock:
+            shards = list(self.shards.values())
+        return sum(shard.count() for shard in shards)
+    
+    def tombstone_ratio(self) -> float:
+        ratios = [shard.tombstone_ratio() for shard in self.shards.values() if hasattr(shard, 'tombstone_ratio')]
+        return max(ratios, default=0.0)
+    
+    def compact(self):
+        for shard in list(self.shards.values()):
+            if hasattr(shard, 'compact'):
+                shard.compact()
+    
+    def shard_stats(self) -> Dict[str, int]:
+        return {name: shard.count() for name, shard in sorted(self.shards.items())}
+    
+    def reset(self):
+        with self._lock:
+            for name in list(self.shards):
+                self.drop_shard(name)
+            self.shards.clear()
+            self._empty.clear()
+
+
+__all__ = ["VectorBackend", "NumpyVectorBackend", "ShardedVectorBackend"]
\ No newline at end of file
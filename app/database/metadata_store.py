@@ -43,6 +43,32 @@ class MetadataStore:
         
         log.info(f"Metadata saved for document: {document_id}")
     
+    def add_documents(self, documents: Dict[str, Dict[str, Any]]):
+        for document_id, metadata in documents.items():
+            metadata['document_id'] = document_id
+            metadata['created_at'] = metadata.get('created_at', datetime.now().isoformat())
+            
+            with open(self.metadata_dir / f"{document_id}.json", 'w') as f:
+                json.dump(metadata, f, indent=2)
+            
+            self.index[document_id] = {
+                'filename': metadata.get('filename', 'unknown'),
+                'file_type': metadata.get('file_type', 'unknown'),
+                'created_at': metadata['created_at']
+            }
+        
+        # The index is written once for the whole batch rather than per document
+        self._save_index()
+        log.info(f"Metadata saved for {len(documents)} documents")
+    
+    def export_documents(self) -> Dict[str, Dict[str, Any]]:
+        documents = {}
+        for document_id in self.index:
+            metadata = self.get_document(document_id)
+            if metadata:
+                documents[document_id] = metadata
+        return documents
+    
     def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
         doc_file = self.metadata_dir / f"{document_id}.json"
         
@@ -0,0 +1,90 @@
+import time
+from typing import List, Dict, Any, Set
+import numpy as np
+from app.database.vector_store import vector_store, VectorStore
+from app.utils.logging_config import log
+
+
+class SearchEvaluator:
+    
+    def __init__(self, store: VectorStore = None):
+        self.store = store or vector_store
+    
+    def _normalize(self, matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def sample_queries(self, sample_size: int) -> np.ndarray:
+        page = self.store.collection.get(include=["embeddings"], limit=sample_size)
+        if not page['ids']:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(page['embeddings'], dtype=np.float32)
+    
+    def exact_neighbors(self, queries: np.ndarray, k: int) -> List[Set[str]]:
+        queries = self._normalize(queries)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=object)
+        
+        # Brute force one page at a time, keeping a running top-k per query
+        for page in self.store.iter_where(None, include=["embeddings"]):
+            vectors = self._normalize(np.asarray(page['embeddings'], dtype=np.float32))
+            page_ids = np.array(page['ids'], dtype=object)
+            
+            scores = np.concatenate([best_scores, queries @ vectors.T], axis=1)
+            ids = np.concatenate([best_ids, np.tile(page_ids, (len(queries), 1))], axis=1)
+            
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_ids = np.take_along_axis(ids, top, axis=1)
+        
+        return [set(row) for row in best_ids]
+    
+    def evaluate(
+        self,
+        k: int = 10,
+        search_efs: List[int] = None,
+        sample_size: int = 100
+    ) -> Dict[str, Any]:
+        search_efs = search_efs or [10, 20, 40, 80, 160]
+        queries = self.sample_queries(sample_size)
+        
+        report = {
+            'k': k,
+            'backend': self.store.backend,
+            'corpus_size': self.store.count(),
+            'sample_size': len(queries),
+            'hnsw_params': self.store.hnsw_params if self.store.backend == "chroma" else None,
+            'curve': []
+        }
+        
+        if len(queries) == 0:
+            return report
+        
+        truths = self.exact_neighbors(queries, k)
+        
+        for search_ef in search_efs:
+            latencies = []
+            recalls = []
+            
+            for query, truth in zip(queries, truths):
+                start_time = time.perf_counter()
+                results = self.store.query(query.tolist(), n_results=k, search_ef=search_ef)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                recalls.append(len(set(results['ids'][0]) & truth) / len(truth))
+            
+            report['curve'].append({
+                'search_ef': search_ef,
+                'recall_at_k': float(np.mean(recalls)),
+                'latency_p50_ms': float(np.percentile(latencies, 50)),
+                'latency_p95_ms': float(np.percentile(latencies, 95))
+            })
+        
+        log.info(f"Search evaluation over {len(queries)} queries: {report['curve']}")
+        return report
+
+
+search_evaluator = SearchEvaluator()
+
+__all__ = ["SearchEvaluator", "search_evaluator"]
\ No newline at end of file
@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import json
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from app.config import settings
+from app.database.vector_store import vector_store, VectorStore
+from app.database.metadata_store import metadata_store, MetadataStore
+from app.utils.logging_config import log
+
+
+SNAPSHOT_FORMAT = 2
+READABLE_FORMATS = (1, 2)  # format 1 stored strings as fixed-width arrays
+MANIFEST_FILE = "manifest.json"
+METADATA_FILE = "metadata_store.json"
+
+
+def row_hash(chunk_id: str, document: Optional[str], metadata: Dict[str, Any], embedding: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(chunk_id.encode())
+    digest.update(b"\0" + (document or "").encode())
+    digest.update(b"\0" + json.dumps(metadata or {}, sort_keys=True).encode())
+    digest.update(b"\0" + np.asarray(embedding, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # One UTF-8 blob plus offsets; fixed-width string arrays pad every row to the longest chunk in the batch
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def read_strings(data, name: str) -> List[str]:
+    if f"{name}_offsets" not in data.files:
+        return data[name].tolist()
+    blob = data[name].tobytes()
+    offsets = data[f"{name}_offsets"].tolist()
+    return [blob[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+
+class SnapshotManager:
+    
+    def __init__(self, store: VectorStore = None, metadata: MetadataStore = None):
+        self.store = store or vector_store
+        self.metadata = metadata or metadata_store
+    
+    def read_manifest(self, path: str) -> Dict[str, Any]:
+        with open(Path(path) / MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    
+    def read_row_hashes(self, path: str) -> Dict[str, str]:
+        hashes = {}
+        manifest = self.read_manifest(path)
+        
+        # Incremental snapshots only hold changed rows, so the full picture comes from the whole chain
+        if manifest.get('base'):
+            hashes.update(self.read_row_hashes(manifest['base']))
+        for deleted_id in manifest.get('deleted_ids', []):
+            hashes.pop(deleted_id, None)
+        
+        for batch in manifest['batches']:
+            with np.load(Path(path) / batch['file'], allow_pickle=False) as data:
+                hashes.update(zip(read_strings(data, 'ids'), read_strings(data, 'row_hashes')))
+        return hashes
+    
+    def _write_batch(self, path: Path, index: int, ids, embeddings, documents, metadatas, hashes) -> Dict[str, Any]:
+        file_name = f"batch_{index:05d}.npz"
+        columns = {
+            'ids': ids,
+            'documents': [document or "" for document in documents],
+            'metadatas': [json.dumps(metadata or {}, sort_keys=True) for metadata in metadatas],
+            'row_hashes': hashes
+        }
+        arrays = {'embeddings': np.asarray(embeddings, dtype=np.float32)}
+        for name, values in columns.items():
+            arrays[name], arrays[f"{name}_offsets"] = encode_strings(values)
+        np.savez_compressed(path / file_name, **arrays)
+        return {'file': file_name, 'rows': len(ids)}
+    
+    def export(self, path: str, base: str = None, batch_size: int = None) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        batch_size = batch_size or settings.vector_read_page_size
+        target = Path(path)
+        if target.exists():
+            raise ValueError(f"Snapshot path already exists: {path}")
+        
+        staging = target.with_name(target.name + ".partial")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        
+        base_hashes = self.read_row_hashes(base) if base else {}
+        seen_ids = set()
+        batches = []
+        total_rows = 0
+        dimension = None
+        
+        for page in self.store.iter_where(None, include=["embeddings", "documents", "metadatas"], page_size=batch_size):
+            embeddings = np.asarray(page['embeddings'], dtype=np.float32)
+            dimension = embeddings.shape[1] if len(embeddings) else dimension
+            keep = []
+            hashes = []
+            
+            for i, chunk_id in enumerate(page['ids']):
+                seen_ids.add(chunk_id)
+                digest = row_hash(chunk_id, page['documents'][i], page['metadatas'][i], embeddings[i])
+                if base_hashes.get(chunk_id) != digest:
+                    keep.append(i)
+                    hashes.append(digest)
+            
+            total_rows += len(page['ids'])
+            if not keep:
+                continue
+            
+            batches.append(self._write_batch(
+                staging,
+                len(batches),
+                [page['ids'][i] for i in keep],
+                embeddings[keep],
+                [page['documents'][i] for i in keep],
+                [page['metadatas'][i] for i in keep],
+                hashes
+            ))
+        
+        with open(staging / METADATA_FILE, 'w') as f:
+            json.dump(self.metadata.export_documents(), f)
+        
+        manifest = {
+            'format': SNAPSHOT_FORMAT,
+            'created_at': datetime.now().isoformat(),
+            'collection_name': settings.collection_name,
+            'backend': self.store.backend,
+            'dimension': dimension,
+            'total_rows': total_rows,
+            'base': str(Path(base).resolve()) if base else None,
+            'deleted_ids': sorted(set(base_hashes) - seen_ids),
+            'batches': batches
+        }
+        with open(staging / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        # A snapshot only appears under its final name once every batch is on disk
+        staging.rename(target)
+        
+        elapsed = time.perf_counter() - start_time
+        written = sum(batch['rows'] for batch in batches)
+        log.info(f"Exported snapshot {path}: {written}/{total_rows} rows in {len(batches)} batches ({elapsed:.1f}s)")
+        return manifest
+    
+    def restore(self, path: str) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        manifest = self.read_manifest(path)
+        if manifest.get('format') not in READABLE_FORMATS:
+            raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+        
+        if manifest.get('base'):
+            self.restore(manifest['base'])
+        
+        writer = self.store.bulk_writer()
+        for batch in manifest['batches']:
+            with np.load(Path(path) / batch['file'], allow_pickle=False) as data:
+                writer.add(
+                    texts=read_strings(data, 'documents'),
+                    embeddings=data['embeddings'].tolist(),
+                    metadatas=[json.loads(metadata) for metadata in read_strings(data, 'metadatas')],
+                    ids=read_strings(data, 'ids')
+                )
+        stats = writer.flush()
+        
+        deleted_ids = manifest.get('deleted_ids', [])
+        for i in range(0, len(deleted_ids), self.store.get_write_batch_size()):
+            batch_ids = deleted_ids[i:i + self.store.get_write_batch_size()]
+            self.store.delete_chunks(batch_ids)
+        
+        with open(Path(path) / METADATA_FILE, 'r') as f:
+            documents = json.load(f)
+        for document_id in set(self.metadata.index) - set(documents):
+            self.metadata.delete_document(document_id)
+        self.metadata.add_documents(documents)
+        
+        elapsed = time.perf_counter() - start_time
+        log.info(
+            f"Restored snapshot {path}: {stats['rows_written']} rows, {len(deleted_ids)} deletions, "
+            f"{len(documents)} documents ({elapsed:.1f}s)"
+        )
+        return {'rows_written': stats['rows_written'], 'rows_deleted': len(deleted_ids), 'documents': len(documents)}
+    
+    def diff(self, old_path: str, new_path: str) -> Dict[str, List[str]]:
+        old_hashes = self.read_row_hashes(old_path)
+        new_hashes = self.read_row_hashes(new_path)
+        
+        return {
+            'added': sorted(set(new_hashes) - set(old_hashes)),
+            'removed': sorted(set(old_hashes) - set(new_hashes)),
+            'changed': sorted(
+                chunk_id for chunk_id in set(old_hashes) & set(new_hashes)
+                if old_hashes[chunk_id] != new_hashes[chunk_id]
+            )
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, restore and compare vector store snapshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = subparsers.add_parser("export", help="Write a snapshot of the vector and metadata stores")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--base", help="Previous snapshot; only rows changed since it are written")
+    export_parser.add_argument("--batch-size", type=int, default=None)
+    
+    import_parser = subparsers.add_parser("import", help="Bulk-load a snapshot without re-embedding")
+    import_parser.add_argument("path")
+    
+    diff_parser = subparsers.add_parser("diff", help="List chunk ids added, removed or changed between snapshots")
+    diff_parser.add_argument("old_path")
+    diff_parser.add_argument("new_path")
+    
+    args = parser.parse_args()
+    
+    if args.command == "export":
+        manifest = snapshot_manager.export(args.path, base=args.base, batch_size=args.batch_size)
+        print(json.dumps({key: value for key, value in manifest.items() if key != 'deleted_ids'}, indent=2))
+    elif args.command == "import":
+        print(json.dumps(snapshot_manager.restore(args.path), indent=2))
+    else:
+        diff = snapshot_manager.diff(args.old_path, args.new_path)
+        print(json.dumps({key: len(ids) for key, ids in diff.items()}, indent=2))
+
+
+snapshot_manager = SnapshotManager()
+
+__all__ = ["SnapshotManager", "snapshot_manager", "row_hash", "encode_strings", "read_strings"]
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,25 +1,146 @@
 import chromadb
 from chromadb.config import Settings as ChromaSettings
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
+import threading
+import time
 import uuid
+import shutil
+from pathlib import Path
 from app.config import settings
+from app.database.backends import NumpyVectorBackend, ShardedVectorBackend
+from app.utils.file_lock import SharedCounter
 from app.utils.logging_config import log
 
 
 class VectorStore:
     
     def __init__(self):
-        self.client = chromadb.PersistentClient(
-            path=settings.chroma_dir,
-            settings=ChromaSettings(anonymized_telemetry=False)
-        )
+        self.backend = settings.vector_backend.lower()
+        self.client = None
+        self.hnsw_params = {
+            "hnsw:M": settings.hnsw_m,
+            "hnsw:construction_ef": settings.hnsw_construction_ef,
+            "hnsw:search_ef": settings.hnsw_search_ef
+        }
+        self._write_lock = threading.RLock()
         
-        self.collection = self.client.get_or_create_collection(
-            name=settings.collection_name,
-            metadata={"hnsw:space": "cosine"}
-        )
+        if self.backend == "chroma":
+            self.client = chromadb.PersistentClient(
+                path=settings.chroma_dir,
+                settings=ChromaSettings(anonymized_telemetry=False)
+            )
+        elif self.backend != "numpy":
+            raise ValueError(f"Unknown vector backend: {settings.vector_backend}")
+            
+        if settings.shard_key:
+            self.collection = ShardedVectorBackend(
+                base_name=settings.collection_name,
+                shard_key=settings.shard_key,
+                open_shard=self.open_collection,
+                drop_shard=self.drop_collection,
+                existing_shards=self.list_collections(),
+                shard_count=settings.shard_count,
+                max_workers=settings.async_workers
+            )
+        else:
+            self.collection = self.open_collection(settings.collection_name)
+        
+        self.chunk_index = DocumentChunkIndex()
+        self.write_listeners = []
+        # Bumped by every write from any process (workers, snapshot imports), so derived indexes can tell they are stale
+        self.generations = SharedCounter(Path(settings.chroma_dir) / f"{settings.collection_name}.generation")
+        # Bumped only once every listener has applied a write; result caches key on it, so a query that reads it
+        # can never file results from a half-applied write under the new value
+        self.applied_generations = SharedCounter(Path(settings.chroma_dir) / f"{settings.collection_name}.applied")
+        self._notifying = threading.local()
+        
+        log.info(f"Vector store initialized: {settings.collection_name} ({self.backend})")
+    
+    def get_numpy_path(self, name: str = None) -> str:
+        return str(Path(settings.chroma_dir) / "numpy" / (name or settings.collection_name))
+    
+    def open_collection(self, name: str):
+        if self.backend == "numpy":
+            return NumpyVectorBackend(self.get_numpy_path(name))
+        
+        # A rebuild interrupted between its two renames leaves the data under the retired name
+        names = self.list_collections()
+        retired_name = f"retired_{name}"[:63]
+        if name not in names and retired_name in names:
+            log.warning(f"Restoring collection {name} from an interrupted rebuild")
+            self.client.get_collection(name=retired_name).modify(name=name)
         
-        log.info(f"Vector store initialized: {settings.collection_name}")
+        return self.client.get_or_create_collection(
+            name=name,
+            metadata=self.get_collection_metadata()
+        )
+    
+    def get_collection_metadata(self) -> Dict[str, Any]:
+        return {"hnsw:space": "cosine", **self.hnsw_params}
+    
+    def list_collections(self) -> List[str]:
+        if self.backend == "numpy":
+            numpy_dir = Path(settings.chroma_dir) / "numpy"
+            return [path.name for path in numpy_dir.iterdir() if path.is_dir()] if numpy_dir.exists() else []
+        return [collection.name for collection in self.client.list_collections()]
+    
+    def drop_collection(self, name: str):
+        if self.backend == "numpy":
+            shutil.rmtree(self.get_numpy_path(name), ignore_errors=True)
+        else:
+            self.client.delete_collection(name=name)
+    
+    def get_write_batch_size(self) -> int:
+        batch_size = settings.vector_write_batch_size
+        client_limit = getattr(self.client, 'max_batch_size', None)
+        if client_limit:
+            batch_size = min(batch_size, client_limit)
+        return batch_size
+    
+    def bulk_writer(self, batch_size: int = None) -> "BulkVectorWriter":
+        return BulkVectorWriter(self, batch_size=batch_size)
+    
+    def add_write_listener(self, listener):
+        # Listeners implement on_upsert(ids, texts, metadatas), on_delete(ids) and on_reset()
+        self.write_listeners.append(listener)
+    
+    def generation(self) -> int:
+        return self.generations.value()
+    
+    def applied_generation(self) -> int:
+        return self.applied_generations.value()
+    
+    def write_generation(self) -> int:
+        # The generation of the write listeners are being notified about on this thread
+        return getattr(self._notifying, 'generation', None) or self.generation()
+    
+    def _notify(self, event: str, *args):
+        self._notifying.generation = self.generations.increment()
+        try:
+            for listener in self.write_listeners:
+                try:
+                    getattr(listener, event)(*args)
+                except Exception as e:
+                    log.error(f"Write listener {type(listener).__name__}.{event} failed: {e}")
+        finally:
+            self.applied_generations.increment()
+    
+    def upsert_batch(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ):
+        with self._write_lock:
+            self.collection.upsert(
+                documents=texts,
+                embeddings=embeddings,
+                metadatas=metadatas,
+                ids=ids
+            )
+            self.chunk_index.update(ids, metadatas)
+        self._notify('on_upsert', ids, texts, metadatas)
     
     def add_documents(
         self,
@@ -32,13 +153,10 @@ class VectorStore:
             ids = [str(uuid.uuid4()) for _ in range(len(texts))]
         
         try:
-            self.collection.add(
-                documents=texts,
-                embeddings=embeddings,
-                metadatas=metadatas,
-                ids=ids
-            )
-            log.info(f"Added {len(texts)} documents to vector store")
+            writer = self.bulk_writer()
+            writer.add(texts, embeddings, metadatas, ids)
+            stats = writer.flush()
+            log.info(f"Added {len(texts)} documents to vector store ({stats['rows_per_second']:.0f} rows/s)")
             return ids
         except Exception as e:
             log.error(f"Error adding documents: {e}")
@@ -49,15 +167,44 @@ class VectorStore:
         query_embedding: List[float],
         n_results: int = 10,
         where: Optional[Dict[str, Any]] = None,
-        where_document: Optional[Dict[str, Any]] = None
+        where_document: Optional[Dict[str, Any]] = None,
+        search_ef: Optional[int] = None
+    ) -> Dict[str, Any]:
+        return self.query_batch(
+            [query_embedding],
+            n_results=n_results,
+            where=where,
+            where_document=where_document,
+            search_ef=search_ef
+        )
+    
+    def query_batch(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+        search_ef: Optional[int] = None
     ) -> Dict[str, Any]:
+        # hnswlib searches with ef = max(search_ef, k), so asking for more neighbours raises the effective ef;
+        # exact backends have nothing to tune
+        fetch = n_results
+        if search_ef and self.backend == "chroma":
+            fetch = max(n_results, search_ef)
+        
         try:
             results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
+                query_embeddings=query_embeddings,
+                n_results=fetch,
                 where=where,
                 where_document=where_document
             )
+            
+            if fetch > n_results:
+                results = {
+                    key: [values[:n_results] for values in value] if isinstance(value, list) else value
+                    for key, value in results.items()
+                }
             return results
         except Exception as e:
             log.error(f"Error querying vector store: {e}")
@@ -77,14 +224,126 @@ class VectorStore:
             log.error(f"Error getting document: {e}")
             return None
     
+    def get_documents(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+            return {
+                chunk_id: {'id': chunk_id, 'document': document, 'metadata': metadata}
+                for chunk_id, document, metadata in zip(result['ids'], result['documents'], result['metadatas'])
+            }
+        except Exception as e:
+            log.error(f"Error getting documents: {e}")
+            return {}
+    
+    def iter_where(
+        self,
+        where: Optional[Dict[str, Any]],
+        include: List[str] = None,
+        page_size: int = None
+    ) -> Iterator[Dict[str, Any]]:
+        page_size = page_size or settings.vector_read_page_size
+        include = include or ["metadatas", "documents"]
+        offset = 0
+        
+        while True:
+            page = self.collection.get(where=where, limit=page_size, offset=offset, include=include)
+            if not page['ids']:
+                break
+            
+            yield page
+            
+            if len(page['ids']) < page_size:
+                break
+            offset += page_size
+    
+    def get_document_chunks(self, document_id: str, page_size: int = None) -> List[Dict[str, Any]]:
+        chunks = []
+        
+        for page in self.iter_where({"document_id": document_id}, page_size=page_size):
+            for chunk_id, document, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+                chunks.append({'id': chunk_id, 'document': document, 'metadata': metadata})
+        
+        chunks.sort(key=lambda chunk: chunk['metadata'].get('chunk_index', 0))
+        self.chunk_index.load(
+            document_id,
+            {chunk['metadata'].get('chunk_index', 0): chunk['id'] for chunk in chunks}
+        )
+        return chunks
+    
+    def get_chunk_ids(self, document_id: str) -> Dict[int, str]:
+        chunk_ids = self.chunk_index.get(document_id)
+        if chunk_ids is not None:
+            return chunk_ids
+        
+        chunk_ids = {}
+        for page in self.iter_where({"document_id": document_id}, include=["metadatas"]):
+            for chunk_id, metadata in zip(page['ids'], page['metadatas']):
+                chunk_ids[metadata.get('chunk_index', 0)] = chunk_id
+        
+        self.chunk_index.load(document_id, chunk_ids)
+        return chunk_ids
+    
+    def get_chunk_window(self, document_id: str, chunk_index: int, window: int = 1) -> List[Dict[str, Any]]:
+        chunk_ids = self.get_chunk_ids(document_id)
+        window_ids = [
+            chunk_ids[i]
+            for i in range(chunk_index - window, chunk_index + window + 1)
+            if i in chunk_ids
+        ]
+        if not window_ids:
+            return []
+        
+        result = self.collection.get(ids=window_ids)
+        chunks = [
+            {'id': chunk_id, 'document': document, 'metadata': metadata}
+            for chunk_id, document, metadata in zip(result['ids'], result['documents'], result['metadatas'])
+        ]
+        chunks.sort(key=lambda chunk: chunk['metadata'].get('chunk_index', 0))
+        return chunks
+    
     def delete_document(self, doc_id: str):
         try:
-            self.collection.delete(ids=[doc_id])
+            self.delete_chunks([doc_id])
             log.info(f"Deleted document: {doc_id}")
         except Exception as e:
             log.error(f"Error deleting document: {e}")
             raise
     
+    def delete_chunks(self, ids: List[str]):
+        with self._write_lock:
+            self.collection.delete(ids=ids)
+            self.chunk_index.discard(ids)
+        self._notify('on_delete', ids)
+    
+    def delete_by_document(self, document_id: str) -> List[str]:
+        try:
+            # Under the write lock the snapshot matches what the delete removes, and a rebuild cannot resurrect it
+            with self._write_lock:
+                chunk_ids = list(self.get_chunk_ids(document_id).values())
+                self.collection.delete(where={"document_id": document_id})
+                self.chunk_index.drop(document_id)
+            self._notify('on_delete', chunk_ids)
+            log.info(f"Deleted {len(chunk_ids)} chunks of document: {document_id}")
+            return chunk_ids
+        except Exception as e:
+            log.error(f"Error deleting chunks of document {document_id}: {e}")
+            raise
+    
+    def tombstone_ratio(self) -> float:
+        # Chroma reclaims deleted HNSW entries itself; only the NumPy backend keeps tombstones
+        if hasattr(self.collection, 'tombstone_ratio'):
+            return self.collection.tombstone_ratio()
+        return 0.0
+    
+    def compact(self):
+        if hasattr(self.collection, 'compact'):
+            self.collection.compact()
+    
+    def shard_stats(self) -> Dict[str, int]:
+        if hasattr(self.collection, 'shard_stats'):
+            return self.collection.shard_stats()
+        return {}
+    
     def count(self) -> int:
         try:
             return self.collection.count()
@@ -92,18 +351,240 @@ class VectorStore:
             log.error(f"Error counting documents: {e}")
             return 0
     
+    def rebuild_collection(
+        self,
+        hnsw_m: int = None,
+        construction_ef: int = None,
+        search_ef: int = None
+    ) -> Dict[str, Any]:
+        if self.backend != "chroma":
+            return {"rebuilt": [], "hnsw_params": None, "message": "Exact backends have no HNSW index to rebuild"}
+        
+        params = dict(self.hnsw_params)
+        if hnsw_m is not None:
+            params["hnsw:M"] = hnsw_m
+        if construction_ef is not None:
+            params["hnsw:construction_ef"] = construction_ef
+        if search_ef is not None:
+            params["hnsw:search_ef"] = search_ef
+        
+        with self._write_lock:
+            previous_params = self.hnsw_params
+            self.hnsw_params = params
+            
+            try:
+                if isinstance(self.collection, ShardedVectorBackend):
+                    names = sorted(self.collection.shards)
+                    for name in names:
+                        self.collection.shards[name] = self._rebuild_chroma_collection(name)
+                else:
+                    names = [settings.collection_name]
+                    self.collection = self._rebuild_chroma_collection(settings.collection_name)
+            except Exception:
+                # Collections that were not swapped still use the previous parameters
+                self.hnsw_params = previous_params
+                raise
+        
+        log.info(f"Rebuilt {len(names)} collections with {params}")
+        return {"rebuilt": names, "hnsw_params": params}
+    
+    def _rebuild_chroma_collection(self, name: str):
+        source = self.client.get_collection(name=name)
+        staging_name = f"rebuild_{name}"[:63]
+        
+        if staging_name in self.list_collections():
+            self.client.delete_collection(name=staging_name)
+        staging = self.client.create_collection(name=staging_name, metadata=self.get_collection_metadata())
+        
+        page_size = min(settings.vector_read_page_size, self.get_write_batch_size())
+        offset = 0
+        while True:
+            page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            staging.upsert(
+                ids=page['ids'],
+                embeddings=page['embeddings'],
+                documents=page['documents'],
+                metadatas=page['metadatas']
+            )
+            offset += len(page['ids'])
+        
+        # Chroma cannot swap collections atomically. Collection objects are bound by id, so queries keep using the
+        # original while names move; it is renamed aside, not dropped, until the copy holds its name
+        retired_name = f"retired_{name}"[:63]
+        if retired_name in self.list_collections():
+            self.client.delete_collection(name=retired_name)
+        source.modify(name=retired_name)
+        try:
+            staging.modify(name=name)
+        except Exception:
+            source.modify(name=name)
+            self.client.delete_collection(name=staging_name)
+            raise
+        
+        self.client.delete_collection(name=retired_name)
+        return staging
+    
     def reset(self):
         try:
-            self.client.delete_collection(name=settings.collection_name)
-            self.collection = self.client.create_collection(
-                name=settings.collection_name,
-                metadata={"hnsw:space": "cosine"}
-            )
+            self.chunk_index.clear()
+            
+            if isinstance(self.collection, (NumpyVectorBackend, ShardedVectorBackend)):
+                self.collection.reset()
+            else:
+                self.client.delete_collection(name=settings.collection_name)
+                self.collection = self.client.create_collection(
+                    name=settings.collection_name,
+                    metadata=self.get_collection_metadata()
+                )
+            self._notify('on_reset')
             log.warning("Vector store reset")
         except Exception as e:
             log.error(f"Error resetting vector store: {e}")
 
 
+class DocumentChunkIndex:
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._locations = {}
+    
+    def load(self, document_id: str, chunk_ids: Dict[int, str]):
+        with self._lock:
+            self._documents[document_id] = dict(chunk_ids)
+            for chunk_index, chunk_id in chunk_ids.items():
+                self._locations[chunk_id] = (document_id, chunk_index)
+    
+    def get(self, document_id: str) -> Optional[Dict[int, str]]:
+        with self._lock:
+            chunk_ids = self._documents.get(document_id)
+            return dict(chunk_ids) if chunk_ids is not None else None
+    
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                # Only documents loaded from the store are known to be complete; others load on first use
+                chunk_ids = self._documents.get(metadata.get('document_id'))
+                if chunk_ids is not None:
+                    chunk_ids[metadata.get('chunk_index', 0)] = chunk_id
+                    self._locations[chunk_id] = (metadata.get('document_id'), metadata.get('chunk_index', 0))
+    
+    def discard(self, ids: List[str]):
+        with self._lock:
+            for chunk_id in ids:
+                location = self._locations.pop(chunk_id, None)
+                if location is not None:
+                    document_id, chunk_index = location
+                    self._documents.get(document_id, {}).pop(chunk_index, None)
+    
+    def drop(self, document_id: str):
+        with self._lock:
+            for chunk_id in self._documents.pop(document_id, {}).values():
+                self._locations.pop(chunk_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._locations.clear()
+
+
+class BulkVectorWriter:
+    
+    def __init__(self, store: VectorStore, batch_size: int = None):
+        self.store = store
+        self.batch_size = batch_size or store.get_write_batch_size()
+        self._lock = threading.Lock()
+        self._texts = []
+        self._embeddings = []
+        self._metadatas = []
+        self._ids = []
+        self.rows_written = 0
+        self.batches_written = 0
+        self.write_seconds = 0.0
+    
+    def add(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ):
+        with self._lock:
+            self._texts.extend(texts)
+            self._embeddings.extend(embeddings)
+            self._metadatas.extend(metadatas)
+            self._ids.extend(ids)
+            
+            while len(self._ids) >= self.batch_size:
+                self._write(self.batch_size)
+    
+    def flush(self) -> Dict[str, Any]:
+        with self._lock:
+            while self._ids:
+                self._write(self.batch_size)
+        return self.stats()
+    
+    def _write(self, size: int):
+        texts = self._texts[:size]
+        embeddings = self._embeddings[:size]
+        metadatas = self._metadatas[:size]
+        ids = self._ids[:size]
+        
+        start_time = time.perf_counter()
+        self.store.upsert_batch(texts, embeddings, metadatas, ids)
+        self.write_seconds += time.perf_counter() - start_time
+        
+        # Only drop rows from the buffer once they are safely written, so a retry resends them
+        del self._texts[:size]
+        del self._embeddings[:size]
+        del self._metadatas[:size]
+        del self._ids[:size]
+        
+        self.rows_written += len(ids)
+        self.batches_written += 1
+    
+    def discard(self, ids: List[str]) -> int:
+        # Drops buffered rows that must never be written, e.g. those of a document that failed to ingest
+        with self._lock:
+            dropped = set(ids)
+            keep = [i for i, chunk_id in enumerate(self._ids) if chunk_id not in dropped]
+            removed = len(self._ids) - len(keep)
+            self._texts = [self._texts[i] for i in keep]
+            self._embeddings = [self._embeddings[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._ids = [self._ids[i] for i in keep]
+            return removed
+    
+    def pending_documents(self) -> Dict[str, List[str]]:
+        with self._lock:
+            documents = {}
+            for chunk_id, metadata in zip(self._ids, self._metadatas):
+                documents.setdefault(metadata.get('document_id'), []).append(chunk_id)
+            return documents
+    
+    @property
+    def pending(self) -> int:
+        return len(self._ids)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "pending": self.pending,
+            "write_seconds": self.write_seconds,
+            "rows_per_second": self.rows_written / self.write_seconds if self.write_seconds else 0.0
+        }
+    
+    def __enter__(self) -> "BulkVectorWriter":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+
 vector_store = VectorStore()
 
-__all__ = ["VectorStore", "vector_store"]
\ No newline at end of file
+__all__ = ["VectorStore", "BulkVectorWriter", "DocumentChunkIndex", "vector_store"]
\ No newline at end of file
@@ -4,6 +4,8 @@ from fastapi.responses import JSONResponse
 from app.config import settings
 from app.utils.logging_config import log
 from app.api import health, upload, query
+from app.core.hybrid_search import hybrid_search
+from app.core.reranking import reranker
 
 app = FastAPI(
     title=settings.app_name,
@@ -28,12 +30,14 @@ app.include_router(query.router, prefix="/api", tags=["query"])
 async def startup_event():
     log.info(f"Starting {settings.app_name} v{settings.app_version}")
     settings.ensure_directories()
+    reranker.warmup()
     log.info("Application startup complete")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down application")
+    hybrid_search.flush()
 
 
 @app.get("/")
@@ -13,6 +13,11 @@ class FileType(str, Enum):
     PPTX = "pptx"
 
 
+class FusionMode(str, Enum):
+    WEIGHTED = "weighted"
+    RRF = "rrf"
+
+
 class QueryType(str, Enum):
     FACTUAL = "factual"
     EXPLORATORY = "exploratory"
@@ -26,7 +31,7 @@ class DocumentMetadata(BaseModel):
     file_size: int  # bytes
     upload_timestamp: datetime
     num_chunks: int
-    source_path: str
+    source_path: Optional[str] = None  # None when uploads are not persisted
     additional_metadata: Optional[Dict[str, Any]] = None
 
 
@@ -55,6 +60,8 @@ class QueryRequest(BaseModel):
     similarity_threshold: Optional[float] = Field(default=0.7, ge=0.0, le=1.0)
     enable_reranking: Optional[bool] = True
     file_types: Optional[List[FileType]] = None
+    search_effort: Optional[int] = Field(default=None, ge=1, le=1000)  # HNSW search_ef for this request
+    fusion: Optional[FusionMode] = None  # hybrid score fusion; defaults to HYBRID_FUSION
     
     @validator('query')
     def validate_query(cls, v):
@@ -63,6 +70,23 @@ class QueryRequest(BaseModel):
         return v.strip()
 
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=1000)
+    top_k: Optional[int] = Field(default=10, ge=1, le=50)
+    similarity_threshold: Optional[float] = Field(default=0.7, ge=0.0, le=1.0)
+    file_types: Optional[List[FileType]] = None
+    search_effort: Optional[int] = Field(default=None, ge=1, le=1000)
+    fusion: Optional[FusionMode] = None
+
+
+class CollectionRebuildRequest(BaseModel):
+    hnsw_m: Optional[int] = Field(default=None, ge=2, le=128)
+    construction_ef: Optional[int] = Field(default=None, ge=1, le=2000)
+    search_ef: Optional[int] = Field(default=None, ge=1, le=2000)
+    eval_k: int = Field(default=10, ge=1, le=100)
+    eval_sample_size: int = Field(default=100, ge=1, le=1000)
+
+
 class RetrievalResult(BaseModel):
     document_id: str
     chunk_id: str
@@ -82,6 +106,16 @@ class QueryResponse(BaseModel):
     processing_time: float
     retrieval_method: str  # "dense", "sparse", "hybrid"
     reranked: bool = False
+    timings: Optional[Dict[str, Any]] = None  # per-leg milliseconds, status and leg pool load for hybrid retrieval
+
+
+class BatchQueryResponse(BaseModel):
+    success: bool
+    total_queries: int
+    responses: List[QueryResponse]
+    processing_time: float
+    retrieval_method: str
+    timings: Optional[Dict[str, Any]] = None
 
 
 class HealthResponse(BaseModel):
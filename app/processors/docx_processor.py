@@ -1,68 +1,77 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 from docx import Document
+from docx.document import Document as DocxDocument
 from app.utils.logging_config import log
-from app.utils.chunking import chunk_text
+from app.utils.chunking import chunk_document
+from app.processors.source import DocumentSource
+from app.processors.registry import processor_registry, ooxml_preflight
 
 
 class DOCXProcessor:
     
     def __init__(self):
         self.supported_extensions = ['.docx']
+        self.supported_mime_types = ['application/vnd.openxmlformats-officedocument.wordprocessingml.document']
     
     def can_process(self, file_path: str) -> bool:
         return Path(file_path).suffix.lower() in self.supported_extensions
     
-    def extract_text_from_docx(self, docx_path: str) -> str:
+    def preflight(self, head: bytes, tail: bytes) -> Tuple[bool, Optional[str]]:
+        return ooxml_preflight(head, tail)
+    
+    def extract_text_from_docx(self, doc: DocxDocument) -> str:
         try:
-            doc = Document(docx_path)
-            text = ""
-            
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
+            parts = [paragraph.text + "\n" for paragraph in doc.paragraphs]
             
             for table in doc.tables:
                 for row in table.rows:
-                    for cell in row.cells:
-                        text += cell.text + " "
-                    text += "\n"
+                    parts.extend(cell.text + " " for cell in row.cells)
+                    parts.append("\n")
             
-            return text.strip()
+            return "".join(parts).strip()
         except Exception as e:
             log.error(f"Error extracting text from DOCX: {e}")
             return ""
     
-    def process(self, file_path: str) -> Tuple[List[str], Dict[str, Any]]:
+    def process(self, source: Union[str, DocumentSource]) -> Tuple[List[str], Dict[str, Any]]:
+        owned = not isinstance(source, DocumentSource)
+        source = DocumentSource.coerce(source)
+        
         try:
-            text = self.extract_text_from_docx(file_path)
+            doc = Document(source.open_stream())
+            text = self.extract_text_from_docx(doc)
             
             if not text:
                 raise ValueError("No text extracted from DOCX")
             
-            chunks_with_indices = chunk_text(text, method="smart")
-            chunks = [chunk for chunk, _ in chunks_with_indices]
-            
-            doc = Document(file_path)
+            chunks, spans, chunk_budget = chunk_document(text, 'docx')
             
             metadata = {
                 'file_type': 'docx',
-                'file_path': str(file_path),
-                'filename': Path(file_path).name,
+                'file_path': source.file_path,
+                'filename': source.filename,
                 'num_paragraphs': len(doc.paragraphs),
                 'num_tables': len(doc.tables),
                 'text_length': len(text),
                 'total_chunks': len(chunks),
-                'extension': Path(file_path).suffix
+                'chunk_spans': spans,
+                'chunk_budget': chunk_budget,
+                'extension': source.extension
             }
             
-            log.info(f"Processed DOCX: {file_path} -> {len(chunks)} chunks")
+            log.info(f"Processed DOCX: {source.filename} -> {len(chunks)} chunks")
             return chunks, metadata
             
         except Exception as e:
-            log.error(f"Error processing DOCX {file_path}: {e}")
+            log.error(f"Error processing DOCX {source.filename}: {e}")
             raise
+        finally:
+            if owned:
+                source.close()
 
 
 docx_processor = DOCXProcessor()
+processor_registry.register('docx', docx_processor, cost_estimate=2.0)
 
 __all__ = ["DOCXProcessor", "docx_processor"]
\ No newline at end of file
@@ -1,25 +1,32 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 from PIL import Image
 import pytesseract
+import filetype
 from app.config import settings
 from app.utils.logging_config import log
-from app.utils.chunking import chunk_text
+from app.utils.chunking import chunk_document
+from app.processors.source import DocumentSource
+from app.processors.registry import processor_registry
 
 
 class ImageProcessor:
     
     def __init__(self):
         self.supported_extensions = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp']
+        self.supported_mime_types = ['image/png', 'image/jpeg', 'image/gif', 'image/bmp', 'image/webp']
         pytesseract.pytesseract.tesseract_cmd = settings.tesseract_cmd
     
     def can_process(self, file_path: str) -> bool:
         return Path(file_path).suffix.lower() in self.supported_extensions
     
-    def extract_text_from_image(self, image_path: str) -> str:
+    def preflight(self, head: bytes, tail: bytes) -> Tuple[bool, Optional[str]]:
+        if not filetype.is_image(head):
+            return False, "File is not a recognised image"
+        return True, None
+    
+    def extract_text_from_image(self, image: Image.Image) -> str:
         try:
-            image = Image.open(image_path)
-            
             text = pytesseract.image_to_string(
                 image,
                 lang=settings.ocr_language,
@@ -28,41 +35,51 @@ class ImageProcessor:
             
             return text.strip()
         except Exception as e:
-            log.error(f"OCR error for {image_path}: {e}")
+            log.error(f"OCR error for image: {e}")
             return ""
     
-    def process(self, file_path: str) -> Tuple[List[str], Dict[str, Any]]:
+    def process(self, source: Union[str, DocumentSource]) -> Tuple[List[str], Dict[str, Any]]:
+        owned = not isinstance(source, DocumentSource)
+        source = DocumentSource.coerce(source)
+        
         try:
-            image = Image.open(file_path)
+            image = Image.open(source.open_stream())
             
-            ocr_text = self.extract_text_from_image(file_path)
+            ocr_text = self.extract_text_from_image(image)
             
             if ocr_text:
-                chunks_with_indices = chunk_text(ocr_text, method="smart")
-                chunks = [chunk for chunk, _ in chunks_with_indices]
+                chunks, spans, chunk_budget = chunk_document(ocr_text, 'image')
             else:
-                chunks = [f"Image file: {Path(file_path).name} (no text detected)"]
+                spans = []
+                chunk_budget = None
+                chunks = [f"Image file: {source.filename} (no text detected)"]
             
             metadata = {
                 'file_type': 'image',
-                'file_path': str(file_path),
-                'filename': Path(file_path).name,
+                'file_path': source.file_path,
+                'filename': source.filename,
                 'image_size': image.size,
                 'image_mode': image.mode,
                 'has_text': bool(ocr_text),
                 'ocr_text_length': len(ocr_text),
                 'total_chunks': len(chunks),
-                'extension': Path(file_path).suffix
+                'chunk_spans': spans,
+                'chunk_budget': chunk_budget,
+                'extension': source.extension
             }
             
-            log.info(f"Processed image: {file_path} -> {len(chunks)} chunks")
+            log.info(f"Processed image: {source.filename} -> {len(chunks)} chunks")
             return chunks, metadata
             
         except Exception as e:
-            log.error(f"Error processing image {file_path}: {e}")
+            log.error(f"Error processing image {source.filename}: {e}")
             raise
+        finally:
+            if owned:
+                source.close()
 
 
 image_processor = ImageProcessor()
+processor_registry.register('image', image_processor, cost_estimate=25.0)
 
 __all__ = ["ImageProcessor", "image_processor"]
\ No newline at end of file
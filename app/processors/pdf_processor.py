@@ -1,43 +1,46 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 import fitz
 from PIL import Image
 import io
 import pytesseract
 from app.config import settings
 from app.utils.logging_config import log
-from app.utils.chunking import chunk_text
+from app.utils.chunking import chunk_document
+from app.processors.registry import processor_registry
+from app.processors.source import DocumentSource
 
 
 class PDFProcessor:
     
     def __init__(self):
         self.supported_extensions = ['.pdf']
+        self.supported_mime_types = ['application/pdf']
         pytesseract.pytesseract.tesseract_cmd = settings.tesseract_cmd
     
     def can_process(self, file_path: str) -> bool:
         return Path(file_path).suffix.lower() in self.supported_extensions
     
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
+    def preflight(self, head: bytes, tail: bytes) -> Tuple[bool, Optional[str]]:
+        if b'%PDF-' not in head[:1024]:
+            return False, "File is not a valid PDF"
+        if b'%%EOF' not in tail:
+            return False, "PDF is truncated or corrupt"
+        if b'/Encrypt' in tail:
+            return False, "PDF is encrypted"
+        return True, None
+    
+    def extract_text_from_pdf(self, doc: fitz.Document) -> str:
         try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            
-            for page in doc:
-                text += page.get_text()
-            
-            doc.close()
-            return text.strip()
+            return "".join(page.get_text() for page in doc).strip()
         except Exception as e:
             log.error(f"Error extracting text from PDF: {e}")
             return ""
     
-    def extract_images_from_pdf(self, pdf_path: str) -> List[Image.Image]:
+    def extract_images_from_pdf(self, doc: fitz.Document) -> List[Image.Image]:
         images = []
         
         try:
-            doc = fitz.open(pdf_path)
-            
             for page_num in range(len(doc)):
                 page = doc[page_num]
                 image_list = page.get_images(full=True)
@@ -50,7 +53,6 @@ class PDFProcessor:
                     image = Image.open(io.BytesIO(image_bytes))
                     images.append(image)
             
-            doc.close()
             return images
         except Exception as e:
             log.error(f"Error extracting images from PDF: {e}")
@@ -72,11 +74,15 @@ class PDFProcessor:
         
         return ocr_text.strip()
     
-    def process(self, file_path: str) -> Tuple[List[str], Dict[str, Any]]:
+    def process(self, source: Union[str, DocumentSource]) -> Tuple[List[str], Dict[str, Any]]:
+        owned = not isinstance(source, DocumentSource)
+        source = DocumentSource.coerce(source)
+        
         try:
-            pdf_text = self.extract_text_from_pdf(file_path)
-            
-            images = self.extract_images_from_pdf(file_path)
+            # PyMuPDF reads straight from the bytes object without copying it
+            with fitz.open(stream=source.as_bytes(), filetype="pdf") as doc:
+                pdf_text = self.extract_text_from_pdf(doc)
+                images = self.extract_images_from_pdf(doc)
             
             ocr_text = ""
             if images:
@@ -88,32 +94,39 @@ class PDFProcessor:
             
             if combined_text:
                 # CRITICAL FIX: Actually chunk the PDF text properly!
-                chunks_with_indices = chunk_text(combined_text, method="smart")
-                chunks = [chunk for chunk, _ in chunks_with_indices]
+                chunks, spans, chunk_budget = chunk_document(combined_text, 'pdf')
             else:
-                chunks = [f"PDF file: {Path(file_path).name} (no text extracted)"]
+                spans = []
+                chunk_budget = None
+                chunks = [f"PDF file: {source.filename} (no text extracted)"]
             
             metadata = {
                 'file_type': 'pdf',
-                'file_path': str(file_path),
-                'filename': Path(file_path).name,
+                'file_path': source.file_path,
+                'filename': source.filename,
                 'has_text': bool(pdf_text),
                 'has_images': bool(images),
                 'num_images': len(images),
                 'text_length': len(pdf_text),
                 'ocr_text_length': len(ocr_text),
                 'total_chunks': len(chunks),
-                'extension': Path(file_path).suffix
+                'chunk_spans': spans,
+                'chunk_budget': chunk_budget,
+                'extension': source.extension
             }
             
-            log.info(f"Processed PDF: {file_path} -> {len(chunks)} chunks, {len(images)} images")
+            log.info(f"Processed PDF: {source.filename} -> {len(chunks)} chunks, {len(images)} images")
             return chunks, metadata
             
         except Exception as e:
-            log.error(f"Error processing PDF {file_path}: {e}")
+            log.error(f"Error processing PDF {source.filename}: {e}")
             raise
+        finally:
+            if owned:
+                source.close()
 
 
 pdf_processor = PDFProcessor()
+processor_registry.register('pdf', pdf_processor, cost_estimate=10.0)
 
 __all__ = ["PDFProcessor", "pdf_processor"]
\ No newline at end of file
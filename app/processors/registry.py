@@ -0,0 +1,145 @@
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+import filetype
+from app.utils.logging_config import log
+
+try:
+    import magic
+except Exception:
+    # python-magic needs the native libmagic, which is not always present
+    magic = None
+
+
+SNIFF_BYTES = 8192
+TAIL_BYTES = 4096
+
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_SIGNATURE = b'PK\x03\x04'
+ZIP_END_OF_DIRECTORY = b'PK\x05\x06'
+
+
+def ooxml_preflight(head: bytes, tail: bytes) -> Tuple[bool, Optional[str]]:
+    # Password-protected DOCX/XLSX files are wrapped in an OLE container
+    if head.startswith(OLE_SIGNATURE):
+        return False, "File is encrypted or in a legacy Office format"
+    
+    if not head.startswith(ZIP_SIGNATURE):
+        return False, "File is not a valid Office Open XML document"
+    
+    if ZIP_END_OF_DIRECTORY not in tail:
+        return False, "File is truncated or corrupt"
+    
+    return True, None
+
+
+class ProcessorRegistry:
+    
+    def __init__(self):
+        self.processors = {}
+        self.costs = {}
+        self.by_extension = {}
+        self.by_mime_type = {}
+    
+    def register(
+        self,
+        processor_type: str,
+        processor: Any,
+        extensions: List[str] = None,
+        mime_types: List[str] = None,
+        cost_estimate: float = 1.0
+    ):
+        extensions = extensions or getattr(processor, 'supported_extensions', [])
+        mime_types = mime_types or getattr(processor, 'supported_mime_types', [])
+        
+        self.processors[processor_type] = processor
+        self.costs[processor_type] = cost_estimate
+        
+        for ext in extensions:
+            self.by_extension[ext.lower()] = processor_type
+        
+        for mime_type in mime_types:
+            candidates = self.by_mime_type.setdefault(mime_type, [])
+            if processor_type not in candidates:
+                candidates.append(processor_type)
+            candidates.sort(key=lambda t: self.costs[t])
+        
+        log.debug(f"Registered {processor_type} processor (cost {cost_estimate})")
+    
+    def read_signature(self, file_path: str) -> Tuple[bytes, bytes]:
+        with open(file_path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+            f.seek(0, 2)
+            size = f.tell()
+            if size <= SNIFF_BYTES:
+                return head, head
+            f.seek(max(size - TAIL_BYTES, 0))
+            tail = f.read(TAIL_BYTES)
+        return head, tail
+    
+    def sniff_mime_type(self, head: bytes) -> Optional[str]:
+        if not head:
+            return None
+        
+        kind = filetype.guess(head)
+        if kind is not None:
+            return kind.mime
+        
+        if magic is not None:
+            try:
+                return magic.from_buffer(head, mime=True)
+            except Exception as e:
+                log.debug(f"libmagic sniffing failed: {e}")
+        
+        return None
+    
+    def resolve(self, file_path: str, head: bytes = None) -> Tuple[Optional[Any], Optional[str]]:
+        extension_type = self.by_extension.get(Path(file_path).suffix.lower())
+        
+        if head is None and Path(file_path).is_file():
+            head, _ = self.read_signature(file_path)
+        
+        mime_type = self.sniff_mime_type(head)
+        candidates = self.by_mime_type.get(mime_type, []) if mime_type else []
+        
+        if candidates and extension_type not in candidates:
+            processor_type = candidates[0]
+            log.warning(f"{file_path} looks like {mime_type}, using {processor_type} processor instead of its extension")
+            return self.processors[processor_type], processor_type
+        
+        if extension_type is None:
+            return None, None
+        
+        return self.processors[extension_type], extension_type
+    
+    def preflight(
+        self,
+        file_path: str,
+        processor_type: str,
+        head: bytes = None,
+        tail: bytes = None
+    ) -> Tuple[bool, Optional[str]]:
+        processor = self.processors.get(processor_type)
+        if processor is None:
+            return False, f"Unknown processor type: {processor_type}"
+        
+        if head is None or tail is None:
+            try:
+                head, tail = self.read_signature(file_path)
+            except OSError as e:
+                return False, f"File could not be read: {e}"
+        
+        if not head:
+            return False, "File is empty"
+        
+        if hasattr(processor, 'preflight'):
+            return processor.preflight(head, tail)
+        
+        return True, None
+    
+    def estimate_cost(self, processor_type: str, file_size: int) -> float:
+        return self.costs.get(processor_type, 1.0) * max(file_size, 1) / (1024 * 1024)
+
+
+processor_registry = ProcessorRegistry()
+
+__all__ = ["ProcessorRegistry", "processor_registry", "ooxml_preflight"]
\ No newline at end of file
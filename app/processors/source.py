@@ -0,0 +1,134 @@
+import io
+import mmap
+from pathlib import Path
+from typing import Optional, Union
+
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+class BufferReader(io.RawIOBase):
+    
+    def __init__(self, buffer: Buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+    
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        
+        self._pos = max(self._pos, 0)
+        return self._pos
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class DocumentSource:
+    
+    def __init__(self, buffer: Buffer, filename: str, file_path: Optional[str] = None):
+        self.buffer = buffer
+        self.filename = filename
+        self.file_path = file_path
+        self._view = memoryview(buffer).cast('B')
+        self._readers = []
+    
+    @classmethod
+    def from_bytes(cls, data: Buffer, filename: str, file_path: Optional[str] = None) -> "DocumentSource":
+        return cls(data, filename=filename, file_path=file_path)
+    
+    @classmethod
+    def from_path(cls, file_path: str) -> "DocumentSource":
+        path = Path(file_path)
+        
+        with open(path, 'rb') as f:
+            if path.stat().st_size == 0:
+                buffer = b""
+            else:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        return cls(buffer, filename=path.name, file_path=str(file_path))
+    
+    @classmethod
+    def coerce(cls, source: Union[str, Path, "DocumentSource"]) -> "DocumentSource":
+        # A source opened here from a path belongs to the caller of coerce, which must close it
+        if isinstance(source, DocumentSource):
+            return source
+        return cls.from_path(str(source))
+    
+    @property
+    def size(self) -> int:
+        return len(self._view)
+    
+    @property
+    def extension(self) -> str:
+        return Path(self.filename).suffix
+    
+    def head(self, n: int) -> bytes:
+        return bytes(self._view[:n])
+    
+    def tail(self, n: int) -> bytes:
+        return bytes(self._view[max(self.size - n, 0):])
+    
+    def as_bytes(self) -> bytes:
+        # Only copies when the buffer is not already an immutable bytes object
+        if isinstance(self.buffer, bytes):
+            return self.buffer
+        return self._view.tobytes()
+    
+    def open_stream(self) -> io.RawIOBase:
+        if isinstance(self.buffer, bytes):
+            # BytesIO shares an immutable bytes buffer until it is written to
+            return io.BytesIO(self.buffer)
+        reader = BufferReader(self._view)
+        # Tracked so close() can release every view onto the buffer before unmapping it
+        self._readers.append(reader)
+        return reader
+    
+    def decode(self, encoding: str = 'utf-8') -> str:
+        return str(self._view, encoding)
+    
+    def close(self):
+        for reader in self._readers:
+            reader.close()
+        self._readers.clear()
+        self._view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+    
+    def __enter__(self) -> "DocumentSource":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+__all__ = ["BufferReader", "DocumentSource"]
\ No newline at end of file
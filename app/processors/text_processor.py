@@ -1,64 +1,68 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union
 from app.utils.logging_config import log
-from app.utils.chunking import chunk_text
+from app.utils.chunking import chunk_document
+from app.processors.registry import processor_registry
+from app.processors.source import DocumentSource
 
 
 class TextProcessor:
     
     def __init__(self):
         self.supported_extensions = ['.txt', '.md', '.csv', '.json', '.log']
+        self.supported_mime_types = ['text/plain', 'text/markdown', 'text/csv', 'application/json']
     
     def can_process(self, file_path: str) -> bool:
         return Path(file_path).suffix.lower() in self.supported_extensions
     
-    def process(self, file_path: str) -> Tuple[List[str], Dict[str, Any]]:
+    def preflight(self, head: bytes, tail: bytes) -> Tuple[bool, Optional[str]]:
+        if b'\x00' in head:
+            return False, "File appears to be binary, not text"
+        return True, None
+    
+    def process(self, source: Union[str, DocumentSource]) -> Tuple[List[str], Dict[str, Any]]:
+        owned = not isinstance(source, DocumentSource)
+        source = DocumentSource.coerce(source)
+        
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            encoding = 'utf-8'
+            try:
+                content = source.decode(encoding)
+            except UnicodeDecodeError:
+                encoding = 'latin-1'
+                content = source.decode(encoding)
             
             if not content.strip():
                 raise ValueError("File is empty")
             
-            chunks_with_indices = chunk_text(content, method="smart")
-            chunks = [chunk for chunk, _ in chunks_with_indices]
+            chunks, spans, chunk_budget = chunk_document(content, 'text')
             
             metadata = {
                 'file_type': 'text',
-                'file_path': str(file_path),
-                'filename': Path(file_path).name,
+                'file_path': source.file_path,
+                'filename': source.filename,
                 'total_characters': len(content),
                 'total_chunks': len(chunks),
-                'extension': Path(file_path).suffix
+                'chunk_spans': spans,
+                'chunk_budget': chunk_budget,
+                'extension': source.extension
             }
             
-            log.info(f"Processed text file: {file_path} -> {len(chunks)} chunks")
-            return chunks, metadata
-            
-        except UnicodeDecodeError:
-            with open(file_path, 'r', encoding='latin-1') as f:
-                content = f.read()
-            
-            chunks_with_indices = chunk_text(content, method="smart")
-            chunks = [chunk for chunk, _ in chunks_with_indices]
-            
-            metadata = {
-                'file_type': 'text',
-                'file_path': str(file_path),
-                'filename': Path(file_path).name,
-                'total_characters': len(content),
-                'total_chunks': len(chunks),
-                'extension': Path(file_path).suffix,
-                'encoding': 'latin-1'
-            }
+            if encoding != 'utf-8':
+                metadata['encoding'] = encoding
             
+            log.info(f"Processed text file: {source.filename} -> {len(chunks)} chunks")
             return chunks, metadata
             
         except Exception as e:
-            log.error(f"Error processing text file {file_path}: {e}")
+            log.error(f"Error processing text file {source.filename}: {e}")
             raise
+        finally:
+            if owned:
+                source.close()
 
 
 text_processor = TextProcessor()
+processor_registry.register('text', text_processor, cost_estimate=1.0)
 
 __all__ = ["TextProcessor", "text_processor"]
\ No newline at end of file
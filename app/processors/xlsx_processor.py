@@ -1,77 +1,86 @@
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
-from openpyxl import load_workbook
+from typing import Dict, Any, List, Optional, Tuple, Union
+from openpyxl import load_workbook, Workbook
 from app.utils.logging_config import log
-from app.utils.chunking import chunk_text
+from app.utils.chunking import chunk_document
+from app.processors.source import DocumentSource
+from app.processors.registry import processor_registry, ooxml_preflight
 
 
 class XLSXProcessor:
     
     def __init__(self):
         self.supported_extensions = ['.xlsx', '.xlsm']
+        self.supported_mime_types = ['application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']
     
     def can_process(self, file_path: str) -> bool:
         return Path(file_path).suffix.lower() in self.supported_extensions
     
-    def extract_text_from_xlsx(self, xlsx_path: str) -> str:
+    def preflight(self, head: bytes, tail: bytes) -> Tuple[bool, Optional[str]]:
+        return ooxml_preflight(head, tail)
+    
+    def extract_text_from_xlsx(self, wb: Workbook) -> str:
         try:
-            wb = load_workbook(xlsx_path, data_only=True)
-            text = ""
+            parts = []
             
             for sheet_name in wb.sheetnames:
                 sheet = wb[sheet_name]
-                text += f"\n=== Sheet: {sheet_name} ===\n"
+                parts.append(f"\n=== Sheet: {sheet_name} ===\n")
                 
                 for row in sheet.iter_rows(values_only=True):
                     row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
                     if row_text.strip():
-                        text += row_text + "\n"
+                        parts.append(row_text + "\n")
             
-            wb.close()
-            return text.strip()
+            return "".join(parts).strip()
         except Exception as e:
             log.error(f"Error extracting text from XLSX: {e}")
             return ""
     
-    def process(self, file_path: str) -> Tuple[List[str], Dict[str, Any]]:
+    def process(self, source: Union[str, DocumentSource]) -> Tuple[List[str], Dict[str, Any]]:
+        owned = not isinstance(source, DocumentSource)
+        source = DocumentSource.coerce(source)
+        
         try:
-            text = self.extract_text_from_xlsx(file_path)
+            wb = load_workbook(source.open_stream(), data_only=True)
+            
+            try:
+                text = self.extract_text_from_xlsx(wb)
+                num_sheets = len(wb.sheetnames)
+                total_rows = sum(wb[sheet_name].max_row for sheet_name in wb.sheetnames)
+            finally:
+                wb.close()
             
             if not text:
                 raise ValueError("No data extracted from XLSX")
             
-            chunks_with_indices = chunk_text(text, method="smart")
-            chunks = [chunk for chunk, _ in chunks_with_indices]
-            
-            wb = load_workbook(file_path, data_only=True)
-            num_sheets = len(wb.sheetnames)
-            
-            total_rows = 0
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                total_rows += sheet.max_row
-            
-            wb.close()
+            chunks, spans, chunk_budget = chunk_document(text, 'xlsx')
             
             metadata = {
                 'file_type': 'xlsx',
-                'file_path': str(file_path),
-                'filename': Path(file_path).name,
+                'file_path': source.file_path,
+                'filename': source.filename,
                 'num_sheets': num_sheets,
                 'total_rows': total_rows,
                 'text_length': len(text),
                 'total_chunks': len(chunks),
-                'extension': Path(file_path).suffix
+                'chunk_spans': spans,
+                'chunk_budget': chunk_budget,
+                'extension': source.extension
             }
             
-            log.info(f"Processed XLSX: {file_path} -> {len(chunks)} chunks")
+            log.info(f"Processed XLSX: {source.filename} -> {len(chunks)} chunks")
             return chunks, metadata
             
         except Exception as e:
-            log.error(f"Error processing XLSX {file_path}: {e}")
+            log.error(f"Error processing XLSX {source.filename}: {e}")
             raise
+        finally:
+            if owned:
+                source.close()
 
 
 xlsx_processor = XLSXProcessor()
+processor_registry.register('xlsx', xlsx_processor, cost_estimate=3.0)
 
 __all__ = ["XLSXProcessor", "xlsx_processor"]
\ No newline at end of file
@@ -0,0 +1,118 @@
+from typing import List, Tuple, Iterable, Dict, Any
+import re
+import unicodedata
+from functools import lru_cache
+from app.config import settings
+
+
+# Letters and digits in any script; inner apostrophes stay so possessives can be stemmed off
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:['’][^\W_]+)*")
+APOSTROPHES = re.compile(r"['’]")
+
+# Lucene's default English stop set: frequent enough to bloat postings, too generic to help ranking
+STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with"
+])
+
+
+# Bumped whenever light_stem changes, so segments stemmed the old way are rebuilt rather than silently missed
+STEMMER_VERSION = 2
+# "-es" is its own syllable after a sibilant (boxes, classes, churches); elsewhere only the "s" is a suffix
+SIBILANT_PLURALS = ("sses", "xes", "ches", "shes", "zzes")
+# Words that only look plural, and plurals the rules above would cut too far
+STEM_EXCEPTIONS = {
+    "news": "news",
+    "series": "series",
+    "species": "species",
+    "means": "means",
+    "lens": "lens",
+    "always": "always",
+    "perhaps": "perhaps",
+    "caches": "cache",
+    "niches": "niche"
+}
+
+
+@lru_cache(maxsize=65536)
+def light_stem(token: str) -> str:
+    # Possessives and plurals only, so stemming never merges unrelated words
+    if token.endswith("'s") or token.endswith("’s"):
+        token = token[:-2]
+    token = APOSTROPHES.sub("", token)
+    
+    if token in STEM_EXCEPTIONS:
+        return STEM_EXCEPTIONS[token]
+    if len(token) < 4 or not token.endswith("s") or token.isdigit():
+        return token
+    if token.endswith("ies") and not token.endswith(("eies", "aies")):
+        return token[:-3] + "y"
+    if token.endswith(SIBILANT_PLURALS):
+        return token[:-2]
+    if token.endswith(("us", "ss", "is")):
+        return token
+    return token[:-1]
+
+
+def fold_accents(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class Analyzer:
+    
+    def __init__(
+        self,
+        stopwords: Iterable[str] = None,
+        stemming: bool = True,
+        max_token_length: int = 64,
+        query_cache_size: int = 4096
+    ):
+        self.stopwords = frozenset(stopwords) if stopwords is not None else frozenset()
+        self.stemming = stemming
+        self.max_token_length = max_token_length
+        self.analyze_query = lru_cache(maxsize=query_cache_size)(self.analyze_query)
+    
+    def normalize(self, text: str) -> str:
+        # ASCII text is by far the common case and needs no Unicode normalization
+        if text.isascii():
+            return text.lower()
+        return fold_accents(text).casefold()
+    
+    def analyze(self, text: str) -> List[str]:
+        text = self.normalize(text)
+        stopwords = self.stopwords
+        max_length = self.max_token_length
+        if self.stemming:
+            # light_stem is memoized, so each distinct token is only stemmed once per process
+            return [
+                light_stem(token) for token in TOKEN_PATTERN.findall(text)
+                if token not in stopwords and len(token) <= max_length
+            ]
+        return [
+            token for token in TOKEN_PATTERN.findall(APOSTROPHES.sub("", text))
+            if token not in stopwords and len(token) <= max_length
+        ]
+    
+    def analyze_query(self, query: str) -> Tuple[str, ...]:
+        # Queries repeat far more than chunk texts, so their analysis is memoized
+        return tuple(self.analyze(query))
+    
+    def signature(self) -> Dict[str, Any]:
+        # Stored with persisted indexes; terms from a different analyzer would never match
+        return {
+            'stopwords': sorted(self.stopwords),
+            'stemming': self.stemming,
+            'stemmer_version': STEMMER_VERSION if self.stemming else None,
+            'max_token_length': self.max_token_length
+        }
+
+
+analyzer = Analyzer(
+    stopwords=STOPWORDS if settings.analyzer_stopwords else None,
+    stemming=settings.analyzer_stemming,
+    query_cache_size=settings.analyzer_query_cache_size
+)
+
+__all__ = ["Analyzer", "analyzer", "light_stem", "fold_accents", "STOPWORDS"]
\ No newline at end of file
@@ -1,90 +1,306 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any
+import math
+from bisect import bisect_left
+from functools import lru_cache
 import re
 from app.config import settings
+from app.utils.logging_config import log
+
+
+WORD_PATTERN = re.compile(r'\S+')
+PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n\s*')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+# Break strength per chunking method; higher wins when picking a cut point
+BOUNDARY_PATTERNS = {
+    "smart": [(PARAGRAPH_BREAK, 2), (SENTENCE_BREAK, 1)],
+    "sentences": [(PARAGRAPH_BREAK, 1), (SENTENCE_BREAK, 1)],
+    "paragraphs": [(PARAGRAPH_BREAK, 1)],
+    "tokens": [],
+}
+
+# Usable input length of each embedding model, excluding special tokens
+EMBEDDING_TOKEN_LIMITS = {
+    "text-embedding-3-small": 8191,
+    "text-embedding-3-large": 8191,
+    "text-embedding-ada-002": 8191,
+    "all-MiniLM-L6-v2": 254,
+}
+
+
+# Whitespace words understate subword tokens (roughly 1.3 per English word)
+WORDS_PER_TOKEN = 0.75
+
+
+class WhitespaceTokenizer:
+    
+    def __init__(self, model_name: str = None):
+        self.name = "whitespace"
+        limit = EMBEDDING_TOKEN_LIMITS.get(model_name)
+        self.max_tokens = int(limit * WORDS_PER_TOKEN) if limit else None
+    
+    def token_offsets(self, text: str) -> List[Tuple[int, int]]:
+        return [match.span() for match in WORD_PATTERN.finditer(text)]
+
+
+class TiktokenTokenizer:
+    
+    def __init__(self, model_name: str):
+        import tiktoken
+        
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        
+        self.name = model_name
+        self.max_tokens = EMBEDDING_TOKEN_LIMITS.get(model_name)
+    
+    def token_offsets(self, text: str) -> List[Tuple[int, int]]:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        _, starts = self.encoding.decode_with_offsets(tokens)
+        ends = starts[1:] + [len(text)]
+        return list(zip(starts, ends))
+
+
+class HFTokenizer:
+    
+    def __init__(self, model_name: str):
+        from tokenizers import Tokenizer
+        
+        repo_id = model_name if '/' in model_name else f"sentence-transformers/{model_name}"
+        self.tokenizer = Tokenizer.from_pretrained(repo_id)
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+        
+        self.name = model_name
+        self.max_tokens = EMBEDDING_TOKEN_LIMITS.get(model_name)
+    
+    def token_offsets(self, text: str) -> List[Tuple[int, int]]:
+        return self.tokenizer.encode(text, add_special_tokens=False).offsets
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer():
+    model_name = settings.text_embedding_model if settings.validate_api_key() else settings.local_embedding_model
+    try:
+        if settings.validate_api_key():
+            return TiktokenTokenizer(model_name)
+        return HFTokenizer(model_name)
+    except Exception as e:
+        log.warning(f"Embedding tokenizer unavailable, falling back to whitespace tokens: {e}")
+        return WhitespaceTokenizer(model_name)
 
 
 class TextChunker:
     
-    def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
-        self.chunk_size = chunk_size or settings.chunk_size
-        self.chunk_overlap = chunk_overlap or settings.chunk_overlap
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None, tokenizer=None):
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.chunk_size = chunk_size if chunk_size is not None else settings.chunk_size
+        self.chunk_overlap = chunk_overlap if chunk_overlap is not None else settings.chunk_overlap
+        
+        if self.tokenizer.max_tokens:
+            self.chunk_size = min(self.chunk_size, self.tokenizer.max_tokens)
+        
+        if self.chunk_overlap >= self.chunk_size:
+            self.chunk_overlap = 0
     
-    def chunk_by_tokens(self, text: str) -> List[str]:
-        words = text.split()
-        chunks = []
+    def chunk_spans(self, text: str, method: str = "smart") -> List[Tuple[int, int, int]]:
+        return self.spans_from_offsets(text, self.tokenizer.token_offsets(text), method)
+    
+    def spans_from_offsets(
+        self,
+        text: str,
+        offsets: List[Tuple[int, int]],
+        method: str = "smart"
+    ) -> List[Tuple[int, int, int]]:
+        num_tokens = len(offsets)
+        if num_tokens == 0:
+            return []
+        
+        starts = [start for start, _ in offsets]
+        
+        # break_strength[j] > 0 means a chunk may end right before token j
+        break_strength = [0] * (num_tokens + 1)
+        max_strength = 0
+        for pattern, strength in BOUNDARY_PATTERNS.get(method, []):
+            max_strength = max(max_strength, strength)
+            for match in pattern.finditer(text):
+                j = bisect_left(starts, match.start())
+                if strength > break_strength[j]:
+                    break_strength[j] = strength
+        
+        spans = []
+        i = 0
         
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk = ' '.join(words[i:i + self.chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
+        while i < num_tokens:
+            limit = min(i + self.chunk_size, num_tokens)
+            end = limit
+            
+            if limit < num_tokens and max_strength:
+                best = 0
+                for j in range(limit, i + self.chunk_size // 2, -1):
+                    if break_strength[j] > best:
+                        best, end = break_strength[j], j
+                        if best == max_strength:
+                            break
+            
+            start_char = offsets[i][0]
+            end_char = offsets[end - 1][1]
+            
+            while start_char < end_char and text[start_char].isspace():
+                start_char += 1
+            while end_char > start_char and text[end_char - 1].isspace():
+                end_char -= 1
+            
+            if end_char > start_char:
+                spans.append((start_char, end_char, end - i))
+            
+            if end >= num_tokens:
+                break
+            
+            i = max(end - self.chunk_overlap, i + 1)
         
-        return chunks
+        return spans
+    
+    def chunk_by_tokens(self, text: str) -> List[str]:
+        return [text[start:end] for start, end, _ in self.chunk_spans(text, method="tokens")]
     
     def chunk_by_sentences(self, text: str) -> List[str]:
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        chunks = []
-        current_chunk = []
-        current_length = 0
+        return [text[start:end] for start, end, _ in self.chunk_spans(text, method="sentences")]
+    
+    def chunk_by_paragraphs(self, text: str) -> List[str]:
+        return [text[start:end] for start, end, _ in self.chunk_spans(text, method="paragraphs")]
+    
+    def smart_chunk(self, text: str) -> List[Tuple[str, int]]:
+        spans = self.chunk_spans(text, method="smart")
+        return [(text[start:end], i) for i, (start, end, _) in enumerate(spans)]
+
+
+class ChunkBudget:
+    
+    def __init__(self, max_chunks: int = None, chunker: TextChunker = None):
+        self.max_chunks = max_chunks or settings.max_chunks_per_doc
+        self.chunker = chunker or TextChunker()
+    
+    def apply(
+        self,
+        text: str,
+        policy: str = "grow",
+        method: str = "smart"
+    ) -> Tuple[List[str], List[Tuple[int, int, int]], Dict[str, Any]]:
+        offsets = self.chunker.tokenizer.token_offsets(text)
+        spans = self.chunker.spans_from_offsets(text, offsets, method)
+        
+        report = {
+            'max_chunks': self.max_chunks,
+            'policy': policy,
+            'applied': 'none',
+            'original_chunks': len(spans),
+            'chunk_size': self.chunker.chunk_size
+        }
         
-        for sentence in sentences:
-            sentence_length = len(sentence.split())
+        if len(spans) > self.max_chunks:
+            if policy == "summarize":
+                chunks, spans = self.summarize(text, offsets, spans)
+                report['applied'] = 'summarize'
+                report['final_chunks'] = len(spans)
+                # Summaries keep only the lead of each child chunk, so the rest of the text is not searchable
+                report['text_dropped'] = True
+                return chunks, spans, report
             
-            if current_length + sentence_length > self.chunk_size and current_chunk:
-                chunks.append(' '.join(current_chunk))
-                overlap_sentences = current_chunk[-2:] if len(current_chunk) > 2 else current_chunk
-                current_chunk = overlap_sentences
-                current_length = sum(len(s.split()) for s in current_chunk)
+            if policy == "grow":
+                spans, report['chunk_size'] = self.grow(text, offsets, spans, method)
+                report['applied'] = 'grow'
             
-            current_chunk.append(sentence)
-            current_length += sentence_length
+            # Growing stops at the model's input limit; past that the tail is dropped rather than summarized away
+            if len(spans) > self.max_chunks:
+                spans = spans[:self.max_chunks]
+                report['applied'] = 'truncate' if policy != "grow" else 'grow+truncate'
+                report['dropped_chars'] = len(text) - spans[-1][1]
+        
+        report['final_chunks'] = len(spans)
+        report['text_dropped'] = report.get('dropped_chars', 0) > 0
+        return [text[start:end] for start, end, _ in spans], spans, report
+    
+    def grow(
+        self,
+        text: str,
+        offsets: List[Tuple[int, int]],
+        spans: List[Tuple[int, int, int]],
+        method: str
+    ) -> Tuple[List[Tuple[int, int, int]], int]:
+        original_size = self.chunker.chunk_size
+        # Without a known model limit chunks never grow past the configured size
+        size_limit = self.chunker.tokenizer.max_tokens or original_size
+        chunk_size = original_size
         
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
+        try:
+            while len(spans) > self.max_chunks and chunk_size < size_limit:
+                # Boundary snapping makes chunks slightly smaller than requested, so grow a little extra
+                chunk_size = min(math.ceil(chunk_size * len(spans) / self.max_chunks * 1.1), size_limit)
+                self.chunker.chunk_size = chunk_size
+                spans = self.chunker.spans_from_offsets(text, offsets, method)
+        finally:
+            self.chunker.chunk_size = original_size
         
-        return chunks
+        return spans, chunk_size
     
-    def chunk_by_paragraphs(self, text: str) -> List[str]:
-        paragraphs = text.split('\n\n')
+    def summarize(
+        self,
+        text: str,
+        offsets: List[Tuple[int, int]],
+        spans: List[Tuple[int, int, int]]
+    ) -> Tuple[List[str], List[Tuple[int, int, int]]]:
+        group_size = math.ceil(len(spans) / self.max_chunks)
+        starts = [start for start, _ in offsets]
         chunks = []
+        summary_spans = []
         
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
+        for g in range(0, len(spans), group_size):
+            group = spans[g:g + group_size]
+            share = max(self.chunker.chunk_size // len(group), 1)
+            leads = []
             
-            words = para.split()
-            if len(words) <= self.chunk_size:
-                chunks.append(para)
-            else:
-                sub_chunks = self.chunk_by_tokens(para)
-                chunks.extend(sub_chunks)
-        
-        return chunks
-    
-    def smart_chunk(self, text: str) -> List[Tuple[str, int]]:
-        if '\n\n' in text and len(text.split('\n\n')) > 1:
-            chunks = self.chunk_by_paragraphs(text)
-        elif '.' in text or '!' in text or '?' in text:
-            chunks = self.chunk_by_sentences(text)
-        else:
-            chunks = self.chunk_by_tokens(text)
+            # Extractive summary: the lead sentence of every child chunk, capped to an equal token share
+            for start_char, end_char, _ in group:
+                first_token = bisect_left(starts, start_char)
+                last_token = min(first_token + share, len(offsets)) - 1
+                lead_end = min(offsets[last_token][1], end_char)
+                
+                sentence_end = SENTENCE_BREAK.search(text, start_char, lead_end)
+                if sentence_end:
+                    lead_end = sentence_end.start()
+                
+                leads.append(text[start_char:lead_end].strip())
+            
+            summary = " ... ".join(lead for lead in leads if lead)
+            summary_offsets = self.chunker.tokenizer.token_offsets(summary)
+            if len(summary_offsets) > self.chunker.chunk_size:
+                summary = summary[:summary_offsets[self.chunker.chunk_size - 1][1]]
+            
+            chunks.append(summary)
+            summary_spans.append((group[0][0], group[-1][1], min(len(summary_offsets), self.chunker.chunk_size)))
         
-        return [(chunk, i) for i, chunk in enumerate(chunks)]
+        return chunks, summary_spans
+
+
+def chunk_document(
+    text: str,
+    file_type: str,
+    method: str = "smart"
+) -> Tuple[List[str], List[Tuple[int, int, int]], Dict[str, Any]]:
+    policy = settings.get_chunk_budget_policy(file_type)
+    return ChunkBudget().apply(text, policy=policy, method=method)
+
+
+def chunk_spans(text: str, method: str = "smart") -> List[Tuple[int, int, int]]:
+    return TextChunker().chunk_spans(text, method=method)
 
 
 def chunk_text(text: str, method: str = "smart") -> List[Tuple[str, int]]:
-    chunker = TextChunker()
-    
-    if method == "smart":
-        return chunker.smart_chunk(text)
-    elif method == "sentences":
-        chunks = chunker.chunk_by_sentences(text)
-    elif method == "paragraphs":
-        chunks = chunker.chunk_by_paragraphs(text)
-    else:
-        chunks = chunker.chunk_by_tokens(text)
-    
-    return [(chunk, i) for i, chunk in enumerate(chunks)]
+    spans = chunk_spans(text, method=method)
+    return [(text[start:end], i) for i, (start, end, _) in enumerate(spans)]
 
 
-__all__ = ["TextChunker", "chunk_text"]
\ No newline at end of file
+__all__ = ["TextChunker", "ChunkBudget", "chunk_text", "chunk_spans", "chunk_document", "get_tokenizer"]
\ No newline at end of file
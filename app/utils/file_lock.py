@@ -0,0 +1,72 @@
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock (Windows) the locks only serialise threads, so run a single worker process
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path: Path) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(str(path), threading.Lock())
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    # Exclusive across threads and worker processes; yields False when non-blocking and already held
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    thread_lock = _thread_lock(path)
+    if not thread_lock.acquire(blocking=blocking):
+        yield False
+        return
+    
+    try:
+        with open(path, 'a') as f:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        thread_lock.release()
+
+
+class SharedCounter:
+    # A monotonically increasing integer in a file, shared by every process that opens the same path
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+    
+    def value(self) -> int:
+        try:
+            return int(self.path.read_text() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+    
+    def increment(self) -> int:
+        with file_lock(self.lock_path):
+            value = self.value() + 1
+            staging = self.path.with_name(self.path.name + ".tmp")
+            staging.write_text(str(value))
+            os.replace(staging, self.path)
+            return value
+
+
+__all__ = ["SharedCounter", "file_lock"]
\ No newline at end of file
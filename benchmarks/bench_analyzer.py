@@ -0,0 +1,79 @@
+import argparse
+import glob
+import time
+import numpy as np
+from app.utils.analyzer import Analyzer, STOPWORDS
+
+BASE_WORDS = [
+    "report", "revenue", "quarter", "invoice", "policy", "company", "category", "analysis", "process",
+    "customer", "employee", "schedule", "budget", "contract", "meeting", "summary", "table", "figure",
+    "result", "market", "product", "service", "account", "payment", "study", "strategy", "risk", "value"
+]
+
+
+def make_corpus(rng, rows):
+    # Capitalised, punctuated and inflected forms, the variants whitespace splitting keeps apart
+    forms = []
+    for word in BASE_WORDS:
+        plural = word[:-1] + "ies" if word.endswith("y") else word + "s"
+        forms += [word, plural, word.capitalize(), f"{word}'s", f"{word},", f"{plural}.", f"({word})"]
+    words = np.array(forms + sorted(STOPWORDS) * 3)
+    return [" ".join(rng.choice(words, size=rng.integers(50, 300))) for _ in range(rows)]
+
+
+def whitespace(text):
+    return text.lower().split()
+
+
+def measure(name, tokenize, texts):
+    start_time = time.perf_counter()
+    analyzed = [tokenize(text) for text in texts]
+    elapsed = time.perf_counter() - start_time
+    
+    input_tokens = sum(len(text.split()) for text in texts)
+    vocabulary = set()
+    postings = 0
+    for tokens in analyzed:
+        terms = set(tokens)
+        vocabulary |= terms
+        postings += len(terms)
+    print(
+        f"{name:<22} {input_tokens / elapsed / 1e6:6.2f}M tokens/s | vocab {len(vocabulary):>8} "
+        f"| postings {postings:>10} | indexed tokens {sum(len(tokens) for tokens in analyzed):>10}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyzer throughput and its effect on vocabulary and postings size")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--files", help="Glob of text files to analyze instead of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=10000)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    if args.files:
+        texts = []
+        for path in glob.glob(args.files, recursive=True):
+            with open(path, 'r', errors='ignore') as f:
+                texts.append(f.read())
+    else:
+        texts = make_corpus(rng, args.rows)
+    
+    print(f"{len(texts)} texts, {sum(len(text) for text in texts) / 1e6:.1f}MB")
+    measure("whitespace", whitespace, texts)
+    measure("analyzer", Analyzer(stemming=False).analyze, texts)
+    measure("analyzer+stem", Analyzer(stemming=True).analyze, texts)
+    measure("analyzer+stem+stop", Analyzer(stopwords=STOPWORDS, stemming=True).analyze, texts)
+    
+    # Repeated queries hit the LRU cache instead of being re-analyzed
+    query_analyzer = Analyzer(stopwords=STOPWORDS)
+    queries = [" ".join(rng.choice(BASE_WORDS, size=3)) for _ in range(100)]
+    start_time = time.perf_counter()
+    for i in range(args.queries):
+        query_analyzer.analyze_query(queries[i % len(queries)])
+    elapsed = time.perf_counter() - start_time
+    print(f"cached query analysis  {elapsed / args.queries * 1e6:.2f}us per query")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
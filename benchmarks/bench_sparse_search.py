@@ -0,0 +1,111 @@
+import argparse
+import statistics
+import tempfile
+import time
+import numpy as np
+from app.core.sparse_index import InvertedIndex
+from app.utils.analyzer import analyzer
+
+try:
+    from rank_bm25 import BM25Okapi
+except ImportError:
+    BM25Okapi = None
+
+
+def make_corpus(rng, rows, vocab_size):
+    vocab = np.array([f"term{i}" for i in range(vocab_size)])
+    # Zipf-like term frequencies, so a few terms appear in almost every chunk
+    weights = 1 / np.arange(1, vocab_size + 1)
+    weights /= weights.sum()
+    return [" ".join(rng.choice(vocab, size=rng.integers(20, 120), p=weights)) for _ in range(rows)], vocab, weights
+
+
+def make_queries(rng, vocab, weights, count):
+    queries = []
+    for _ in range(count):
+        rare = rng.choice(vocab[50:], size=rng.integers(1, 4))
+        common = rng.choice(vocab, size=2, p=weights)
+        queries.append(" ".join(list(rare) + list(common)))
+    return queries
+
+
+def time_queries(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start_time = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    return latencies, results
+
+
+def report(name, latencies, agreement=None):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    line = f"{name:<14} query p50 {statistics.median(latencies):8.2f}ms p95 {p95:8.2f}ms"
+    if agreement is not None:
+        line += f" | top-k agreement {agreement:.3f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare block-max pruned BM25 with exhaustive scoring as the corpus grows")
+    parser.add_argument("--sizes", default="10000,50000,100000")
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--full-scan", action="store_true", help="Also time rank_bm25's score-every-document path")
+    parser.add_argument("--filters", default="50,10,1", help="Percentages of the corpus a file_type filter keeps")
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    
+    for rows in [int(size) for size in args.sizes.split(",")]:
+        texts, vocab, weights = make_corpus(rng, rows, args.vocab)
+        queries = make_queries(rng, vocab, weights, args.queries)
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            start_time = time.perf_counter()
+            builder = InvertedIndex()
+            # One hundred file_type buckets, so a filter over n of them keeps n% of the corpus
+            builder.add_many(
+                [f"chunk_{i}" for i in range(rows)],
+                texts,
+                [{"file_type": f"type{i % 100}"} for i in range(rows)]
+            )
+            builder.save(f"{temp_dir}/bm25")
+            build_seconds = time.perf_counter() - start_time
+            
+            index = InvertedIndex(f"{temp_dir}/bm25")
+            exhaustive_latencies, exhaustive_hits = time_queries(
+                lambda query: index.search(query, args.k, exhaustive=True), queries
+            )
+            pruned_latencies, pruned_hits = time_queries(lambda query: index.search(query, args.k), queries)
+            
+            agreement = np.mean([
+                np.allclose([score for _, score in pruned], [score for _, score in exhaustive])
+                for pruned, exhaustive in zip(pruned_hits, exhaustive_hits)
+            ])
+            
+            print(f"\n{rows} chunks, vocab {args.vocab}, {args.queries} queries, k={args.k}, build {build_seconds:.1f}s")
+            report("exhaustive", exhaustive_latencies)
+            report("block-max", pruned_latencies, agreement)
+        
+            for percent in [int(value) for value in args.filters.split(",") if value]:
+                where = {"file_type": {"$in": [f"type{i}" for i in range(percent)]}}
+                filtered_latencies, _ = time_queries(lambda query: index.search(query, args.k, where=where), queries)
+                report(f"filter {percent}%", filtered_latencies)
+        
+        if args.full_scan and BM25Okapi is not None:
+            bm25 = BM25Okapi([analyzer.analyze(text) for text in texts])
+            
+            def full_scan(query):
+                scores = bm25.get_scores(analyzer.analyze(query))
+                return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:args.k]
+            
+            scan_latencies, _ = time_queries(full_scan, queries[:20])
+            report("full scan", scan_latencies)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+import argparse
+import statistics
+import tempfile
+import time
+import numpy as np
+import chromadb
+from chromadb.config import Settings as ChromaSettings
+from app.database.backends import NumpyVectorBackend
+
+
+def build(collection, ids, vectors, metadatas, batch_size):
+    start_time = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        collection.upsert(
+            ids=ids[i:i + batch_size],
+            embeddings=vectors[i:i + batch_size].tolist(),
+            metadatas=metadatas[i:i + batch_size]
+        )
+    return time.perf_counter() - start_time
+
+
+def run_queries(collection, queries, k, where=None):
+    latencies = []
+    hits = []
+    for query in queries:
+        start_time = time.perf_counter()
+        results = collection.query(query_embeddings=[query.tolist()], n_results=k, where=where)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        hits.append(results['ids'][0])
+    return latencies, hits
+
+
+def report(name, build_seconds, latencies, recall):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<8} build {build_seconds:7.2f}s | query p50 {statistics.median(latencies):7.2f}ms "
+        f"p95 {p95:7.2f}ms | recall@k {recall:.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the exact NumPy vector backend with Chroma's HNSW")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    ids = [f"chunk_{i}" for i in range(args.rows)]
+    file_types = np.array(["pdf", "docx", "xlsx", "text"])
+    metadatas = [{"file_type": str(file_types[i % 4]), "chunk_index": i} for i in range(args.rows)]
+    
+    for label, where in (("all", None), ("filtered", {"file_type": "pdf"})):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            numpy_backend = NumpyVectorBackend(f"{temp_dir}/numpy", initial_capacity=args.rows)
+            numpy_build = build(numpy_backend, ids, vectors, metadatas, args.batch_size)
+            numpy_latencies, exact_hits = run_queries(numpy_backend, queries, args.k, where)
+            
+            client = chromadb.PersistentClient(path=f"{temp_dir}/chroma", settings=ChromaSettings(anonymized_telemetry=False))
+            chroma = client.create_collection(name="benchmark", metadata={"hnsw:space": "cosine"})
+            chroma_build = build(chroma, ids, vectors, metadatas, min(args.batch_size, client.max_batch_size))
+            chroma_latencies, chroma_hits = run_queries(chroma, queries, args.k, where)
+            
+            recall = np.mean([
+                len(set(found) & set(exact)) / len(exact)
+                for found, exact in zip(chroma_hits, exact_hits)
+            ])
+            
+            print(f"\n{args.rows} rows x {args.dim} dims, {args.queries} queries, k={args.k}, {label}")
+            report("numpy", numpy_build, numpy_latencies, 1.0)
+            report("chroma", chroma_build, chroma_latencies, recall)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -64,4 +64,136 @@ def test_list_documents_endpoint():
     assert response.status_code == 200
     data = response.json()
     assert "total" in data
-    assert "documents" in data
\ No newline at end of file
+    assert "documents" in data
+
+
+def test_batch_query_endpoint():
+    response = client.post("/api/query/batch", json={
+        "queries": ["first test query", "second test query", ""],
+        "top_k": 3
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_queries"] == 3
+    assert len(data["responses"]) == 3
+    assert data["responses"][0]["query"] == "first test query"
+    assert data["responses"][2]["success"] is False
+
+
+def test_batch_query_endpoint_requires_queries():
+    response = client.post("/api/query/batch", json={"queries": []})
+    assert response.status_code == 422
+
+
+def test_query_endpoint_serves_cached_response_with_etag(monkeypatch):
+    import hashlib
+    import tempfile
+    from app.config import settings
+    from app.core import cache as cache_module
+    from app.api import query as query_module
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "cache_dir", temp_dir)
+        monkeypatch.setattr(settings, "cache_enabled", True)
+        monkeypatch.setattr(settings, "semantic_cache_enabled", False)
+        monkeypatch.setattr(settings, "enable_hybrid_search", True)
+        cache = cache_module.CacheManager()
+        monkeypatch.setattr(query_module, "cache_manager", cache)
+        generation = [0]
+        monkeypatch.setattr(query_module.vector_store, "applied_generation", lambda: generation[0])
+        
+        calls = []
+        result = {'chunk_id': "doc_chunk_0", 'document_id': "doc", 'content': "Refunds within 30 days", 'score': 0.9}
+        monkeypatch.setattr(
+            query_module.hybrid_search, "hybrid_retrieve_timed",
+            lambda **kwargs: calls.append(kwargs) or ([dict(result)], {})
+        )
+        payload = {"query": "refund policy", "top_k": 5, "enable_reranking": False}
+        
+        first = client.post("/api/query", json=payload)
+        assert first.status_code == 200
+        assert first.json()['results'][0]['chunk_id'] == "doc_chunk_0"
+        assert first.headers["x-cache"] == "miss"
+        assert first.headers["etag"].startswith("W/")
+        
+        # Hits replay the stored bytes without the timings measured when it was filled
+        second = client.post("/api/query", json=payload)
+        assert second.headers["x-cache"] == "hit"
+        assert second.json()['results'] == first.json()['results']
+        assert second.json()['processing_time'] == 0.0 and second.json()['timings'] is None
+        assert second.headers["etag"] == f'"{hashlib.md5(second.content).hexdigest()}"'
+        assert first.headers["etag"] == f"W/{second.headers['etag']}"
+        assert len(calls) == 1
+        
+        not_modified = client.post("/api/query", json=payload, headers={"If-None-Match": first.headers["etag"]})
+        assert not_modified.status_code == 304
+        assert len(calls) == 1
+        
+        # Other parameters and index writes produce a different fingerprint
+        other = client.post("/api/query", json={**payload, "top_k": 3})
+        assert other.headers["x-cache"] == "miss"
+        generation[0] += 1
+        refreshed = client.post("/api/query", json=payload, headers={"If-None-Match": first.headers["etag"]})
+        assert refreshed.status_code == 200
+        assert refreshed.headers["x-cache"] == "miss"
+        assert len(calls) == 3
+        
+        # A rerank that fell back to retrieval order is served, but never cached as a reranked response
+        async def timed_out_rerank(query, results):
+            return results, False
+        
+        monkeypatch.setattr(settings, "enable_reranking", True)
+        monkeypatch.setattr(query_module.reranker, "rerank_async", timed_out_rerank)
+        for _ in range(2):
+            fallback = client.post("/api/query", json={**payload, "enable_reranking": True})
+            assert fallback.json()['reranked'] is False
+            assert fallback.headers["x-cache"] == "bypass" and "etag" not in fallback.headers
+        assert len(calls) == 5
+        
+        # Zero hits leave nothing to rerank, so the reranked scope still caches them
+        monkeypatch.setattr(
+            query_module.hybrid_search, "hybrid_retrieve_timed",
+            lambda **kwargs: calls.append(kwargs) or ([], {})
+        )
+        for status in ("miss", "hit"):
+            empty = client.post("/api/query", json={**payload, "query": "unknown topic", "enable_reranking": True})
+            assert empty.json()['total_results'] == 0
+            assert empty.headers["x-cache"] == status
+        assert len(calls) == 6
+
+
+def test_query_endpoint_files_semantic_results_under_the_request_generation(monkeypatch):
+    import tempfile
+    from app.config import settings
+    from app.core import cache as cache_module
+    from app.api import query as query_module
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "cache_dir", temp_dir)
+        monkeypatch.setattr(settings, "cache_enabled", True)
+        monkeypatch.setattr(settings, "semantic_cache_enabled", True)
+        monkeypatch.setattr(settings, "enable_hybrid_search", True)
+        cache = cache_module.CacheManager()
+        monkeypatch.setattr(query_module, "cache_manager", cache)
+        monkeypatch.setattr(query_module.text_embedder, "embed_text", lambda query: [1.0, 0.0])
+        generation = [0]
+        monkeypatch.setattr(query_module.vector_store, "applied_generation", lambda: generation[0])
+        
+        calls = []
+        result = {'chunk_id': "doc_chunk_0", 'document_id': "doc", 'content': "Refunds within 30 days", 'score': 0.9}
+        
+        # An index write lands while the first request is still searching
+        def retrieve_then_write(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                generation[0] += 1
+            return [dict(result)], {}
+        
+        monkeypatch.setattr(query_module.hybrid_search, "hybrid_retrieve_timed", retrieve_then_write)
+        payload = {"query": "refund policy", "top_k": 5, "enable_reranking": False}
+        
+        assert client.post("/api/query", json=payload).headers["x-cache"] == "miss"
+        # The pre-write results were filed under the old generation, so the reworded query searches again
+        assert client.post("/api/query", json={**payload, "query": "refunds policy"}).headers["x-cache"] == "miss"
+        assert client.post("/api/query", json={**payload, "query": "policy on refunds"}).headers["x-cache"] == "semantic"
+        assert len(calls) == 2
\ No newline at end of file
@@ -67,4 +67,110 @@ def test_chunking():
     chunks = chunk_text(text, method="sentences")
     
     assert len(chunks) > 0
-    assert all(isinstance(chunk, tuple) for chunk in chunks)
\ No newline at end of file
+    assert all(isinstance(chunk, tuple) for chunk in chunks)
+
+
+def test_chunk_spans_offsets():
+    from app.utils.chunking import TextChunker, WhitespaceTokenizer
+    
+    text = "First sentence here. Second one follows!\n\nNew paragraph with several more words in it."
+    chunker = TextChunker(chunk_size=6, chunk_overlap=1, tokenizer=WhitespaceTokenizer())
+    spans = chunker.chunk_spans(text)
+    
+    assert len(spans) > 1
+    for start_char, end_char, token_count in spans:
+        assert 0 < token_count <= 6
+        assert text[start_char:end_char] == text[start_char:end_char].strip()
+    
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(text)
+
+
+def test_chunk_budget_policies():
+    from app.utils.chunking import ChunkBudget, TextChunker, WhitespaceTokenizer
+    
+    text = " ".join(f"Row {i} has value {i * 3}." for i in range(400))
+    
+    for policy in ["grow", "summarize", "truncate"]:
+        chunker = TextChunker(chunk_size=50, chunk_overlap=5, tokenizer=WhitespaceTokenizer("text-embedding-3-small"))
+        chunks, spans, report = ChunkBudget(max_chunks=5, chunker=chunker).apply(text, policy=policy)
+        
+        assert len(chunks) <= 5
+        assert len(spans) == len(chunks)
+        assert report['original_chunks'] > 5
+        assert report['final_chunks'] == len(chunks)
+        assert report['applied'] == policy
+    
+        assert report['text_dropped'] == (policy != "grow")
+    
+    # No known model limit: growing stops at the configured size, and the tail is dropped and reported
+    chunker = TextChunker(chunk_size=50, chunk_overlap=5, tokenizer=WhitespaceTokenizer())
+    chunks, spans, report = ChunkBudget(max_chunks=5, chunker=chunker).apply(text, policy="grow")
+    assert report['applied'] == 'grow+truncate'
+    assert report['chunk_size'] == 50
+    assert all(token_count <= 50 for _, _, token_count in spans)
+    # The kept chunks are the original text, not lead-sentence summaries
+    assert chunks == [text[start:end] for start, end, _ in spans]
+    assert report['text_dropped'] and report['dropped_chars'] == len(text) - spans[-1][1]
+
+
+def test_upload_ingestion_cleans_up_after_failure(monkeypatch):
+    from app.config import settings
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "upload_dir", temp_dir)
+        monkeypatch.setattr(settings, "persist_uploads", True)
+        
+        with pytest.raises(ValueError):
+            document_ingestion.ingest_upload(b"   ", "empty.txt")
+        assert os.listdir(temp_dir) == []
+        
+        monkeypatch.setattr(settings, "persist_uploads", False)
+        doc_id, metadata = document_ingestion.ingest_upload(
+            b"An upload that is only held in memory.", "note.txt", tenant="acme"
+        )
+        assert metadata['file_path'] is None
+        assert metadata['tenant'] == "acme"
+        assert os.listdir(temp_dir) == []
+        document_ingestion.delete_document(doc_id)
+
+
+def test_batch_flush_failure_rolls_back_buffered_documents(monkeypatch):
+    from app.config import settings
+    from app.core import ingestion as ingestion_module
+    from app.database.metadata_store import metadata_store
+    from app.database.vector_store import BulkVectorWriter
+    
+    class FlakyStore:
+        def __init__(self):
+            self.written = []
+            self.deleted = []
+        
+        def upsert_batch(self, texts, embeddings, metadatas, ids):
+            if self.written:
+                raise RuntimeError("vector store unavailable")
+            self.written.extend(ids)
+        
+        def delete_by_document(self, document_id):
+            self.deleted.append(document_id)
+    
+    store = FlakyStore()
+    monkeypatch.setattr(ingestion_module, "vector_store", store)
+    monkeypatch.setattr(settings, "persist_uploads", False)
+    writer = BulkVectorWriter(store, batch_size=1000)
+    
+    doc_ids = [
+        document_ingestion.ingest_upload(f"Document number {i} for the batch.".encode(), f"doc{i}.txt", writer=writer)[0]
+        for i in range(3)
+    ]
+    writer.batch_size = 1
+    stats, flush_errors = document_ingestion.flush_writer(writer)
+    
+    # The first document made it to the store; the other two were still buffered when the write failed
+    assert store.written == [f"{doc_ids[0]}_chunk_0"]
+    assert set(flush_errors) == set(doc_ids[1:])
+    assert store.deleted == doc_ids[1:]
+    assert stats['pending'] == 0
+    assert metadata_store.get_document(doc_ids[0]) is not None
+    assert all(metadata_store.get_document(doc_id) is None for doc_id in doc_ids[1:])
+    metadata_store.delete_document(doc_ids[0])
\ No newline at end of file
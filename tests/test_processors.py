@@ -0,0 +1,109 @@
+import pytest
+import tempfile
+import os
+from app.processors.text_processor import text_processor
+from app.processors.pdf_processor import pdf_processor
+from app.processors.docx_processor import docx_processor
+from app.processors.xlsx_processor import xlsx_processor
+from app.processors.registry import processor_registry
+from app.processors.source import DocumentSource
+
+
+def _write_temp(data: bytes, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(mode='wb', suffix=suffix, delete=False) as f:
+        f.write(data)
+        return f.name
+
+
+def test_registry_resolves_by_extension():
+    processor, proc_type = processor_registry.resolve('report.docx')
+    assert proc_type == 'docx'
+    
+    processor, proc_type = processor_registry.resolve('notes.md')
+    assert proc_type == 'text'
+    
+    processor, proc_type = processor_registry.resolve('archive.zip')
+    assert processor is None
+
+
+def test_registry_sniffs_misnamed_file():
+    import fitz
+    
+    doc = fitz.open()
+    doc.new_page()
+    temp_path = _write_temp(doc.tobytes(), '.txt')
+    
+    try:
+        processor, proc_type = processor_registry.resolve(temp_path)
+        assert proc_type == 'pdf'
+        
+        is_valid, error = processor_registry.preflight(temp_path, proc_type)
+        assert is_valid
+        assert error is None
+    finally:
+        os.unlink(temp_path)
+
+
+def test_preflight_rejects_corrupt_files():
+    temp_path = _write_temp(b'%PDF-1.7\n1 0 obj', '.pdf')
+    
+    try:
+        is_valid, error = processor_registry.preflight(temp_path, 'pdf')
+        assert not is_valid
+        assert 'truncated' in error
+    finally:
+        os.unlink(temp_path)
+    
+    temp_path = _write_temp(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 512, '.docx')
+    
+    try:
+        is_valid, error = processor_registry.preflight(temp_path, 'docx')
+        assert not is_valid
+        assert 'encrypted' in error
+    finally:
+        os.unlink(temp_path)
+
+
+def test_processors_accept_in_memory_source():
+    import io
+    from openpyxl import Workbook
+    
+    wb = Workbook()
+    wb.active.append(["region", "revenue"])
+    wb.active.append(["north", 42])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    
+    source = DocumentSource.from_bytes(buffer.getvalue(), filename="sales.xlsx")
+    chunks, metadata = xlsx_processor.process(source)
+    
+    assert any("north | 42" in chunk for chunk in chunks)
+    assert metadata['filename'] == "sales.xlsx"
+    assert metadata['num_sheets'] == 1
+    
+    source = DocumentSource.from_bytes(b"plain text body. second sentence.", filename="notes.txt")
+    chunks, metadata = text_processor.process(source)
+    
+    assert metadata['total_characters'] == len("plain text body. second sentence.")
+
+
+def test_processors_close_only_sources_they_open(monkeypatch):
+    closed = []
+    original_close = DocumentSource.close
+    
+    def recording_close(self):
+        closed.append(self.filename)
+        original_close(self)
+    
+    monkeypatch.setattr(DocumentSource, "close", recording_close)
+    temp_path = _write_temp(b"mapped text body. second sentence.", ".txt")
+    try:
+        text_processor.process(temp_path)
+        assert closed == [os.path.basename(temp_path)]
+        
+        source = DocumentSource.from_bytes(b"caller owned body.", filename="owned.txt")
+        text_processor.process(source)
+        assert closed == [os.path.basename(temp_path)]
+        assert source.head(6) == b"caller"
+    finally:
+        os.unlink(temp_path)
\ No newline at end of file
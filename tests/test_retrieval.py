@@ -4,6 +4,24 @@ from app.core.embeddings import text_embedder
 from app.database.vector_store import vector_store
 
 
+@pytest.fixture
+def numpy_store(monkeypatch):
+    # An empty exact-search store in a scratch directory, wired into the retrieval and hybrid search modules
+    import tempfile
+    from app.config import settings
+    from app.core import hybrid_search as hybrid_module
+    from app.core import retrieval as retrieval_module
+    from app.database.vector_store import VectorStore
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        store = VectorStore()
+        monkeypatch.setattr(hybrid_module, "vector_store", store)
+        monkeypatch.setattr(retrieval_module, "vector_store", store)
+        yield store
+
+
 def test_text_embedder():
     text = "This is a test sentence for embedding."
     embedding = text_embedder.embed_text(text)
@@ -51,4 +69,1041 @@ def test_cache_operations():
     retrieved = cache_manager.get(test_key)
     assert retrieved == test_value
     
-    cache_manager.clear()
\ No newline at end of file
+    cache_manager.clear()
+
+
+def test_bulk_writer_upserts_in_batches():
+    from app.database.vector_store import BulkVectorWriter
+    
+    class RecordingStore:
+        def __init__(self):
+            self.batches = []
+        
+        def upsert_batch(self, texts, embeddings, metadatas, ids):
+            self.batches.append(list(ids))
+    
+    store = RecordingStore()
+    ids = [f"doc_chunk_{i}" for i in range(5)]
+    texts = [f"chunk {i}" for i in range(5)]
+    embeddings = [[float(i)] * 4 for i in range(5)]
+    metadatas = [{"document_id": "doc", "chunk_index": i} for i in range(5)]
+    
+    writer = BulkVectorWriter(store, batch_size=2)
+    writer.add(texts, embeddings, metadatas, ids)
+    assert writer.pending == 1
+    assert store.batches == [ids[0:2], ids[2:4]]
+    
+    stats = writer.flush()
+    
+    assert stats['pending'] == 0
+    assert stats['rows_written'] == 5
+    assert stats['batches_written'] == 3
+    assert store.batches[-1] == ids[4:]
+
+
+def test_numpy_backend_exact_search():
+    import tempfile
+    from app.database.backends import NumpyVectorBackend
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        backend = NumpyVectorBackend(temp_dir, initial_capacity=2)
+        backend.upsert(
+            ids=["a", "b", "c"],
+            embeddings=[[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]],
+            metadatas=[{"file_type": "pdf"}, {"file_type": "text"}, {"file_type": "pdf"}],
+            documents=["alpha", "beta", "gamma"]
+        )
+        
+        results = backend.query(query_embeddings=[[1.0, 0.1]], n_results=2)
+        assert results['ids'] == [["a", "c"]]
+        assert results['distances'][0][0] < results['distances'][0][1]
+        
+        results = backend.query(query_embeddings=[[1.0, 0.1]], n_results=5, where={"file_type": {"$in": ["text"]}})
+        assert results['ids'] == [["b"]]
+        
+        backend.delete(ids=["a"])
+        reopened = NumpyVectorBackend(temp_dir)
+        
+        assert reopened.count() == 2
+        assert reopened.get(where={"file_type": "pdf"})['documents'] == ["gamma"]
+        
+        reopened.compact()
+        assert reopened.get()['ids'] == ["b", "c"]
+
+
+def test_document_chunk_paging_and_window(monkeypatch):
+    import tempfile
+    from app.config import settings
+    from app.database.vector_store import VectorStore
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        store = VectorStore()
+        
+        # Written out of order to check sorting by chunk_index
+        order = [3, 0, 4, 1, 2]
+        store.upsert_batch(
+            texts=[f"chunk {i}" for i in order],
+            embeddings=[[1.0, float(i)] for i in order],
+            metadatas=[{"document_id": "doc", "chunk_index": i} for i in order],
+            ids=[f"doc_chunk_{i}" for i in order]
+        )
+        
+        chunks = store.get_document_chunks("doc", page_size=2)
+        assert [chunk['metadata']['chunk_index'] for chunk in chunks] == [0, 1, 2, 3, 4]
+        
+        window = store.get_chunk_window("doc", 0, window=1)
+        assert [chunk['id'] for chunk in window] == ["doc_chunk_0", "doc_chunk_1"]
+        
+        store.delete_document("doc_chunk_3")
+        window = store.get_chunk_window("doc", 3, window=1)
+        assert [chunk['id'] for chunk in window] == ["doc_chunk_2", "doc_chunk_4"]
+
+
+def test_document_delete_cascades_to_sparse_index(numpy_store):
+    import threading
+    from app.config import settings
+    from app.core import hybrid_search as hybrid_module
+    
+    numpy_store.upsert_batch(
+        texts=["apples and pears", "apples only", "bananas"],
+        embeddings=[[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]],
+        metadatas=[
+            {"document_id": "keep", "chunk_index": 0},
+            {"document_id": "gone", "chunk_index": 0},
+            {"document_id": "gone", "chunk_index": 1}
+        ],
+        ids=["keep_chunk_0", "gone_chunk_0", "gone_chunk_1"]
+    )
+        
+    search = hybrid_module.HybridSearch()
+    search.build_bm25_index()
+    assert {r['chunk_id'] for r in search.sparse_retrieval("apples")} == {"keep_chunk_0", "gone_chunk_0"}
+        
+    deleted = numpy_store.delete_by_document("gone")
+        
+    assert sorted(deleted) == ["gone_chunk_0", "gone_chunk_1"]
+    assert numpy_store.count() == 1
+    assert [r['chunk_id'] for r in search.sparse_retrieval("apples")] == ["keep_chunk_0"]
+    assert search.tombstone_ratio() > settings.compaction_tombstone_ratio
+        
+    numpy_store.compact()
+    search.compact()
+    assert numpy_store.tombstone_ratio() == 0.0
+    assert "keep_chunk_0" in search.index and len(search.index) == 1
+    
+    # A document delete waits for a rebuild or bulk flush holding the write lock instead of racing it
+    with numpy_store._write_lock:
+        deleter = threading.Thread(target=numpy_store.delete_by_document, args=("keep",))
+        deleter.start()
+        deleter.join(timeout=0.2)
+        assert deleter.is_alive() and numpy_store.count() == 1
+    deleter.join()
+    assert numpy_store.count() == 0 and len(search.index) == 0
+
+
+def test_sparse_index_updates_incrementally(numpy_store):
+    from app.core import hybrid_search as hybrid_module
+    
+    search = hybrid_module.HybridSearch()
+    numpy_store.upsert_batch(
+        texts=["kiwi kiwi salad", "kiwi and a long list of other fruit"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        metadatas=[{"document_id": "a", "chunk_index": 0}, {"document_id": "b", "chunk_index": 0}],
+        ids=["a_chunk_0", "b_chunk_0"]
+    )
+        
+    assert [r['chunk_id'] for r in search.sparse_retrieval("kiwi")] == ["a_chunk_0", "b_chunk_0"]
+        
+    numpy_store.upsert_batch(
+        texts=["mango salad"],
+        embeddings=[[0.5, 0.5]],
+        metadatas=[{"document_id": "a", "chunk_index": 0}],
+        ids=["a_chunk_0"]
+    )
+        
+    assert [r['chunk_id'] for r in search.sparse_retrieval("kiwi")] == ["b_chunk_0"]
+    assert [r['chunk_id'] for r in search.sparse_retrieval("mango")] == ["a_chunk_0"]
+    assert search.index.stats()['documents'] == 2
+    assert len(search.index.term_postings("kiwi")[0]) == 1
+    assert len(search.index.term_postings("salad")[0]) == 1
+        
+    numpy_store.delete_chunks(["b_chunk_0"])
+    assert search.sparse_retrieval("kiwi") == []
+    assert len(search.index.term_postings("kiwi")[0]) == 0
+
+
+def test_sparse_merge_runs_off_the_writing_thread(monkeypatch, numpy_store):
+    import threading
+    from app.config import settings
+    from app.core import hybrid_search as hybrid_module
+    from app.core.sparse_index import InvertedIndex
+    
+    search = hybrid_module.HybridSearch()
+    numpy_store.upsert_batch(["kiwi salad"], [[1.0, 0.0]], [{"document_id": "a", "chunk_index": 0}], ["a_chunk_0"])
+    search.ensure_index()
+    first_segment = search.state['segment']
+    
+    release = threading.Event()
+    original_save = InvertedIndex.save
+    
+    def blocked_save(self, path=None):
+        release.wait(5)
+        return original_save(self, path)
+    
+    monkeypatch.setattr(InvertedIndex, "save", blocked_save)
+    monkeypatch.setattr(settings, "sparse_flush_docs", 1)
+    
+    # The write returns while the merge is still running, and queries keep reading segment plus delta
+    numpy_store.upsert_batch(["mango salad"], [[0.0, 1.0]], [{"document_id": "b", "chunk_index": 0}], ["b_chunk_0"])
+    merge = search._flush_future
+    assert merge is not None and not merge.done()
+    assert [r['chunk_id'] for r in search.sparse_retrieval("mango")] == ["b_chunk_0"]
+    
+    release.set()
+    merge.result(timeout=5)
+    assert search.state['segment'] != first_segment
+    assert search.index.delta_size() == 0
+    assert {r['chunk_id'] for r in search.sparse_retrieval("salad")} == {"a_chunk_0", "b_chunk_0"}
+
+
+def test_sparse_index_persists_and_reopens(monkeypatch, numpy_store):
+    import numpy as np
+    from app.core import hybrid_search as hybrid_module
+    from app.core.sparse_index import InvertedIndex
+    
+    numpy_store.upsert_batch(
+        texts=[f"chunk {i} about topic{i % 3}" for i in range(30)],
+        embeddings=[[1.0, float(i)] for i in range(30)],
+        metadatas=[{"document_id": f"d{i}", "chunk_index": 0} for i in range(30)],
+        ids=[f"d{i}_chunk_0" for i in range(30)]
+    )
+        
+    search = hybrid_module.HybridSearch()
+    expected = search.sparse_retrieval("topic1", top_k=20)
+    assert len(expected) == 10
+        
+    numpy_store.delete_chunks(["d1_chunk_0"])
+    numpy_store.upsert_batch(texts=["topic1 topic1"], embeddings=[[0.0, 1.0]], metadatas=[{"document_id": "new"}], ids=["new_chunk_0"])
+    search.flush()
+    assert search.index.stats()['delta_documents'] == 0
+        
+    def fail_rebuild():
+        raise AssertionError("segment should be reopened, not rebuilt")
+        
+    reopened = hybrid_module.HybridSearch()
+    monkeypatch.setattr(reopened, "build_bm25_index", fail_rebuild)
+    results = reopened.sparse_retrieval("topic1", top_k=20)
+        
+    assert results[0]['chunk_id'] == "new_chunk_0"
+    assert "d1_chunk_0" not in {r['chunk_id'] for r in results}
+    assert len(results) == 10
+        
+    fresh = InvertedIndex()
+    for i in range(30):
+        if i != 1:
+            fresh.add(f"d{i}_chunk_0", f"chunk {i} about topic{i % 3}")
+    fresh.add("new_chunk_0", "topic1 topic1")
+        
+    assert [chunk_id for chunk_id, _ in fresh.search("topic1", 20)] == [r['chunk_id'] for r in results]
+    assert isinstance(reopened.index.segment.doc_gaps.base, np.memmap)
+
+
+def test_sparse_index_is_shared_between_workers(monkeypatch):
+    import tempfile
+    from app.config import settings
+    from app.core import hybrid_search as hybrid_module
+    from app.database.vector_store import VectorStore
+    
+    def ids(search, query):
+        return sorted(r['chunk_id'] for r in search.sparse_retrieval(query))
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        
+        # Each worker process has its own store handle and sparse index over the same directories
+        store_a = VectorStore()
+        monkeypatch.setattr(hybrid_module, "vector_store", store_a)
+        worker_a = hybrid_module.HybridSearch()
+        store_a.upsert_batch(texts=["alpha"], embeddings=[[1.0, 0.0]], metadatas=[{"document_id": "a"}], ids=["a_chunk_0"])
+        assert ids(worker_a, "alpha") == ["a_chunk_0"]
+        
+        store_b = VectorStore()
+        monkeypatch.setattr(hybrid_module, "vector_store", store_b)
+        worker_b = hybrid_module.HybridSearch()
+        
+        def fail_rebuild():
+            raise AssertionError("a published segment should be opened, not rebuilt")
+        
+        monkeypatch.setattr(worker_b, "build_bm25_index", fail_rebuild)
+        assert ids(worker_b, "alpha") == ["a_chunk_0"]
+        
+        store_b.upsert_batch(texts=["beta"], embeddings=[[0.0, 1.0]], metadatas=[{"document_id": "b"}], ids=["b_chunk_0"])
+        assert ids(worker_a, "beta") == ["b_chunk_0"]
+        
+        # Both workers flush; neither drops the postings the other ingested
+        worker_a.flush()
+        store_b.upsert_batch(texts=["gamma"], embeddings=[[0.5, 0.5]], metadatas=[{"document_id": "c"}], ids=["c_chunk_0"])
+        worker_b.flush()
+        for search in (worker_a, worker_b, hybrid_module.HybridSearch()):
+            assert [ids(search, term) for term in ("alpha", "beta", "gamma")] == [["a_chunk_0"], ["b_chunk_0"], ["c_chunk_0"]]
+        
+        # A write that never reaches the journal (e.g. a snapshot import) keeps the row count but bumps the generation
+        importer = VectorStore()
+        importer.upsert_batch(texts=["delta"], embeddings=[[1.0, 0.0]], metadatas=[{"document_id": "a"}], ids=["a_chunk_0"])
+        monkeypatch.setattr(hybrid_module, "vector_store", importer)
+        monkeypatch.setattr(settings, "sparse_sync_interval", 0.0)
+        reopened = hybrid_module.HybridSearch()
+        assert ids(reopened, "delta") == ["a_chunk_0"]
+        assert ids(reopened, "alpha") == []
+        assert ids(worker_a, "delta") == ["a_chunk_0"]
+        assert ids(worker_a, "alpha") == []
+
+
+def test_sharded_store_routes_and_merges(monkeypatch):
+    import tempfile
+    from app.config import settings
+    from app.database.vector_store import VectorStore
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        monkeypatch.setattr(settings, "shard_key", "file_type")
+        store = VectorStore()
+        
+        store.upsert_batch(
+            texts=["pdf near", "text nearest", "pdf far", "xlsx near"],
+            embeddings=[[1.0, 0.2], [1.0, 0.0], [0.0, 1.0], [1.0, 0.1]],
+            metadatas=[
+                {"document_id": "a", "file_type": "pdf", "chunk_index": 0},
+                {"document_id": "b", "file_type": "text", "chunk_index": 0},
+                {"document_id": "a", "file_type": "pdf", "chunk_index": 1},
+                {"document_id": "c", "file_type": "xlsx", "chunk_index": 0}
+            ],
+            ids=["a_chunk_0", "b_chunk_0", "a_chunk_1", "c_chunk_0"]
+        )
+        
+        assert len(store.shard_stats()) == 3
+        assert store.collection.route({"file_type": {"$in": ["pdf", "xlsx"]}}) == [
+            "multimodal_documents__pdf", "multimodal_documents__xlsx"
+        ]
+        
+        results = store.query([1.0, 0.0], n_results=3)
+        assert results['ids'][0] == ["b_chunk_0", "c_chunk_0", "a_chunk_0"]
+        
+        results = store.query([1.0, 0.0], n_results=3, where={"file_type": {"$in": ["pdf"]}})
+        assert results['ids'][0] == ["a_chunk_0", "a_chunk_1"]
+        
+        page = store.collection.get(limit=2, offset=1)
+        assert len(page['ids']) == 2
+        assert [chunk['id'] for chunk in store.get_document_chunks("a", page_size=1)] == ["a_chunk_0", "a_chunk_1"]
+        
+        # Changing the shard-key value moves the row rather than leaving a duplicate behind
+        store.upsert_batch(
+            texts=["xlsx near, now text"],
+            embeddings=[[1.0, 0.1]],
+            metadatas=[{"document_id": "c", "file_type": "text", "chunk_index": 0}],
+            ids=["c_chunk_0"]
+        )
+        assert store.count() == 4
+        assert store.shard_stats()["multimodal_documents__xlsx"] == 0
+        results = store.query([1.0, 0.0], n_results=4)
+        assert sorted(results['ids'][0]) == ["a_chunk_0", "a_chunk_1", "b_chunk_0", "c_chunk_0"]
+        
+        reopened = VectorStore()
+        assert reopened.count() == 4
+
+
+def test_tenant_queries_prune_shards_and_filter_both_legs(monkeypatch):
+    import tempfile
+    from app.config import settings
+    from app.core import cache as cache_module
+    from app.core import hybrid_search as hybrid_module
+    from app.core import retrieval as retrieval_module
+    from app.database.vector_store import VectorStore
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        monkeypatch.setattr(settings, "shard_key", "tenant")
+        monkeypatch.setattr(settings, "cache_dir", f"{temp_dir}/cache")
+        monkeypatch.setattr(settings, "cache_enabled", True)
+        store = VectorStore()
+        monkeypatch.setattr(hybrid_module, "vector_store", store)
+        monkeypatch.setattr(retrieval_module, "vector_store", store)
+        monkeypatch.setattr(retrieval_module, "cache_manager", cache_module.CacheManager())
+        monkeypatch.setattr(retrieval_module.text_embedder, "embed_text", lambda text: [1.0, 0.0])
+        
+        store.upsert_batch(
+            texts=["acme refund policy", "globex refund policy", "acme holiday schedule"],
+            embeddings=[[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]],
+            metadatas=[
+                {"document_id": "a", "tenant": "acme", "file_type": "text", "chunk_index": 0},
+                {"document_id": "g", "tenant": "globex", "file_type": "text", "chunk_index": 0},
+                {"document_id": "h", "tenant": "acme", "file_type": "pdf", "chunk_index": 0}
+            ],
+            ids=["a_chunk_0", "g_chunk_0", "h_chunk_0"]
+        )
+        
+        # Only the tenant's own shard is searched
+        where = retrieval_module.retrieval_system.where_filter(["text"], "acme")
+        assert store.collection.route(where) == ["multimodal_documents__acme"]
+        
+        search = hybrid_module.HybridSearch()
+        assert {r['chunk_id'] for r in search.hybrid_retrieve("refund policy", top_k=5, tenant="acme")} == {
+            "a_chunk_0", "h_chunk_0"
+        }
+        assert [r['chunk_id'] for r in search.hybrid_retrieve("refund policy", top_k=5, tenant="globex")] == ["g_chunk_0"]
+        assert [r['chunk_id'] for r in search.sparse_retrieval("refund", where=search.sparse_filter(["text"], "acme"))] == [
+            "a_chunk_0"
+        ]
+        
+        # Cached results never cross tenants
+        retrieval = retrieval_module.retrieval_system
+        assert {r['chunk_id'] for r in retrieval.retrieve("refund policy", top_k=5, tenant="acme")} == {"a_chunk_0", "h_chunk_0"}
+        assert [r['chunk_id'] for r in retrieval.retrieve("refund policy", top_k=5, tenant="globex")] == ["g_chunk_0"]
+
+
+def test_search_evaluation_on_exact_backend(monkeypatch):
+    import tempfile
+    import numpy as np
+    from app.config import settings
+    from app.database.vector_store import VectorStore
+    from app.database.search_eval import SearchEvaluator
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        store = VectorStore()
+        
+        vectors = np.random.default_rng(0).standard_normal((50, 8))
+        store.upsert_batch(
+            texts=[f"chunk {i}" for i in range(50)],
+            embeddings=vectors.tolist(),
+            metadatas=[{"document_id": f"doc{i}", "chunk_index": 0} for i in range(50)],
+            ids=[f"doc{i}_chunk_0" for i in range(50)]
+        )
+        
+        report = SearchEvaluator(store).evaluate(k=5, search_efs=[5, 20], sample_size=10)
+        
+        assert report['sample_size'] == 10
+        assert [point['search_ef'] for point in report['curve']] == [5, 20]
+        assert all(point['recall_at_k'] == 1.0 for point in report['curve'])
+        assert store.rebuild_collection(hnsw_m=32)['rebuilt'] == []
+
+
+def test_snapshot_export_restore_and_incremental(monkeypatch):
+    import os
+    import tempfile
+    import numpy as np
+    from app.config import settings
+    from app.database.vector_store import VectorStore
+    from app.database.metadata_store import MetadataStore
+    from app.database.snapshot import SnapshotManager
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "numpy")
+        monkeypatch.setattr(settings, "chroma_dir", os.path.join(temp_dir, "source"))
+        source = SnapshotManager(VectorStore(), MetadataStore())
+        
+        source.store.upsert_batch(
+            texts=["alpha \u00e9t\u00e9 \u2713", "beta", "gamma"],
+            embeddings=[[1.0, 0.0], [0.0, 1.0], [0.5, 0.5]],
+            metadatas=[{"document_id": "doc", "chunk_index": i} for i in range(3)],
+            ids=[f"doc_chunk_{i}" for i in range(3)]
+        )
+        source.metadata.add_document("doc", {"filename": "doc.txt", "file_type": "text"})
+        
+        full_path = os.path.join(temp_dir, "snap_full")
+        manifest = source.export(full_path, batch_size=2)
+        assert manifest['total_rows'] == 3
+        assert len(manifest['batches']) == 2
+        # Texts are one UTF-8 blob per batch rather than fixed-width strings padded to the longest chunk
+        with np.load(os.path.join(full_path, manifest['batches'][0]['file'])) as data:
+            assert data['documents'].dtype == np.uint8
+            assert data['documents_offsets'].tolist() == [0, 15, 19]
+        
+        source.store.upsert_batch(["beta v2"], [[0.0, 1.0]], [{"document_id": "doc", "chunk_index": 1}], ["doc_chunk_1"])
+        source.store.collection.delete(ids=["doc_chunk_2"])
+        
+        incremental_path = os.path.join(temp_dir, "snap_incremental")
+        manifest = source.export(incremental_path, base=full_path)
+        assert sum(batch['rows'] for batch in manifest['batches']) == 1
+        assert manifest['deleted_ids'] == ["doc_chunk_2"]
+        assert source.diff(full_path, incremental_path) == {
+            'added': [], 'removed': ["doc_chunk_2"], 'changed': ["doc_chunk_1"]
+        }
+        
+        monkeypatch.setattr(settings, "chroma_dir", os.path.join(temp_dir, "replica"))
+        replica = SnapshotManager(VectorStore(), MetadataStore())
+        result = replica.restore(incremental_path)
+        
+        assert result['documents'] == 1
+        assert replica.store.count() == 2
+        assert replica.store.get_document("doc_chunk_1")['document'] == "beta v2"
+        assert replica.store.get_document("doc_chunk_0")['document'] == "alpha \u00e9t\u00e9 \u2713"
+        assert replica.metadata.get_document("doc")['filename'] == "doc.txt"
+
+
+def test_pruned_sparse_search_matches_exhaustive():
+    import tempfile
+    import numpy as np
+    from app.core.sparse_index import InvertedIndex
+    
+    rng = np.random.default_rng(7)
+    vocab = np.array([f"t{i}" for i in range(400)])
+    weights = 1 / np.arange(1, 401)
+    weights /= weights.sum()
+    texts = [" ".join(rng.choice(vocab, size=rng.integers(5, 40), p=weights)) for _ in range(3000)]
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = InvertedIndex()
+        index.add_many([f"c{i}" for i in range(3000)], texts)
+        index.save(f"{temp_dir}/bm25")
+        index.remove([f"c{i}" for i in range(0, 3000, 5)])
+        index.add_many([f"new{i}" for i in range(50)], texts[:50])
+        
+        for _ in range(40):
+            query = " ".join(rng.choice(vocab, size=rng.integers(1, 5), p=weights))
+            pruned = index.search(query, top_k=10)
+            exhaustive = index.search(query, top_k=10, exhaustive=True)
+            
+            assert np.allclose([score for _, score in pruned], [score for _, score in exhaustive])
+            assert not {chunk_id for chunk_id, _ in pruned} & {f"c{i}" for i in range(0, 3000, 5)}
+
+
+def test_hybrid_legs_run_concurrently_and_degrade(monkeypatch, numpy_store):
+    import time
+    from app.config import settings
+    from app.core import hybrid_search as hybrid_module
+    
+    monkeypatch.setattr(settings, "hybrid_dense_timeout", 0.2)
+    numpy_store.upsert_batch(
+        texts=["quarterly revenue report", "holiday schedule"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        metadatas=[{"document_id": "a", "chunk_index": 0}, {"document_id": "b", "chunk_index": 0}],
+        ids=["a_chunk_0", "b_chunk_0"]
+    )
+    search = hybrid_module.HybridSearch()
+        
+    def slow_retrieve(**kwargs):
+        time.sleep(1.0)
+        return []
+        
+    monkeypatch.setattr(hybrid_module.retrieval_system, "retrieve", slow_retrieve)
+    start_time = time.perf_counter()
+    results, timings = search.hybrid_retrieve_timed("revenue", top_k=5)
+        
+    assert time.perf_counter() - start_time < 0.9
+    assert [r['chunk_id'] for r in results] == ["a_chunk_0"]
+    assert results[0]['content'] == "quarterly revenue report"
+    assert timings['dense_status'] == "timeout"
+    assert timings['sparse_status'] == "ok"
+    assert timings['sparse_ms'] >= 0
+        
+    def broken_retrieve(**kwargs):
+        raise RuntimeError("embedding service down")
+        
+    monkeypatch.setattr(hybrid_module.retrieval_system, "retrieve", broken_retrieve)
+    results, timings = search.hybrid_retrieve_timed("revenue", top_k=5)
+    assert timings['dense_status'] == "error"
+    assert [r['chunk_id'] for r in results] == ["a_chunk_0"]
+
+    # With a single leg thread the sparse leg queues behind the slow dense one and is cancelled, not left waiting
+    monkeypatch.setattr(settings, "hybrid_leg_workers", 1)
+    monkeypatch.setattr(settings, "hybrid_sparse_timeout", 0.3)
+    monkeypatch.setattr(hybrid_module.retrieval_system, "retrieve", slow_retrieve)
+    narrow = hybrid_module.HybridSearch()
+    results, timings = narrow.hybrid_retrieve_timed("revenue", top_k=5)
+    assert results == [] and timings['sparse_status'] == "timeout"
+    assert timings['legs_in_flight'] == 0 and timings['leg_workers'] == 1
+    
+    # The abandoned dense leg still holds the thread, which the next request reports
+    results, timings = narrow.hybrid_retrieve_timed("revenue", top_k=5)
+    assert timings['legs_in_flight'] == 1
+    assert timings['dense_status'] == timings['sparse_status'] == "timeout"
+
+
+def test_hybrid_fusion_hydrates_sparse_hits_in_one_call(monkeypatch, numpy_store):
+    from app.config import settings
+    from app.core import hybrid_search as hybrid_module
+    
+    numpy_store.upsert_batch(
+        texts=["invoice total due", "invoice archive", "team offsite"],
+        embeddings=[[1.0, 0.0], [0.7, 0.7], [0.0, 1.0]],
+        metadatas=[
+            {"document_id": "a", "chunk_index": 0, "filename": "a.pdf", "file_type": "pdf"},
+            {"document_id": "b", "chunk_index": 0, "filename": "b.txt", "file_type": "text"},
+            {"document_id": "c", "chunk_index": 0, "filename": "c.txt", "file_type": "text"}
+        ],
+        ids=["a_chunk_0", "b_chunk_0", "c_chunk_0"]
+    )
+    search = hybrid_module.HybridSearch()
+        
+    requested = []
+    lookups = []
+    get_documents = numpy_store.get_documents
+        
+    def dense_retrieve(**kwargs):
+        requested.append(kwargs['top_k'])
+        return [{'chunk_id': "c_chunk_0", 'content': "team offsite", 'score': 0.9, 'metadata': {}}]
+        
+    def counted_get_documents(ids):
+        lookups.append(list(ids))
+        return get_documents(ids)
+        
+    monkeypatch.setattr(hybrid_module.retrieval_system, "retrieve", dense_retrieve)
+    monkeypatch.setattr(numpy_store, "get_documents", counted_get_documents)
+        
+    results = search.hybrid_retrieve("invoice", top_k=3, fusion="rrf")
+        
+    assert requested == [3]
+    assert len(lookups) == 1 and sorted(lookups[0]) == ["a_chunk_0", "b_chunk_0"]
+    assert {r['chunk_id'] for r in results} == {"a_chunk_0", "b_chunk_0", "c_chunk_0"}
+    assert all(r['score'] <= 2 / (settings.rrf_k + 1) for r in results)
+    hydrated = next(r for r in results if r['chunk_id'] == "a_chunk_0")
+    assert hydrated['filename'] == "a.pdf" and hydrated['document_id'] == "a"
+        
+    results = search.hybrid_retrieve("invoice", top_k=1)
+    assert requested[-1] == 2
+    assert len(results) == 1
+
+    # A sparse hit the store no longer holds is replaced by the next candidate instead of shortening the page
+    numpy_store.collection.delete(ids=["b_chunk_0"])
+    lookups.clear()
+    results = search.hybrid_retrieve("invoice", top_k=2, fusion="rrf")
+    assert [r['chunk_id'] for r in results] == ["c_chunk_0", "a_chunk_0"]
+    assert lookups == [["b_chunk_0"], ["a_chunk_0"]]
+
+
+def test_sparse_filters_use_attribute_bitmaps(monkeypatch):
+    import tempfile
+    import numpy as np
+    from app.core import sparse_index
+    from app.core.sparse_index import InvertedIndex
+    
+    # Keep block-max pruning on for every filter so it is checked against exhaustive scoring
+    monkeypatch.setattr(sparse_index, "FILTER_PRUNING_RATIO", 0.0)
+    
+    rng = np.random.default_rng(11)
+    vocab = np.array([f"t{i}" for i in range(200)])
+    file_types = ["pdf", "text", "image", "audio"]
+    ids = [f"c{i}" for i in range(2000)]
+    texts = [" ".join(rng.choice(vocab, size=rng.integers(5, 30))) for _ in ids]
+    metadatas = [
+        {"file_type": file_types[i % 4 if i % 50 else 3], "document_id": f"doc{i // 100}", "upload_date": f"2024-01-{1 + i % 28:02d}"}
+        for i in range(len(ids))
+    ]
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = InvertedIndex()
+        index.add_many(ids, texts, metadatas)
+        index.save(f"{temp_dir}/bm25")
+        index.remove(ids[:100])
+        index.add_many(["new0", "new1"], ["t1 t2 t3", "t1 t2 t3"], [{"file_type": "pdf"}, {"file_type": "text"}])
+        
+        where_clauses = [
+            {"file_type": "pdf"},
+            {"file_type": {"$in": ["image", "audio"]}},
+            {"document_id": "doc3", "upload_date": {"$gte": "2024-01-10"}},
+            {"$or": [{"document_id": "doc1"}, {"upload_date": {"$lt": "2024-01-03"}}]}
+        ]
+        chunk_metadata = dict(zip(ids, metadatas))
+        chunk_metadata.update({"new0": {"file_type": "pdf"}, "new1": {"file_type": "text"}})
+        
+        for where in where_clauses:
+            for query in ["t1 t2 t3", "t5 t40", "t199"]:
+                pruned = index.search(query, top_k=10, where=where)
+                exhaustive = index.search(query, top_k=10, exhaustive=True, where=where)
+                assert np.allclose([score for _, score in pruned], [score for _, score in exhaustive])
+                assert not {chunk_id for chunk_id, _ in pruned} & set(ids[:100])
+        
+        pdf_hits = index.search("t1 t2 t3", top_k=50, where={"file_type": "pdf"})
+        assert pdf_hits and all(chunk_metadata[chunk_id]["file_type"] == "pdf" for chunk_id, _ in pdf_hits)
+        assert "new0" in dict(pdf_hits) and "new1" not in dict(pdf_hits)
+        
+        index.save()
+        reopened = InvertedIndex(f"{temp_dir}/bm25")
+        reopened_hits = reopened.search("t1 t2 t3", top_k=50, where={"file_type": "pdf"})
+        assert reopened_hits == reopened.search("t1 t2 t3", top_k=50, exhaustive=True, where={"file_type": "pdf"})
+        assert "new0" in dict(reopened_hits)
+        assert all(chunk_metadata[chunk_id]["file_type"] == "pdf" for chunk_id, _ in reopened_hits)
+        assert all(
+            chunk_metadata[chunk_id]["document_id"] == "doc5"
+            for chunk_id, _ in reopened.search("t1 t2", top_k=50, where={"document_id": "doc5"})
+        )
+
+
+def test_analyzer_normalizes_index_and_query_terms():
+    import tempfile
+    import pytest
+    from app.core.sparse_index import InvertedIndex
+    from app.utils.analyzer import Analyzer, STOPWORDS, light_stem
+    
+    analyzer = Analyzer(stopwords=STOPWORDS)
+    assert analyzer.analyze("The Report, reports' and REPORTS.") == ["report", "report", "report"]
+    # "-es" comes off whole only after a sibilant; other plurals, and words that merely end in "s", keep their stem
+    plurals = ["boxes", "classes", "processes", "churches", "wishes", "files", "houses", "sizes"]
+    assert [light_stem(word) for word in plurals] == ["box", "class", "process", "church", "wish", "file", "house", "size"]
+    assert [light_stem(word) for word in ["box", "class", "process", "file", "house"]] == ["box", "class", "process", "file", "house"]
+    assert [light_stem(word) for word in ["news", "series", "analysis", "status", "caches"]] == ["news", "series", "analysis", "status", "cache"]
+    assert analyzer.analyze("Companies' policies; café résumé") == ["company", "policy", "cafe", "resume"]
+    assert analyzer.analyze_query("quarterly reports") is analyzer.analyze_query("quarterly reports")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = InvertedIndex(analyzer=analyzer)
+        index.add_many(["a", "b"], ["Quarterly report, final.", "The holiday schedule"])
+        assert [chunk_id for chunk_id, _ in index.search("reports")] == ["a"]
+        assert index.search("the") == []
+        index.save(f"{temp_dir}/bm25")
+        
+        # Terms indexed under one analyzer would silently miss under another, so reopening refuses
+        with pytest.raises(ValueError):
+            InvertedIndex(f"{temp_dir}/bm25", analyzer=Analyzer(stemming=False))
+        assert [chunk_id for chunk_id, _ in InvertedIndex(f"{temp_dir}/bm25", analyzer=analyzer).search("Report")] == ["a"]
+
+
+def test_cross_encoder_rerank_batches_and_respects_budget(monkeypatch):
+    import asyncio
+    import time
+    import numpy as np
+    from app.core.reranking import Reranker
+    
+    class FakeScorer:
+        model_name = "fake-cross-encoder"
+        delay = 0.0
+        calls = []
+        
+        def load(self):
+            pass
+        
+        def score(self, query, passages):
+            self.calls.append(len(passages))
+            time.sleep(self.delay)
+            return np.array([passage.count(query) for passage in passages], dtype=float)
+    
+    reranker = Reranker()
+    reranker.enabled = True
+    reranker.backend = "cross_encoder"
+    reranker.cross_encoder = FakeScorer()
+    results = [
+        {"chunk_id": "a", "content": "budget", "score": 0.9},
+        {"chunk_id": "b", "content": "budget budget budget", "score": 0.5},
+        {"chunk_id": "c", "content": "budget budget", "score": 0.4}
+    ]
+    
+    ranked = reranker.rerank("budget", [dict(result) for result in results])
+    assert [result['chunk_id'] for result in ranked] == ["b", "c", "a"]
+    assert FakeScorer.calls == [3]
+    
+    # Past the latency budget the retrieval order comes back untouched
+    reranker.timeout = 0.05
+    reranker.cross_encoder.delay = 0.3
+    slow, applied = asyncio.run(reranker.rerank_async("budget", [dict(result) for result in results]))
+    assert not applied
+    assert [result['chunk_id'] for result in slow] == ["a", "b", "c"]
+    assert all('rerank_score' not in result for result in slow)
+    
+    # A model that cannot load hands over to term overlap
+    reranker.backend = "auto"
+    reranker.cross_encoder_available = False
+    fallback = reranker.rerank("budget", [dict(result) for result in results])
+    assert all('rerank_score' in result for result in fallback)
+
+
+def test_auto_rerank_skips_missing_model_and_awaits_fallback(monkeypatch):
+    import asyncio
+    from app.core.reranking import Reranker
+    
+    class MissingScorer:
+        model_name = "missing-cross-encoder"
+        local = False
+        
+        def is_local(self):
+            return self.local
+        
+        def load(self):
+            raise OSError("not downloaded")
+    
+    reranker = Reranker()
+    reranker.enabled = True
+    reranker.backend = "auto"
+    reranker.use_openai = True
+    reranker.cross_encoder = MissingScorer()
+    
+    # auto never triggers a download, so warmup has nothing to load
+    assert reranker.select_backend() == "openai"
+    
+    async def openai_async(query, results):
+        return results[::-1], True
+    
+    def openai_sync(query, results):
+        raise AssertionError("the async path must not block on the sync client")
+    
+    monkeypatch.setattr(reranker, "rerank_with_openai_async", openai_async)
+    monkeypatch.setattr(reranker, "rerank_with_openai", openai_sync)
+    
+    # A model that looks local but fails to load falls back to the awaited OpenAI path
+    reranker.cross_encoder_local = None
+    reranker.cross_encoder.local = True
+    assert reranker.select_backend() == "cross_encoder"
+    results = [{"chunk_id": "a", "content": "x", "score": 0.9}, {"chunk_id": "b", "content": "y", "score": 0.5}]
+    ranked, applied = asyncio.run(reranker.rerank_async("x", results))
+    assert applied
+    assert [result['chunk_id'] for result in ranked] == ["b", "a"]
+    assert not reranker.cross_encoder_available
+
+
+def test_llm_rerank_listwise_single_call_and_cached(monkeypatch):
+    import asyncio
+    import json
+    import tempfile
+    import time
+    from app.config import settings
+    from app.core import cache as cache_module
+    from app.core import reranking as reranking_module
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "cache_dir", temp_dir)
+        monkeypatch.setattr(settings, "cache_enabled", True)
+        monkeypatch.setattr(reranking_module, "cache_manager", cache_module.CacheManager())
+        
+        reranker = reranking_module.Reranker()
+        reranker.enabled = True
+        reranker.use_openai = True
+        reranker.backend = "openai"
+        prompts = []
+        
+        async def fake_complete(client, prompt, max_tokens, json_output=False):
+            prompts.append(prompt)
+            await asyncio.sleep(0.1)
+            if json_output and "partial" in prompt:
+                return json.dumps({"2": 1})
+            if json_output:
+                return json.dumps({"1": 2, "2": 9, "3": 5})
+            return "8" if "second" in prompt else "1"
+        
+        monkeypatch.setattr(reranker, "_complete", fake_complete)
+        results = [
+            {"chunk_id": "a", "content": "first passage", "score": 0.9},
+            {"chunk_id": "b", "content": "second passage", "score": 0.5},
+            {"chunk_id": "c", "content": "third passage", "score": 0.4}
+        ]
+        
+        ranked, applied = asyncio.run(reranker.rerank_async("which passage", [dict(result) for result in results]))
+        assert applied
+        assert [result['chunk_id'] for result in ranked] == ["b", "c", "a"]
+        assert len(prompts) == 1 and "[3] third passage" in prompts[0]
+        
+        # Same query again: every score comes from the cache
+        cached = reranker.rerank("which passage", [dict(result) for result in results])
+        assert [result['chunk_id'] for result in cached] == ["b", "c", "a"]
+        assert len(prompts) == 1
+        
+        # A chunk re-ingested with new text is scored again rather than served its old score
+        edited = [dict(result, content="third passage, revised") if result['chunk_id'] == "c" else dict(result) for result in results]
+        reranker.rerank("which passage", edited)
+        assert len(prompts) == 2 and "[1] third passage, revised" in prompts[1] and "first" not in prompts[1]
+        
+        # Passages the model left out of its reply follow the scored ones instead of competing on retrieval scores
+        partial = reranker.rerank("partial query", [dict(result) for result in results])
+        assert [result['chunk_id'] for result in partial] == ["b", "a", "c"]
+        assert partial[0]['rerank_score'] == 0.1 and 'rerank_score' not in partial[1]
+        assert len(prompts) == 3
+        
+        # Pointwise calls run concurrently rather than one after another
+        reranker.llm_mode = "pointwise"
+        start_time = time.perf_counter()
+        pointwise, _ = asyncio.run(reranker.rerank_async("another query", [dict(result) for result in results]))
+        assert time.perf_counter() - start_time < 0.25
+        assert len(prompts) == 6
+        assert pointwise[0]['chunk_id'] == "b"
+
+
+def test_simple_rerank_uses_stored_term_vectors(monkeypatch, numpy_store):
+    from app.core import hybrid_search as hybrid_module
+    from app.core import reranking as reranking_module
+    
+    texts = ["Budget report for the quarter.", "Holiday schedule", "Quarterly budget, budget reports"]
+    numpy_store.upsert_batch(
+        texts=texts[:2],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+        metadatas=[{"document_id": "a"}, {"document_id": "b"}],
+        ids=["a", "b"]
+    )
+    search = hybrid_module.HybridSearch()
+    search.build_bm25_index()
+    # One chunk lives in the saved segment's forward vectors, the other only in the in-memory delta
+    numpy_store.upsert_batch(texts=texts[2:], embeddings=[[1.0, 1.0]], metadatas=[{"document_id": "c"}], ids=["c"])
+    monkeypatch.setattr(reranking_module, "hybrid_search", search)
+        
+    tfs, lengths, known = search.index.term_matrix(["a", "b", "c", "missing"], ["budget", "report"])
+    assert tfs.tolist() == [[1, 1], [0, 0], [2, 1], [0, 0]]
+    assert known.tolist() == [True, True, True, False]
+        
+    analyzed = []
+    original_analyze = reranking_module.analyzer.analyze
+    monkeypatch.setattr(reranking_module.analyzer, "analyze", lambda text: analyzed.append(text) or original_analyze(text))
+    results = [
+        {"chunk_id": "b", "content": texts[1], "score": 0.5},
+        {"chunk_id": "a", "content": texts[0], "score": 0.5},
+        {"chunk_id": "c", "content": texts[2], "score": 0.5},
+        {"chunk_id": "unindexed", "content": "budget memo", "score": 0.5}
+    ]
+    ranked = reranking_module.Reranker().simple_rerank("budget reports", results)
+        
+    assert [result['chunk_id'] for result in ranked][:2] == ["c", "a"]
+    assert ranked[-1]['chunk_id'] == "b"
+    assert "budget memo" in analyzed and not set(analyzed) & set(texts)
+
+
+def test_query_cache_keys_on_params_and_index_generation(monkeypatch, numpy_store):
+    from app.config import settings
+    from app.core import cache as cache_module
+    from app.core import retrieval as retrieval_module
+    
+    monkeypatch.setattr(settings, "cache_dir", f"{settings.chroma_dir}/cache")
+    monkeypatch.setattr(settings, "cache_enabled", True)
+    monkeypatch.setattr(retrieval_module, "cache_manager", cache_module.CacheManager())
+    monkeypatch.setattr(retrieval_module.text_embedder, "embed_text", lambda text: [1.0, 0.0])
+    retrieval = retrieval_module.RetrievalSystem()
+        
+    numpy_store.upsert_batch(
+        texts=["pdf chunk", "text chunk"],
+        embeddings=[[1.0, 0.0], [0.9, 0.1]],
+        metadatas=[{"document_id": "a", "file_type": "pdf"}, {"document_id": "b", "file_type": "text"}],
+        ids=["a_chunk_0", "b_chunk_0"]
+    )
+        
+    searches = []
+    original_query = numpy_store.query
+    monkeypatch.setattr(numpy_store, "query", lambda *args, **kwargs: searches.append(kwargs) or original_query(*args, **kwargs))
+        
+    assert len(retrieval.retrieve("chunks", top_k=2)) == 2
+    assert len(retrieval.retrieve("chunks", top_k=2)) == 2
+    assert len(searches) == 1
+        
+    # Different parameters are different cache entries
+    assert [r['chunk_id'] for r in retrieval.retrieve("chunks", top_k=2, file_types=["text"])] == ["b_chunk_0"]
+    assert len(retrieval.retrieve("chunks", top_k=1)) == 1
+    assert len(searches) == 3
+        
+    # Any write moves the generation on, so nothing cached before it is served again
+    numpy_store.delete_chunks(["b_chunk_0"])
+    assert [r['chunk_id'] for r in retrieval.retrieve("chunks", top_k=2)] == ["a_chunk_0"]
+    assert len(searches) == 4
+
+    # A write landing mid-search must not file the pre-write results under the new generation
+    def query_then_write(*args, **kwargs):
+        results = original_query(*args, **kwargs)
+        searches.append(kwargs)
+        numpy_store.applied_generations.increment()
+        return results
+    
+    monkeypatch.setattr(numpy_store, "query", query_then_write)
+    retrieval.retrieve("other chunks", top_k=2)
+    retrieval.retrieve("other chunks", top_k=2)
+    assert len(searches) == 6
+    
+    # The generation caches key on moves only after every write listener has applied the write
+    seen = []
+    
+    class Listener:
+        def on_upsert(self, ids, texts, metadatas):
+            seen.append(numpy_store.applied_generation())
+    
+    numpy_store.add_write_listener(Listener())
+    before = numpy_store.applied_generation()
+    numpy_store.upsert_batch(texts=["late chunk"], embeddings=[[1.0, 0.0]], metadatas=[{"document_id": "c"}], ids=["c_chunk_0"])
+    assert seen == [before]
+    assert numpy_store.applied_generation() == before + 1
+
+
+def test_semantic_cache_matches_close_queries_with_same_filters():
+    from app.core.cache import SemanticCache
+    
+    cache = SemanticCache(threshold=0.95, capacity=2)
+    scope = {'file_types': None, 'top_k': 5}
+    cache.set([1.0, 0.0, 0.0], scope, 0, ["refund policy"])
+    
+    # A reworded query within the threshold is served the earlier results
+    assert cache.get([0.99, 0.05, 0.0], scope, 0) == ["refund policy"]
+    assert cache.get([0.0, 1.0, 0.0], scope, 0) is None
+    # Filters must match exactly, however close the embeddings
+    assert cache.get([1.0, 0.0, 0.0], {'file_types': ["pdf"], 'top_k': 5}, 0) is None
+    # A newer index generation retires every entry
+    assert cache.get([1.0, 0.0, 0.0], scope, 1) is None
+    
+    cache.set([0.0, 1.0, 0.0], scope, 0, ["shipping"])
+    cache.set([0.0, 0.0, 1.0], scope, 0, ["returns"])
+    assert cache.get([1.0, 0.0, 0.0], scope, 0) is None
+    assert cache.get([0.0, 0.0, 2.0], scope, 0) == ["returns"]
+    
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['hits'] == 2 and stats['misses'] == 4
+    assert stats['hit_rate'] == 2 / 6
+
+
+def test_numpy_backend_log_stays_bounded():
+    import tempfile
+    import pytest
+    from app.database.backends import NumpyVectorBackend, VectorBackend
+    
+    with pytest.raises(TypeError):
+        VectorBackend()
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        backend = NumpyVectorBackend(temp_dir, initial_capacity=4)
+        ids = [f"chunk_{i}" for i in range(4)]
+        for version in range(20):
+            backend.upsert(ids, [[1.0, float(i)] for i in range(4)], [{"version": version}] * 4, [f"v{version}"] * 4)
+        backend.delete(ids=["chunk_1"])
+        
+        # Eighty overwrites were logged, but the file is rewritten before it exceeds two records per row
+        with open(backend.rows_path) as f:
+            assert sum(1 for _ in f) <= 8
+        
+        reopened = NumpyVectorBackend(temp_dir)
+        assert reopened.count() == 3
+        assert reopened.get(ids=["chunk_0", "chunk_1"])['ids'] == ["chunk_0"]
+        assert reopened.get(ids=["chunk_3"])['metadatas'] == [{"version": 19}]
+
+
+def test_chroma_rebuild_keeps_collection_when_swap_fails(monkeypatch):
+    import tempfile
+    import pytest
+    from chromadb.api.models.Collection import Collection
+    from app.config import settings
+    from app.database.vector_store import VectorStore
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setattr(settings, "vector_backend", "chroma")
+        monkeypatch.setattr(settings, "chroma_dir", temp_dir)
+        store = VectorStore()
+        store.upsert_batch(
+            texts=["first", "second"],
+            embeddings=[[1.0, 0.0], [0.0, 1.0]],
+            metadatas=[{"document_id": "a"}, {"document_id": "b"}],
+            ids=["a_chunk_0", "b_chunk_0"]
+        )
+        
+        original_modify = Collection.modify
+        
+        def failing_modify(collection, name=None, metadata=None):
+            if collection.name.startswith("rebuild_"):
+                raise RuntimeError("rename failed")
+            return original_modify(collection, name=name, metadata=metadata)
+        
+        monkeypatch.setattr(Collection, "modify", failing_modify)
+        with pytest.raises(RuntimeError):
+            store.rebuild_collection(hnsw_m=32)
+        assert store.count() == 2
+        assert settings.collection_name in store.list_collections()
+        
+        monkeypatch.setattr(Collection, "modify", original_modify)
+        assert store.rebuild_collection(hnsw_m=32)['hnsw_params']['hnsw:M'] == 32
+        assert store.count() == 2
+        assert sorted(store.list_collections()) == [settings.collection_name]
\ No newline at end of file